@@ -0,0 +1,1403 @@
+"""
+Load test offline untuk bot kencan.
+
+Membangun ConversationHandler yang sama persis dengan `main()` (lewat
+`register_handlers`), tetapi dengan Bot palsu yang tidak pernah menyentuh jaringan,
+lalu memutar aliran Update sintetis:
+
+    registrasi (/start -> GENDER -> ... -> DESCRIPTION), tombol menu, dan badai
+    callback `match_like_*` / `match_dislike_*`.
+
+Hasilnya berupa throughput, latensi p50/p95/p99 per handler, serta pembagian waktu
+database vs. waktu Telegram API, dan ditulis sebagai JSON agar bisa dibandingkan antar run.
+
+Contoh:
+    python loadtest.py --users 200 --swipes 50 --output loadtest_results.json
+
+Dengan `--scoring-benchmark N`, yang diukur hanya CompatibilityScorer: N kandidat
+sintetis diberi skor dengan NumPy dan dengan Python murni.
+
+Dengan `--filter-benchmark N`, yang diukur hanya pengambilan kandidat dengan filter
+usia/gender/kata kunci pada database berisi N profil sintetis.
+
+Dengan `--pool-benchmark`, load test di atas dijalankan pada 1, 8 dan 64 pengguna bersamaan,
+dengan pool koneksi dan dengan satu koneksi bersama, untuk membandingkan latensi p50/p99.
+
+Dengan `--geo-benchmark N`, yang diukur hanya pencarian kandidat terdekat pada N profil
+sintetis yang mengelompok di beberapa kota (termasuk satu kota di garis bujur ±180).
+
+Dengan `--deck-benchmark N`, latensi per swipe lewat deck kandidat dibandingkan dengan
+query `ORDER BY RANDOM()` lama pada database berisi N profil sintetis.
+
+Dengan `--admission-check`, badai tombol (`--mash` pada kartu yang sama dan `--mash-distinct`
+pada banyak kartu berbeda) dijalankan dengan dan tanpa pembatasan per pengguna, lalu jumlah
+peminjaman pool.write()/pool.read(), swipe yang tertulis dan callback yang dijawab dibandingkan.
+Keluar dengan status 1 jika pembatasan menghilangkan swipe normal, tidak mengurangi penulisan
+dan peminjaman koneksi, atau membiarkan callback tidak dijawab.
+
+Dengan `--restart-check`, bot di-restart pada file database yang sama setelah `--users`
+pengguna terdaftar. Keluar dengan status 1 jika percakapan yang tersimpan lebih dari yang
+sedang berjalan (registrasi dan edit profil) atau ada pengguna yang tidak bisa melanjutkan.
+
+Dengan `--outbox-check`, yang diperiksa hanya antrean pesan keluar (rate limit global dan
+per chat, prioritas, RetryAfter, close()) dengan waktu kirim yang dicatat oleh Bot palsu.
+Keluar dengan status 1 jika ada pelanggaran.
+
+Dengan `--shards N`, bot dijalankan sebagai N proses worker (lihat "Sharding Multi-Proses"
+di telegram_bot_2025.py) dan update dikirim lewat ShardRouter, sama seperti mode produksi.
+Jumlah match yang tercatat di semua shard dibandingkan dengan jumlah mutual like yang
+diharapkan, sehingga like lintas shard yang hilang langsung terlihat:
+    python loadtest.py --shards 4 --users 2000 --swipes 20 --unthrottled
+Dengan `--restart-shard`, worker 0 dijalankan ulang di tengah fase swipe; keluar dengan
+status 1 jika ada match, swipe, atau update yang hilang.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from telegram import Bot, Update
+from telegram.ext import Application
+from telegram.request import BaseRequest, RequestData
+
+import telegram_bot_2025 as bot_module
+
+logger = logging.getLogger("loadtest")
+
+FAKE_TOKEN = "123456:LOADTEST"
+BOT_USER = {"id": 123456, "is_bot": True, "first_name": "LoadTest", "username": "loadtest_bot"}
+
+
+class FakeRequest(BaseRequest):
+    """
+    Pengganti HTTP client Bot API. Setiap panggilan dijawab dengan respons minimal
+    yang valid setelah jeda `latency` detik, dan durasinya dicatat per method.
+
+    Dengan `record=True`, setiap panggilan dicatat sebagai (waktu, method, chat_id, berhasil).
+    Nilai di `floods` dipakai satu per satu untuk menjawab panggilan berikutnya dengan
+    429 Too Many Requests dan `retry_after` sebesar nilai tersebut.
+    """
+
+    def __init__(self, latency: float = 0.0, record: bool = False):
+        self.latency = latency
+        self.api_time = 0.0
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.record = record
+        self.log: List[Tuple[float, str, Optional[int], bool]] = []
+        self.floods: List[int] = []
+        self._message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return None
+
+    async def do_request(
+        self,
+        url: str,
+        method: str,
+        request_data: Optional[RequestData] = None,
+        read_timeout: Any = None,
+        write_timeout: Any = None,
+        connect_timeout: Any = None,
+        pool_timeout: Any = None,
+    ) -> Tuple[int, bytes]:
+        started = time.perf_counter()
+        api_method = url.rsplit("/", 1)[-1]
+        params = request_data.parameters if request_data is not None else {}
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if api_method != "getMe" and self.floods:
+            retry_after = self.floods.pop(0)
+            if self.record:
+                self.log.append((time.monotonic(), api_method, params.get("chat_id"), False))
+            body = {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {retry_after}",
+                "parameters": {"retry_after": retry_after},
+            }
+            return 429, json.dumps(body).encode()
+
+        if api_method == "getMe":
+            result: Any = BOT_USER
+        elif api_method in ("sendMessage", "sendPhoto", "editMessageCaption", "editMessageText"):
+            self._message_id += 1
+            chat_id = int(params.get("chat_id", 0))
+            result = {
+                "message_id": params.get("message_id", self._message_id),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+        else:
+            result = True
+
+        self.calls[api_method] += 1
+        self.api_time += time.perf_counter() - started
+        if self.record:
+            self.log.append((time.monotonic(), api_method, params.get("chat_id"), True))
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class UpdateFactory:
+    """Membuat Update sintetis dalam format JSON Bot API."""
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> Dict[str, Any]:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def message(self, user_id: int, **content: Any) -> Update:
+        update_id = self._next_id()
+        data = {
+            "update_id": update_id,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                **content,
+            },
+        }
+        return Update.de_json(data, self.bot)
+
+    def command(self, user_id: int, command: str) -> Update:
+        return self.message(
+            user_id, text=command, entities=[{"type": "bot_command", "offset": 0, "length": len(command.split()[0])}]
+        )
+
+    def text(self, user_id: int, text: str) -> Update:
+        return self.message(user_id, text=text)
+
+    def location(self, user_id: int, latitude: float, longitude: float) -> Update:
+        return self.message(user_id, location={"latitude": latitude, "longitude": longitude})
+
+    def photo(self, user_id: int) -> Update:
+        size = {"file_id": f"photo-{user_id}", "file_unique_id": f"u{user_id}", "width": 640, "height": 640}
+        return self.message(user_id, photo=[size])
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = self._next_id()
+        payload = {
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "caption": "kartu profil",
+                },
+            },
+        }
+        return Update.de_json(payload, self.bot)
+
+
+def apply_limits(app: Application, args: argparse.Namespace) -> None:
+    """Menerapkan --unthrottled dan --no-admission pada Application yang sudah diinisialisasi."""
+    if args.unthrottled:
+        # Mengukur kapasitas bot sendiri, bukan batas kecepatan Telegram maupun per pengguna.
+        outbox = app.bot_data["outbox"]
+        outbox.global_bucket = bot_module.TokenBucket(1_000_000, 1_000_000)
+        outbox.chat_rate = outbox.chat_burst = 1_000_000
+        outbox.edit_rate = outbox.edit_burst = 1_000_000
+        if not getattr(args, "admission_limits", False):
+            admission = app.bot_data["admission"]
+            admission.rate = admission.burst = 1_000_000
+    if args.no_admission:
+        del app.bot_data["admission"]
+
+
+def registration_steps(factory: "UpdateFactory", user_id: int) -> List[Tuple[str, Update]]:
+    """Update registrasi satu pengguna, dari /start sampai deskripsi."""
+    # Pengguna disebar di sekitar beberapa kota agar pencarian radius ikut teruji.
+    city_lat, city_lon = [(-6.2, 106.8), (-7.25, 112.75), (-6.9, 107.6)][user_id % 3]
+    offset = (user_id % 100) / 1000
+    return [
+        ("start", factory.command(user_id, "/start")),
+        ("gender", factory.text(user_id, "Pria" if user_id % 2 else "Wanita")),
+        ("age", factory.text(user_id, str(18 + user_id % 40))),
+        ("hobby", factory.text(user_id, "Membaca")),
+        ("location", factory.location(user_id, city_lat + offset, city_lon + offset)),
+        ("photo", factory.photo(user_id)),
+        ("description", factory.text(user_id, f"Halo, saya pengguna {user_id}.")),
+    ]
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.request = FakeRequest(latency=args.api_latency_ms / 1000)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.db_time = 0.0
+        self.db_ops: Dict[str, int] = defaultdict(int)
+        self.job_stats: Dict[str, Dict[str, float]] = {}
+        self.admission_stats: Dict[str, int] = {}
+        self.pool_stats: Dict[str, Dict[str, float]] = {}
+        self.swipes_written = 0
+
+    def _instrument_pool(self, pool: "bot_module.DatabasePool") -> None:
+        """Mencatat lama setiap koneksi dipinjam sebagai waktu database."""
+        for name in ("read", "write"):
+            acquire = getattr(pool, name)
+
+            @asynccontextmanager
+            async def timed(acquire=acquire, name=name):
+                self.db_ops[name] += 1
+                async with acquire() as db:
+                    started = time.perf_counter()
+                    try:
+                        yield db
+                    finally:
+                        self.db_time += time.perf_counter() - started
+
+            setattr(pool, name, timed)
+
+    async def _process(self, app: Application, label: str, update: Update) -> None:
+        started = time.perf_counter()
+        await app.process_update(update)
+        self.latencies[label].append(time.perf_counter() - started)
+
+    async def _simulate_user(self, app: Application, factory: UpdateFactory, user_id: int) -> None:
+        args = self.args
+        steps = registration_steps(factory, user_id)
+        steps.append(("my_profile", factory.text(user_id, "Profil Saya 👤")))
+        # Sebagian pengguna mencari dengan filter usia (lewat indeks), sisanya tanpa filter.
+        if user_id % 4 == 0:
+            steps.append(("filter", factory.command(user_id, "/filter usia 20-45")))
+        steps.append(("find_match", factory.text(user_id, "Cari Pasangan 💘")))
+        for label, update in steps:
+            await self._process(app, label, update)
+
+        for i in range(args.swipes):
+            match_id = app.user_data[user_id].get("potential_match_id")
+            if match_id is None:
+                break
+            if args.swipe_interval_ms:
+                await asyncio.sleep(args.swipe_interval_ms / 1000)
+            action = "like" if (user_id + i) % 3 else "dislike"
+            await self._process(app, "match_choice", factory.callback(user_id, f"match_{action}_{match_id}"))
+
+        # Badai tombol: kartu yang sedang tampil ditekan berkali-kali sekaligus.
+        match_id = app.user_data[user_id].get("potential_match_id")
+        if args.mash and match_id is not None:
+            await asyncio.gather(*(
+                self._process(app, "mash", factory.callback(user_id, f"match_like_{match_id}"))
+                for _ in range(args.mash)
+            ))
+        # Badai kartu berbeda: callback buatan (misal dari skrip) untuk banyak pengguna lain sekaligus.
+        # Setiap tekanan adalah swipe baru, jadi deduplikasi tidak berlaku; hanya rate limit.
+        if getattr(args, "mash_distinct", 0):
+            first_id = 1_000_000
+            targets = [first_id + (user_id - first_id + args.users // 2 + k) % args.users for k in range(args.mash_distinct)]
+            await asyncio.gather(*(
+                self._process(app, "mash_distinct", factory.callback(user_id, f"match_like_{target}"))
+                for target in targets
+                if target != user_id
+            ))
+
+        # Membuka daftar match dan like masuk, lalu satu halaman berikutnya.
+        await self._process(app, "show_matches", factory.text(user_id, "Match Saya 💞"))
+        await self._process(app, "show_likes", factory.text(user_id, "Yang Menyukai Saya 😍"))
+        date, last_id = bot_module.LIST_FIRST_CURSOR
+        await self._process(app, "list_page", factory.callback(user_id, f"list_likes_o_{date}_{last_id}"))
+
+    async def _run_background_jobs(self, app: Application) -> None:
+        """Menjalankan pemeliharaan dan precompute terus-menerus selama trafik berlangsung."""
+        while True:
+            await bot_module.run_job(app, "optimize_database", bot_module.optimize_database)
+            await bot_module.run_job(app, "precompute_recommendations", bot_module.precompute_recommendations)
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        with tempfile.TemporaryDirectory() as tmp:
+            bot_module.DATABASE_FILE = os.path.join(tmp, "loadtest.db")
+            app = (
+                Application.builder()
+                .token(FAKE_TOKEN)
+                .request(self.request)
+                .get_updates_request(FakeRequest())
+                .persistence(bot_module.SQLitePersistence())
+                .build()
+            )
+            bot_module.register_handlers(app)
+            await app.initialize()
+            await bot_module.post_init(app)
+            if getattr(args, "single_connection", False):
+                # Seperti sebelum ada pool: semua query antre di satu koneksi.
+                pool = app.bot_data["pool"]
+                pool.read = pool.write
+            self._instrument_pool(app.bot_data["pool"])
+            apply_limits(app, args)
+
+            factory = UpdateFactory(app.bot)
+            user_ids = [1_000_000 + i for i in range(args.users)]
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def run_user(user_id: int) -> None:
+                async with semaphore:
+                    await self._simulate_user(app, factory, user_id)
+
+            jobs = asyncio.create_task(self._run_background_jobs(app)) if args.background_jobs else None
+            started = time.perf_counter()
+            await asyncio.gather(*(run_user(user_id) for user_id in user_ids))
+            elapsed = time.perf_counter() - started
+            if jobs is not None:
+                jobs.cancel()
+                try:
+                    await jobs
+                except asyncio.CancelledError:
+                    pass
+            self.job_stats = app.bot_data["jobs"].stats()
+            self.pool_stats = app.bot_data["pool"].stats()
+            admission = app.bot_data.get("admission")
+            self.admission_stats = dict(admission.stats) if admission is not None else {}
+            # Swipe yang benar-benar tertulis, untuk dibandingkan dengan jumlah tombol yang ditekan.
+            await app.bot_data["swipes"].flush()
+            async with app.bot_data["pool"].read() as db:
+                async with db.execute("SELECT COUNT(*) FROM swipes") as cursor:
+                    (self.swipes_written,) = await cursor.fetchone()
+
+            await bot_module.post_shutdown(app)
+            await app.shutdown()
+
+        return self._report(elapsed)
+
+    def _report(self, elapsed: float) -> Dict[str, Any]:
+        def percentile(values: List[float], pct: float) -> float:
+            ordered = sorted(values)
+            index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+            return ordered[index] * 1000
+
+        total_updates = sum(len(v) for v in self.latencies.values())
+        handlers = {
+            label: {
+                "count": len(values),
+                "mean_ms": statistics.mean(values) * 1000,
+                "p50_ms": percentile(values, 50),
+                "p95_ms": percentile(values, 95),
+                "p99_ms": percentile(values, 99),
+            }
+            for label, values in self.latencies.items()
+        }
+        return {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": vars(self.args),
+            "elapsed_s": elapsed,
+            "updates": total_updates,
+            "throughput_updates_per_s": total_updates / elapsed if elapsed else 0.0,
+            "db_time_s": self.db_time,
+            "api_time_s": self.request.api_time,
+            "api_calls": dict(self.request.calls),
+            "db_ops": dict(self.db_ops),
+            "swipes_written": self.swipes_written,
+            "admission": self.admission_stats,
+            "handlers": handlers,
+            "jobs": self.job_stats,
+        }
+
+
+def benchmark_scoring(candidates: int, repeat: int = 20, top_k: int = 50) -> Dict[str, Any]:
+    """Membandingkan waktu skor dan top-k versi NumPy dengan versi Python murni."""
+    rng = random.Random(42)
+    hobbies = ["membaca", "musik", "hiking", "kopi", "film", "memasak", "game", "futsal"]
+    viewer = bot_module.ScoringProfile(1, 27, -6.2, 106.8, bot_module.hobby_signature("musik kopi film"))
+    features = bot_module.CandidateFeatures()
+    for user_id in range(2, candidates + 2):
+        swipes = rng.randint(0, 200)
+        features.append(
+            user_id,
+            rng.randint(18, 60) if rng.random() > 0.05 else None,
+            -6.2 + rng.uniform(-2, 2),
+            106.8 + rng.uniform(-2, 2),
+            " ".join(rng.sample(hobbies, rng.randint(1, 3))),
+            swipes,
+            rng.randint(0, swipes),
+            rng.random() < 0.01,
+        )
+
+    likes = bot_module.LikeIndex()
+    results: Dict[str, Any] = {"candidates": candidates, "repeat": repeat}
+    rankings = {}
+    for name, use_numpy in (("numpy", True), ("python", False)):
+        if use_numpy and bot_module.np is None:
+            continue
+        scorer = bot_module.CompatibilityScorer(likes, use_numpy=use_numpy, jitter=0.0)
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            rankings[name] = scorer.top_k(viewer, features, top_k)
+            timings.append(time.perf_counter() - started)
+        results[f"{name}_ms"] = statistics.median(timings) * 1000
+    if len(rankings) == 2:
+        results["same_top_k"] = rankings["numpy"] == rankings["python"]
+        results["speedup"] = results["python_ms"] / results["numpy_ms"]
+    return results
+
+
+FILTER_BENCHMARK_CASES: List[Tuple[str, "bot_module.MatchFilters"]] = [
+    ("age 25-30", bot_module.MatchFilters(25, 30)),
+    ("age 25-30 + gender", bot_module.MatchFilters(25, 30, "Wanita")),
+    ("age 40 + gender", bot_module.MatchFilters(40, 40, "Pria")),
+    ("keyword", bot_module.MatchFilters(keyword="hiking")),
+    ("keyword + age + gender", bot_module.MatchFilters(20, 35, "Pria", "kopi")),
+    ("keyword (2 words)", bot_module.MatchFilters(keyword="musik kopi")),
+]
+
+
+PROFILE_HOBBIES = ["membaca", "musik", "hiking", "kopi", "film", "memasak", "game", "futsal"]
+PROFILE_COLUMNS = ["user_id", "gender", "age", "hobby", "latitude", "longitude", "photo_id", "description", "last_active"]
+
+
+def uniform_location(rng: random.Random) -> Tuple[float, float]:
+    """Lokasi acak merata di sekitar Jakarta (±2 derajat)."""
+    return -6.2 + rng.uniform(-2, 2), 106.8 + rng.uniform(-2, 2)
+
+
+async def seed_profiles(
+    path: str, profiles: int, rng: random.Random, locate: Callable[[random.Random], Tuple[float, float]] = uniform_location
+) -> Tuple[float, "bot_module.SchemaFeatures"]:
+    """
+    Mengisi database `path` dengan `profiles` profil sintetis lewat jalur impor massal.
+    Mengembalikan lama pengisian (detik) dan indeks opsional yang tersedia.
+    """
+    words = PROFILE_HOBBIES + [f"kata{i}" for i in range(1000)]
+    now = bot_module.sql_timestamp(0)
+
+    def rows():
+        for user_id in range(1, profiles + 1):
+            latitude, longitude = locate(rng)
+            yield (
+                user_id,
+                rng.choice(bot_module.GENDER_OPTIONS),
+                rng.randint(18, 60),
+                " ".join(rng.sample(PROFILE_HOBBIES, rng.randint(1, 2))),
+                latitude,
+                longitude,
+                f"photo{user_id}",
+                " ".join(rng.choices(words, k=8)),
+                now,
+            )
+
+    db = await bot_module.aiosqlite.connect(path)
+    try:
+        started = time.perf_counter()
+        await bot_module._load_bulk_rows(db, "users", PROFILE_COLUMNS, rows())
+        seed_s = time.perf_counter() - started
+        features = await bot_module.create_tables(db)
+    finally:
+        await db.close()
+    return seed_s, features
+
+
+def open_decks(
+    pool: "bot_module.DatabasePool", features: "bot_module.SchemaFeatures", **kwargs: Any
+) -> "bot_module.CandidateDeckManager":
+    """CandidateDeckManager dengan konfigurasi yang sama seperti `setup_database`."""
+    likes = bot_module.LikeIndex()
+    return bot_module.CandidateDeckManager(
+        pool,
+        bot_module.SwipeBuffer(pool, likes, bot_module.SeenSetStore(pool)),
+        bot_module.ProfileCardCache(pool),
+        geo_enabled=features.geo,
+        search_enabled=features.search,
+        scorer=bot_module.CompatibilityScorer(likes),
+        **kwargs,
+    )
+
+
+def latency_summary(timings: List[float]) -> Dict[str, float]:
+    """p50/p95/p99 dalam milidetik."""
+    ordered = sorted(timings)
+
+    def percentile(pct: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))] * 1000
+
+    return {"p50_ms": percentile(50), "p95_ms": percentile(95), "p99_ms": percentile(99)}
+
+
+# Query find_match sebelum ada deck kandidat: full scan dan sort acak pada setiap swipe.
+LEGACY_FIND_MATCH_SQL = """
+    SELECT user_id, gender, age, hobby, description, photo_id
+    FROM users
+    WHERE user_id != ? AND user_id NOT IN (
+        SELECT swiped_id FROM swipes WHERE swiper_id = ?
+    )
+    ORDER BY RANDOM()
+    LIMIT 1
+"""
+
+
+async def benchmark_decks(
+    profiles: int, viewers: int = 20, swipes: int = 100, history: int = 200, legacy_repeat: int = 20
+) -> Dict[str, Any]:
+    """
+    Membandingkan latensi per swipe antara deck kandidat dan query ORDER BY RANDOM() lama
+    pada database berisi `profiles` profil sintetis.
+
+    Setiap viewer sudah punya `history` swipe. Satu swipe lewat deck = kandidat berikutnya
+    (termasuk pengisian ulang deck bila habis) + mencatat swipe; p99 memuat biaya pengisian
+    ulang. Satu swipe lama = query lama + INSERT swipe + commit.
+    """
+    rng = random.Random(42)
+    results: Dict[str, Any] = {"profiles": profiles, "viewers": viewers, "history": history}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "decks.db")
+        results["seed_s"], features = await seed_profiles(path, profiles, rng)
+
+        pool = bot_module.DatabasePool(path)
+        await pool.open()
+        decks = open_decks(pool, features)
+        buffer = decks.swipes
+        viewer_ids = rng.sample(range(1, profiles + 1), viewers)
+        try:
+            for viewer in viewer_ids:
+                for swiped_id in rng.sample(range(1, profiles + 1), min(history, profiles - 1)):
+                    if swiped_id != viewer:
+                        await buffer.add(viewer, swiped_id, "dislike")
+            await buffer.flush()
+
+            timings = []
+            for i in range(swipes * viewers):
+                viewer = viewer_ids[i % viewers]
+                started = time.perf_counter()
+                candidate_id = await decks.next_candidate(viewer)
+                if candidate_id is not None:
+                    await buffer.add(viewer, candidate_id, "dislike")
+                    decks.mark_seen(viewer, candidate_id)
+                timings.append(time.perf_counter() - started)
+                # Memberi kesempatan pengisian ulang di background, seperti jeda antar swipe pengguna.
+                await asyncio.sleep(0)
+            results["deck"] = latency_summary(timings)
+            results["deck_fills"] = dict(decks.fill_stats)
+            await buffer.flush()
+
+            timings = []
+            async with pool.write() as db:
+                for i in range(legacy_repeat):
+                    viewer = viewer_ids[i % viewers]
+                    started = time.perf_counter()
+                    async with db.execute(LEGACY_FIND_MATCH_SQL, (viewer, viewer)) as cursor:
+                        row = await cursor.fetchone()
+                    await db.execute(
+                        "INSERT OR IGNORE INTO swipes (swiper_id, swiped_id, action) VALUES (?, ?, 'dislike')",
+                        (viewer, row[0]),
+                    )
+                    await db.commit()
+                    timings.append(time.perf_counter() - started)
+            results["order_by_random"] = latency_summary(timings)
+            results["speedup_p50"] = results["order_by_random"]["p50_ms"] / results["deck"]["p50_ms"]
+        finally:
+            decks.close()
+            await pool.close()
+    return results
+
+
+# Kota sintetis untuk --geo-benchmark: (nama, lat, lon, sebaran derajat, bobot). Fiji berada
+# tepat di garis bujur ±180, sehingga pencarian yang melewati garis tersebut ikut teruji.
+GEO_CITIES = [
+    ("jakarta", -6.2, 106.8, 0.15, 0.35),
+    ("surabaya", -7.25, 112.75, 0.1, 0.15),
+    ("bandung", -6.9, 107.6, 0.08, 0.1),
+    ("suva", -17.8, 179.99, 0.3, 0.1),
+]
+# Sisanya tersebar merata di pedesaan.
+GEO_RURAL_BOUNDS = (-10.0, 5.0, 95.0, 141.0)
+# Posisi viewer per kasus: pusat kota padat, pinggir kota, pedesaan, dan sisi barat garis bujur ±180.
+GEO_BENCHMARK_VIEWERS = [
+    ("dense city center", -6.2, 106.8),
+    ("city edge", -6.2, 107.3),
+    ("rural", 0.5, 120.0),
+    ("dateline", -17.8, -179.95),
+]
+
+
+def clustered_location(rng: random.Random) -> Tuple[float, float]:
+    """Lokasi acak: sebagian besar mengelompok di sekitar GEO_CITIES (sebaran normal), sisanya pedesaan."""
+    pick = rng.random()
+    for _, lat, lon, spread, weight in GEO_CITIES:
+        if pick < weight:
+            longitude = lon + rng.gauss(0, spread)
+            # Bujur di luar ±180 dibungkus ke sisi lain.
+            return lat + rng.gauss(0, spread), (longitude + 180.0) % 360.0 - 180.0
+        pick -= weight
+    min_lat, max_lat, min_lon, max_lon = GEO_RURAL_BOUNDS
+    return rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)
+
+
+async def benchmark_geo(profiles: int, repeat: int = 50) -> Dict[str, Any]:
+    """
+    Mengukur pengambilan kandidat terdekat pada `profiles` profil sintetis yang mengelompok
+    di beberapa kota. Untuk setiap posisi viewer dicatat latensi p50/p99, jarak kandidat
+    terjauh, dan berapa banyak kandidat yang sama dengan hasil brute force (haversine ke
+    semua profil) — 1.0 berarti hasilnya tepat kandidat terdekat.
+    """
+    rng = random.Random(42)
+    locations: List[Tuple[float, float]] = []
+
+    def locate(rng: random.Random) -> Tuple[float, float]:
+        location = clustered_location(rng)
+        locations.append(location)
+        return location
+
+    results: Dict[str, Any] = {"profiles": profiles, "repeat": repeat, "cases": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "geo.db")
+        results["seed_s"], features = await seed_profiles(path, profiles, rng, locate)
+        if not features.geo:
+            raise RuntimeError("SQLite was built without the R*Tree module")
+
+        pool = bot_module.DatabasePool(path)
+        await pool.open()
+        decks = open_decks(pool, features)
+        viewer = profiles + 1
+        seen = await decks.swipes.seen.get(viewer)
+        count = decks.deck_size * decks.rank_pool_factor
+        try:
+            async with pool.read() as conn:
+                for name, lat, lon in GEO_BENCHMARK_VIEWERS:
+                    timings = []
+                    for _ in range(repeat):
+                        started = time.perf_counter()
+                        batch = await decks._fetch_nearby_candidates(conn, viewer, lat, lon, set(), seen, count)
+                        timings.append(time.perf_counter() - started)
+                    nearest = sorted(
+                        range(1, profiles + 1),
+                        key=lambda user_id: bot_module.haversine_km(lat, lon, *locations[user_id - 1]),
+                    )[:count]
+                    farthest = max(
+                        (bot_module.haversine_km(lat, lon, *locations[user_id - 1]) for user_id in batch), default=0.0
+                    )
+                    results["cases"][name] = {
+                        **latency_summary(timings),
+                        "candidates": len(batch),
+                        "farthest_km": farthest,
+                        "same_as_brute_force": len(set(batch) & set(nearest)) / max(1, len(nearest)),
+                    }
+        finally:
+            decks.close()
+            await pool.close()
+    return results
+
+
+async def benchmark_filters(profiles: int, repeat: int = 50) -> Dict[str, Any]:
+    """
+    Mengukur pengambilan kandidat dengan filter (usia, gender, kata kunci) pada database
+    berisi `profiles` profil sintetis yang mengelompok di beberapa kota. Waktu diukur per
+    panggilan lewat aiosqlite, untuk satu deck (DECK_SIZE), untuk kumpulan kandidat sebelum
+    diberi skor (DECK_SIZE * FILTER_RANK_POOL_FACTOR), dan untuk kumpulan yang sama bagi
+    viewer di pusat kota padat: kandidat terdekat lebih dulu, sisanya dari indeks filter.
+    """
+    rng = random.Random(42)
+    results: Dict[str, Any] = {"profiles": profiles, "repeat": repeat, "cases": {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "filters.db")
+        results["seed_s"], features = await seed_profiles(path, profiles, rng, clustered_location)
+
+        pool = bot_module.DatabasePool(path)
+        await pool.open()
+        decks = open_decks(pool, features)
+        viewer = 1
+        viewer_seen = await decks.swipes.seen.get(viewer)
+        pool_size = decks.deck_size * min(decks.rank_pool_factor, bot_module.FILTER_RANK_POOL_FACTOR)
+        _, lat, lon = GEO_BENCHMARK_VIEWERS[0]
+
+        async def fetch(conn, match_filters, count: int, nearby: bool) -> List[int]:
+            batch: List[int] = []
+            if nearby:
+                batch = await decks._fetch_nearby_candidates(
+                    conn, viewer, lat, lon, set(), viewer_seen, count, match_filters
+                )
+            if len(batch) < count:
+                batch += await decks._fetch_filtered_candidates(
+                    conn, viewer, match_filters, set(batch), viewer_seen, count - len(batch)
+                )
+            return batch
+
+        try:
+            async with pool.read() as conn:
+                for name, match_filters in FILTER_BENCHMARK_CASES:
+                    case: Dict[str, Any] = {}
+                    for label, count, nearby in (
+                        ("deck", decks.deck_size, False),
+                        ("pool", pool_size, False),
+                        ("nearby_pool", pool_size, features.geo),
+                    ):
+                        timings, found = [], 0
+                        for _ in range(repeat):
+                            started = time.perf_counter()
+                            batch = await fetch(conn, match_filters, count, nearby)
+                            timings.append(time.perf_counter() - started)
+                            found += len(batch)
+                        timings.sort()
+                        case[f"{label}_p50_ms"] = statistics.median(timings) * 1000
+                        case[f"{label}_p95_ms"] = timings[int(len(timings) * 0.95) - 1] * 1000
+                        case[f"{label}_candidates"] = found / repeat
+                    results["cases"][name] = case
+        finally:
+            decks.close()
+            await pool.close()
+    return results
+
+
+POOL_BENCHMARK_CONCURRENCY = (1, 8, 64)
+POOL_BENCHMARK_HANDLERS = ("find_match", "match_choice", "my_profile", "show_matches")
+
+
+async def benchmark_pool(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Menjalankan load test biasa pada 1, 8 dan 64 pengguna bersamaan, sekali dengan pool
+    koneksi dan sekali dengan satu koneksi bersama (seperti sebelum ada pool), lalu
+    membandingkan latensi handler p50/p99 dan waktu tunggu koneksi.
+    """
+    results: Dict[str, Any] = {"users": args.users, "swipes": args.swipes, "runs": {}}
+    for concurrency in POOL_BENCHMARK_CONCURRENCY:
+        for mode, single in (("pool", False), ("single_connection", True)):
+            run_args = argparse.Namespace(**{**vars(args), "concurrency": concurrency, "single_connection": single})
+            test = LoadTest(run_args)
+            report = await test.run()
+            all_updates = [value for values in test.latencies.values() for value in values]
+            results["runs"][f"{mode} x{concurrency}"] = {
+                "throughput_updates_per_s": report["throughput_updates_per_s"],
+                "all": latency_summary(all_updates),
+                **{label: latency_summary(test.latencies[label]) for label in POOL_BENCHMARK_HANDLERS},
+                # Dengan satu koneksi bersama, semua query menunggu sebagai "write".
+                "pool_wait": test.pool_stats,
+            }
+    return results
+
+
+# Default untuk --admission-check: kartu berbeda yang ditekan sekaligus per pengguna, dan jeda
+# antar swipe biasa yang sedikit di bawah USER_RATE agar swipe normal tidak ikut dibatasi.
+ADMISSION_CHECK_MASH_DISTINCT = 60
+ADMISSION_CHECK_SWIPE_INTERVAL_MS = 1000 / bot_module.USER_RATE * 1.2
+
+
+async def check_admission(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Menjalankan badai tombol yang sama dua kali, dengan AdmissionController (batas bawaan)
+    dan tanpa, lalu membandingkan peminjaman koneksi pool (terutama pool.write()), swipe yang
+    tertulis, dan callback yang dijawab. Antrean pesan keluar tidak dibatasi pada kedua run.
+
+    Badai berisi tombol ❤️ kartu yang sama (`--mash`, dideduplikasi) dan banyak kartu berbeda
+    sekaligus (`--mash-distinct`, hanya bisa ditahan oleh rate limit). Pelanggaran dicatat di
+    `failures`: swipe normal yang hilang, callback yang tidak dijawab, atau admission yang tidak
+    mengurangi penulisan.
+    """
+    base = {
+        **vars(args),
+        "unthrottled": True,
+        "admission_limits": True,
+        "mash": args.mash or 5,
+        "mash_distinct": args.mash_distinct or ADMISSION_CHECK_MASH_DISTINCT,
+        "swipe_interval_ms": args.swipe_interval_ms or ADMISSION_CHECK_SWIPE_INTERVAL_MS,
+    }
+    failures: List[str] = []
+    results: Dict[str, Any] = {"failures": failures, "config": {key: base[key] for key in (
+        "users", "swipes", "mash", "mash_distinct", "swipe_interval_ms"
+    )}}
+    for mode, no_admission in (("admission", False), ("no_admission", True)):
+        test = LoadTest(argparse.Namespace(**{**base, "no_admission": no_admission}))
+        report = await test.run()
+        callbacks = sum(
+            report["handlers"].get(label, {}).get("count", 0)
+            for label in ("match_choice", "mash", "mash_distinct", "list_page")
+        )
+        results[mode] = {
+            "pool_write": report["db_ops"].get("write", 0),
+            "pool_read": report["db_ops"].get("read", 0),
+            "swipes_written": report["swipes_written"],
+            "callbacks": callbacks,
+            "callbacks_answered": report["api_calls"].get("answerCallbackQuery", 0),
+            "api_calls": sum(report["api_calls"].values()),
+            "admission": report["admission"],
+            "elapsed_s": round(report["elapsed_s"], 3),
+        }
+
+    on, off = results["admission"], results["no_admission"]
+    # Setiap pengguna melakukan `swipes` swipe normal, ditambah tepat satu dari badai kartu yang sama.
+    normal_swipes = args.users * (args.swipes + 1)
+    if on["swipes_written"] < normal_swipes:
+        failures.append(f"admission dropped normal swipes: {on['swipes_written']} written, expected at least {normal_swipes}")
+    # Swipe ditulis lewat SwipeBuffer, jadi jumlah pool.write() adalah jumlah flush dan nyaris sama
+    # pada kedua run; badai yang lolos terlihat dari baris swipe yang ikut ditulis dan dari
+    # peminjaman koneksi untuk membaca kartu berikutnya.
+    on_acquired, off_acquired = on["pool_write"] + on["pool_read"], off["pool_write"] + off["pool_read"]
+    if on_acquired >= off_acquired:
+        failures.append(f"admission did not reduce pool acquisitions: {on_acquired} vs {off_acquired} without it")
+    if on["swipes_written"] >= off["swipes_written"]:
+        failures.append(f"admission did not reduce swipes written: {on['swipes_written']} vs {off['swipes_written']} without it")
+    if on["callbacks_answered"] < on["callbacks"]:
+        failures.append(f"{on['callbacks'] - on['callbacks_answered']} callback queries were never answered")
+    return results
+
+
+async def check_restart(args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Mendaftarkan `--users` pengguna (separuh berhenti di MATCHING, separuh di MENU), satu
+    pengguna di tengah registrasi dan satu di tengah edit profil, lalu me-restart bot pada
+    file database yang sama. Yang dicatat di `failures`: baris percakapan tersimpan selain dua
+    percakapan yang sedang berjalan (waktu restart harus tetap datar), serta pengguna yang
+    setelah restart tidak bisa langsung melanjutkan (swipe, menu, registrasi, edit).
+    """
+    failures: List[str] = []
+    results: Dict[str, Any] = {"failures": failures, "users": args.users}
+    user_ids = [1_000_000 + i for i in range(max(args.users, 2))]
+    matching = set(user_ids[::2])
+    # Pengguna MENU yang membuka edit deskripsi, dan pengguna baru yang baru memilih gender.
+    editing, registering = user_ids[1], user_ids[0] - 1
+
+    async def start_bot(request: FakeRequest) -> Tuple[Application, float]:
+        started = time.perf_counter()
+        app = (
+            Application.builder()
+            .token(FAKE_TOKEN)
+            .request(request)
+            .get_updates_request(FakeRequest())
+            .persistence(bot_module.SQLitePersistence())
+            .build()
+        )
+        bot_module.register_handlers(app)
+        await app.initialize()
+        elapsed = time.perf_counter() - started
+        await bot_module.post_init(app)
+        apply_limits(app, argparse.Namespace(**{**vars(args), "unthrottled": True}))
+        return app, elapsed
+
+    async def stop_bot(app: Application) -> None:
+        await app.bot_data["swipes"].flush()
+        await bot_module.post_shutdown(app)
+        await app.shutdown()
+
+    async def query(sql: str, params: Tuple[Any, ...] = ()) -> List[Tuple[Any, ...]]:
+        async with bot_module.aiosqlite.connect(bot_module.DATABASE_FILE) as db:
+            async with db.execute(sql, params) as cursor:
+                return await cursor.fetchall()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        bot_module.DATABASE_FILE = os.path.join(tmp, "loadtest.db")
+        request = FakeRequest()
+        app, _ = await start_bot(request)
+        factory = UpdateFactory(app.bot)
+        for user_id in user_ids:
+            for _, update in registration_steps(factory, user_id):
+                await app.process_update(update)
+            if user_id in matching:
+                await app.process_update(factory.text(user_id, "Cari Pasangan 💘"))
+        cards = {user_id: app.user_data[user_id].get("potential_match_id") for user_id in matching}
+        await app.process_update(factory.callback(editing, "edit_description"))
+        for _, update in registration_steps(factory, registering)[:2]:
+            await app.process_update(update)
+        await stop_bot(app)
+
+        stored = await query("SELECT name, state FROM persisted_conversations")
+        results["stored_conversations"] = len(stored)
+        if len(stored) != 2:
+            failures.append(f"{len(stored)} conversation rows stored, expected 2 (one registration, one edit)")
+
+        request = FakeRequest()
+        app, results["initialize_s"] = await start_bot(request)
+        factory = UpdateFactory(app.bot)
+        (swipes_before,) = (await query("SELECT COUNT(*) FROM swipes"))[0]
+        for user_id, match_id in cards.items():
+            if match_id is not None:
+                await app.process_update(factory.callback(user_id, f"match_like_{match_id}"))
+        await app.bot_data["swipes"].flush()
+        (swipes_after,) = (await query("SELECT COUNT(*) FROM swipes"))[0]
+        expected_swipes = sum(match_id is not None for match_id in cards.values())
+        results["resumed_swipes"] = swipes_after - swipes_before
+        if swipes_after - swipes_before != expected_swipes:
+            failures.append(f"{swipes_after - swipes_before} of {expected_swipes} card buttons worked after the restart")
+
+        photos = request.calls["sendPhoto"]
+        menu_users = [user_id for user_id in user_ids if user_id not in matching and user_id != editing]
+        for user_id in menu_users:
+            await app.process_update(factory.text(user_id, "Profil Saya 👤"))
+        results["resumed_menus"] = request.calls["sendPhoto"] - photos
+        if request.calls["sendPhoto"] - photos != len(menu_users):
+            failures.append(f"{request.calls['sendPhoto'] - photos} of {len(menu_users)} menu buttons worked after the restart")
+
+        await app.process_update(factory.text(registering, "25"))
+        await app.process_update(factory.text(editing, "Deskripsi setelah restart"))
+        await stop_bot(app)
+        if await query("SELECT state FROM persisted_conversations WHERE name = 'main'") != [(json.dumps(bot_module.HOBBY),)]:
+            failures.append("registration did not continue after the restart")
+        if await query("SELECT 1 FROM users WHERE user_id = ? AND description = 'Deskripsi setelah restart'", (editing,)) != [(1,)]:
+            failures.append("profile edit did not continue after the restart")
+    return results
+
+
+OUTBOX_CHECK_CHATS = 12
+OUTBOX_CHECK_REPLIES_PER_CHAT = 6
+OUTBOX_CHECK_SWIPES_PER_CHAT = 8
+# Toleransi penjadwalan event loop saat membandingkan waktu kirim dengan batas rate.
+OUTBOX_CHECK_SLACK_S = 0.05
+
+
+def rate_violations(times: List[float], rate: float, burst: float) -> int:
+    """Jumlah jendela [t_i, t_j] yang berisi lebih banyak panggilan daripada `burst + rate * (t_j - t_i)`."""
+    times = sorted(times)
+    violations = 0
+    for i, start in enumerate(times):
+        for j in range(i, len(times)):
+            if j - i + 1 > burst + rate * (times[j] - start + OUTBOX_CHECK_SLACK_S):
+                violations += 1
+    return violations
+
+
+async def check_outbox() -> Dict[str, Any]:
+    """
+    Memeriksa MessageScheduler dengan Bot asli di atas FakeRequest yang mencatat waktu setiap
+    panggilan: batas rate global dan per chat, laju swipe (edit caption + kartu baru), prioritas balasan di atas notifikasi,
+    jeda RetryAfter, dan `close()` dengan pesan yang masih ditahan rate limit atau menunggu retry.
+    Setiap pelanggaran dicatat di `failures`.
+    """
+    request = FakeRequest(record=True)
+    bot = Bot(FAKE_TOKEN, request=request)
+    await bot.initialize()
+    failures: List[str] = []
+    results: Dict[str, Any] = {"failures": failures}
+
+    def sent_since(mark: int) -> List[Tuple[float, str, Optional[int], bool]]:
+        return [entry for entry in request.log[mark:] if entry[3]]
+
+    # 1. Batas rate: campuran balasan dan notifikasi ke beberapa chat, dengan rate produksi.
+    mark = len(request.log)
+    scheduler = bot_module.MessageScheduler()
+    scheduler.start()
+    started = time.monotonic()
+    replies = []
+    for chat_id in range(1, OUTBOX_CHECK_CHATS + 1):
+        for n in range(OUTBOX_CHECK_REPLIES_PER_CHAT):
+            replies.append(scheduler.send(bot.send_message, chat_id=chat_id, text=f"reply {n}"))
+        scheduler.notify(bot.send_message, chat_id=chat_id, text="notification")
+    await asyncio.gather(*replies)
+    await scheduler.close(timeout=30)
+    sent = sent_since(mark)
+    expected = OUTBOX_CHECK_CHATS * (OUTBOX_CHECK_REPLIES_PER_CHAT + 1)
+    global_violations = rate_violations(
+        [entry[0] for entry in sent], bot_module.OUTBOX_GLOBAL_RATE, bot_module.OUTBOX_GLOBAL_RATE
+    )
+    chat_violations = sum(
+        rate_violations(
+            [entry[0] for entry in sent if entry[2] == chat_id],
+            bot_module.OUTBOX_CHAT_RATE,
+            bot_module.OUTBOX_CHAT_BURST,
+        )
+        for chat_id in range(1, OUTBOX_CHECK_CHATS + 1)
+    )
+    results["rate_limits"] = {
+        "messages": len(sent),
+        "elapsed_s": round(time.monotonic() - started, 3),
+        "global_violations": global_violations,
+        "chat_violations": chat_violations,
+    }
+    if len(sent) != expected:
+        failures.append(f"rate_limits: {len(sent)} of {expected} messages delivered")
+    if global_violations:
+        failures.append(f"rate_limits: global rate exceeded in {global_violations} windows")
+    if chat_violations:
+        failures.append(f"rate_limits: per-chat rate exceeded in {chat_violations} windows")
+
+    # 2. Swipe: edit caption kartu lama lalu kirim kartu baru, berurutan per chat seperti handler.
+    #    Edit punya bucket per chat sendiri, jadi laju swipe mengikuti batas pesan baru (1/detik),
+    #    bukan setengahnya; pesan baru dan edit masing-masing tetap dalam batasnya.
+    mark = len(request.log)
+    scheduler = bot_module.MessageScheduler()
+    scheduler.start()
+    started = time.monotonic()
+
+    async def swipe(chat_id: int) -> None:
+        for n in range(OUTBOX_CHECK_SWIPES_PER_CHAT):
+            await scheduler.send(bot.edit_message_caption, chat_id=chat_id, message_id=n + 1, caption="liked")
+            await scheduler.send(bot.send_photo, chat_id=chat_id, photo="card", caption=f"card {n}")
+
+    chats = range(5001, 5001 + OUTBOX_CHECK_CHATS)
+    await asyncio.gather(*(swipe(chat_id) for chat_id in chats))
+    await scheduler.close(timeout=30)
+    elapsed = time.monotonic() - started
+    sent = sent_since(mark)
+    limits = {
+        "sendPhoto": (bot_module.OUTBOX_CHAT_RATE, bot_module.OUTBOX_CHAT_BURST),
+        "editMessageCaption": (bot_module.OUTBOX_CHAT_EDIT_RATE, bot_module.OUTBOX_CHAT_EDIT_BURST),
+    }
+    swipe_violations = {
+        api_method: sum(
+            rate_violations([entry[0] for entry in sent if entry[1] == api_method and entry[2] == chat_id], rate, burst)
+            for chat_id in chats
+        )
+        for api_method, (rate, burst) in limits.items()
+    }
+    swipe_violations["global"] = rate_violations(
+        [entry[0] for entry in sent], bot_module.OUTBOX_GLOBAL_RATE, bot_module.OUTBOX_GLOBAL_RATE
+    )
+    # Kartu baru adalah yang paling ketat: setelah burst habis, satu kartu per 1/OUTBOX_CHAT_RATE detik.
+    expected_s = (OUTBOX_CHECK_SWIPES_PER_CHAT - bot_module.OUTBOX_CHAT_BURST) / bot_module.OUTBOX_CHAT_RATE
+    results["swipes"] = {
+        "messages": len(sent),
+        "elapsed_s": round(elapsed, 3),
+        "expected_s": expected_s,
+        "violations": swipe_violations,
+    }
+    if len(sent) != 2 * OUTBOX_CHECK_CHATS * OUTBOX_CHECK_SWIPES_PER_CHAT:
+        failures.append(f"swipes: {len(sent)} of {2 * OUTBOX_CHECK_CHATS * OUTBOX_CHECK_SWIPES_PER_CHAT} calls delivered")
+    for api_method, violations in swipe_violations.items():
+        if violations:
+            failures.append(f"swipes: {api_method} rate exceeded in {violations} windows")
+    if elapsed > expected_s + 1:
+        failures.append(f"swipes: took {elapsed:.3f}s, expected about {expected_s}s at one swipe per second")
+
+    # 3. Prioritas: notifikasi masuk antrean lebih dulu, tetapi balasan harus terkirim lebih dulu.
+    mark = len(request.log)
+    scheduler = bot_module.MessageScheduler(workers=1)
+    for chat_id in range(1001, 1011):
+        scheduler.notify(bot.send_message, chat_id=chat_id, text="notification")
+    replies = [
+        asyncio.create_task(scheduler.send(bot.send_message, chat_id=chat_id, text="reply"))
+        for chat_id in range(2001, 2011)
+    ]
+    await asyncio.sleep(0)
+    scheduler.start()
+    await asyncio.gather(*replies)
+    await scheduler.close(timeout=5)
+    order = [entry[2] for entry in sent_since(mark)]
+    last_reply = max(i for i, chat_id in enumerate(order) if chat_id >= 2001)
+    first_notification = min(i for i, chat_id in enumerate(order) if chat_id < 2001)
+    results["priority"] = {"last_reply": last_reply, "first_notification": first_notification}
+    if last_reply > first_notification:
+        failures.append("priority: a notification was sent before an interactive reply")
+
+    # 4. RetryAfter: panggilan pertama dijawab 429; tidak ada yang dikirim sebelum jeda habis.
+    mark = len(request.log)
+    scheduler = bot_module.MessageScheduler(workers=1)
+    scheduler.start()
+    request.floods.append(1)
+    delivered = await asyncio.gather(
+        *(scheduler.send(bot.send_message, chat_id=chat_id, text="reply") for chat_id in range(3001, 3004))
+    )
+    await scheduler.close(timeout=5)
+    flooded_at = request.log[mark][0]
+    resumed_at = min(entry[0] for entry in sent_since(mark))
+    results["retry_after"] = {"paused_s": round(resumed_at - flooded_at, 3), **scheduler.stats}
+    if resumed_at - flooded_at < 1 - OUTBOX_CHECK_SLACK_S:
+        failures.append(f"retry_after: resumed after {resumed_at - flooded_at:.3f}s instead of 1s")
+    if len(delivered) != 3 or scheduler.stats["flood_waits"] != 1 or scheduler.stats["retried"] != 1:
+        failures.append(f"retry_after: unexpected stats {scheduler.stats}")
+
+    # 5. close(): pesan yang ditahan rate limit chat atau menunggu retry ikut ditunggu,
+    #    dan jika waktu habis dibatalkan, bukan dibiarkan menggantung.
+    for timeout in (0.3, 10.0):
+        mark = len(request.log)
+        scheduler = bot_module.MessageScheduler()
+        scheduler.start()
+        request.floods.append(2)
+        replies = [asyncio.create_task(scheduler.send(bot.send_message, chat_id=4001, text="retry"))]
+        await asyncio.sleep(0.05)
+        replies += [
+            asyncio.create_task(scheduler.send(bot.send_message, chat_id=4002, text=f"reply {n}"))
+            for n in range(OUTBOX_CHECK_REPLIES_PER_CHAT)
+        ]
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        await scheduler.close(timeout=timeout)
+        _, hanging = await asyncio.wait(replies, timeout=1)
+        cancelled = sum(task.cancelled() for task in replies if task.done())
+        delivered = len(sent_since(mark))
+        results[f"close_timeout_{timeout}"] = {
+            "elapsed_s": round(time.monotonic() - started, 3),
+            "delivered": delivered,
+            "cancelled": cancelled,
+            "hanging": len(hanging),
+        }
+        if hanging:
+            failures.append(f"close({timeout}): {len(hanging)} senders still waiting after close")
+        if timeout > 5 and (delivered != len(replies) or cancelled):
+            failures.append(f"close({timeout}): {delivered} of {len(replies)} messages delivered")
+        if timeout < 5 and cancelled == 0:
+            failures.append(f"close({timeout}): parked messages were sent instead of waiting")
+
+    await bot.shutdown()
+    return results
+
+
+def run_shard_worker(args: argparse.Namespace) -> None:
+    """Proses worker untuk `--shards`: bot lengkap dengan Bot API palsu, dijalankan oleh ShardedLoadTest."""
+    bot_module.DATABASE_FILE = os.path.join(args.socket_dir, "loadtest.db")
+    builder = Application.builder().token(FAKE_TOKEN).request(FakeRequest(latency=args.api_latency_ms / 1000))
+    app = bot_module.build_shard_application(args.shard_worker, args.shards, args.socket_dir, builder)
+    asyncio.run(bot_module.run_shard_worker(app, args.socket_dir, ready=lambda app: apply_limits(app, args)))
+
+
+class ShardedLoadTest:
+    """
+    Menjalankan `--shards` worker sebagai proses terpisah dan mengirim update lewat ShardRouter.
+
+    Fase registrasi dan fase swipe masing-masing diukur sampai semua worker selesai memproses
+    (termasuk pesan antar-shard). Setiap pengguna menyukai `--swipes` pengguna acak lain, sehingga
+    jumlah mutual like bisa dihitung di sini dan dibandingkan dengan tabel matches di semua shard.
+
+    Waktu CPU setiap shard per fase juga dicatat: di mesin dengan core sebanyak jumlah shard,
+    lama fase dibatasi oleh shard tersibuk, bukan oleh jumlah waktu CPU semua shard.
+
+    Dengan `--restart-shard`, worker 0 dihentikan (SIGTERM) dan dijalankan ulang di tengah fase
+    swipe. Match, swipe, atau update yang hilang dicatat di `failures`.
+    """
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.random = random.Random(0)
+
+    def _start_worker(self, socket_dir: str, index: int) -> subprocess.Popen:
+        args = self.args
+        command = [
+            sys.executable, os.path.abspath(__file__), "--shards", str(args.shards), "--socket-dir", socket_dir,
+            "--api-latency-ms", str(args.api_latency_ms),
+        ]
+        command += ["--unthrottled"] * args.unthrottled + ["--no-admission"] * args.no_admission
+        return subprocess.Popen(command + ["--shard-worker", str(index)])
+
+    @staticmethod
+    async def _drain(router: "bot_module.ShardRouter") -> List[Dict[str, Any]]:
+        """Drain berulang sampai statistik tidak berubah, karena pesan antar-shard bisa datang setelah drain."""
+        previous = None
+        while True:
+            stats = await router.drain()
+            counters = [{key: value for key, value in shard.items() if key not in ("ipc", "cpu_s")} for shard in stats]
+            if counters == previous:
+                return stats
+            previous = counters
+
+    async def run(self) -> Dict[str, Any]:
+        args = self.args
+        user_ids = [1_000_000 + i for i in range(args.users)]
+        factory = UpdateFactory(None)
+        likes: Set[Tuple[int, int]] = set()
+        failures: List[str] = []
+        with tempfile.TemporaryDirectory() as socket_dir:
+            workers = [self._start_worker(socket_dir, index) for index in range(args.shards)]
+            router = bot_module.ShardRouter(args.shards, socket_dir)
+            try:
+                await router.start()
+                # Satu drain kosong agar waktu start worker tidak ikut terukur.
+                before = await router.drain()
+
+                started = time.perf_counter()
+                updates = 0
+                for user_id in user_ids:
+                    for _, update in registration_steps(factory, user_id):
+                        await router.dispatch(update)
+                        updates += 1
+                registered = await self._drain(router)
+                registration_s = time.perf_counter() - started
+
+                started = time.perf_counter()
+                swipe_updates = 0
+                for user_id in user_ids:
+                    if args.restart_shard and user_id == user_ids[len(user_ids) // 2]:
+                        # Ditunggu di thread lain agar update tetap dikirim selama worker 0 berhenti.
+                        restart = asyncio.create_task(asyncio.to_thread(bot_module.stop_shard_workers, workers[:1]))
+                    await router.dispatch(factory.text(user_id, "Cari Pasangan 💘"))
+                    swipe_updates += 1
+                    others = self.random.sample(user_ids, min(args.swipes + 1, len(user_ids)))
+                    for match_id in [other for other in others if other != user_id][: args.swipes]:
+                        await router.dispatch(factory.callback(user_id, f"match_like_{match_id}"))
+                        likes.add((user_id, match_id))
+                        swipe_updates += 1
+                    if args.restart_shard:
+                        # Memberi giliran ke koneksi router agar update sampai ke worker yang sedang berhenti.
+                        await asyncio.sleep(0)
+                if args.restart_shard:
+                    await restart
+                    workers[0] = self._start_worker(socket_dir, 0)
+                shards = await self._drain(router)
+                swipes_s = time.perf_counter() - started
+            finally:
+                await router.close()
+                bot_module.stop_shard_workers(workers)
+
+        registration_cpu = [after["cpu_s"] - start["cpu_s"] for start, after in zip(before, registered)]
+        swipe_cpu = [after["cpu_s"] - start["cpu_s"] for start, after in zip(registered, shards)]
+        mutual = sum(1 for swiper_id, swiped_id in likes if (swiped_id, swiper_id) in likes)
+        match_rows = sum(shard["matches"] for shard in shards)
+        swipes_written = sum(shard["swipes"] for shard in shards)
+        if match_rows != mutual:
+            failures.append(f"{match_rows} match rows, expected {mutual}")
+        if swipes_written != len(likes):
+            failures.append(f"{swipes_written} swipes written, expected {len(likes)}")
+        router_stats = router.stats()
+        if router_stats["lost_updates"]:
+            failures.append(f"{router_stats['lost_updates']} updates were lost between router and workers")
+        return {
+            "failures": failures,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "config": vars(args),
+            "registration_s": registration_s,
+            "registration_updates_per_s": updates / registration_s,
+            "swipe_phase_s": swipes_s,
+            "swipe_updates_per_s": swipe_updates / swipes_s,
+            "registration_cpu_s": registration_cpu,
+            "swipe_cpu_s": swipe_cpu,
+            # Throughput jika setiap shard punya core sendiri: dibatasi shard dengan waktu CPU terbesar.
+            "swipe_updates_per_cpu_s_busiest_shard": swipe_updates / max(swipe_cpu),
+            # Setiap match disimpan dua arah, masing-masing di shard pemilik user_id.
+            "expected_match_rows": mutual,
+            "match_rows": match_rows,
+            "expected_swipes": len(likes),
+            "swipes_written": swipes_written,
+            "router": router_stats,
+            "shards": shards,
+        }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"Updates: {report['updates']} in {report['elapsed_s']:.2f}s "
+          f"({report['throughput_updates_per_s']:.1f} updates/s)")
+    print(f"DB time: {report['db_time_s']:.2f}s, Telegram API time: {report['api_time_s']:.2f}s")
+    print(f"DB connections: {report['db_ops']}, swipes written: {report['swipes_written']}, "
+          f"API calls: {sum(report['api_calls'].values())}")
+    if report["admission"]:
+        print(f"Admission: {report['admission']}")
+    print(f"{'handler':<14}{'count':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for label, stats in report["handlers"].items():
+        print(f"{label:<14}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['p99_ms']:>10.2f}")
+    for name, stats in report.get("jobs", {}).items():
+        print(f"job {name}: {stats['runs']:.0f} runs, {stats['total_duration_seconds']:.2f}s total, "
+              f"{stats['last_items']:.0f} items in last run")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Load test offline untuk bot kencan.")
+    parser.add_argument("--users", type=int, default=100, help="Jumlah pengguna sintetis.")
+    parser.add_argument("--swipes", type=int, default=20, help="Jumlah swipe per pengguna.")
+    parser.add_argument("--swipe-interval-ms", type=float, default=0, help="Jeda antar swipe per pengguna.")
+    parser.add_argument("--concurrency", type=int, default=50, help="Jumlah pengguna aktif bersamaan.")
+    parser.add_argument("--api-latency-ms", type=float, default=0, help="Latensi simulasi setiap panggilan Bot API.")
+    parser.add_argument(
+        "--unthrottled", action="store_true", help="Menonaktifkan rate limit antrean pesan keluar dan per pengguna."
+    )
+    parser.add_argument("--mash", type=int, default=0, metavar="N", help="Setiap pengguna menekan ❤️ N kali sekaligus di akhir.")
+    parser.add_argument(
+        "--mash-distinct",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Setiap pengguna menekan ❤️ pada N kartu berbeda sekaligus (callback buatan).",
+    )
+    parser.add_argument("--no-admission", action="store_true", help="Menonaktifkan pembatasan dan deduplikasi per pengguna.")
+    parser.add_argument(
+        "--background-jobs", action="store_true", help="Menjalankan pemeliharaan dan precompute selama load test."
+    )
+    parser.add_argument("--output", default="loadtest_results.json", help="File hasil dalam format JSON.")
+    parser.add_argument(
+        "--scoring-benchmark", type=int, metavar="N", help="Hanya mengukur skor kecocokan untuk N kandidat."
+    )
+    parser.add_argument(
+        "--filter-benchmark", type=int, metavar="N", help="Hanya mengukur pencarian kandidat dengan filter pada N profil."
+    )
+    parser.add_argument(
+        "--pool-benchmark",
+        action="store_true",
+        help="Membandingkan pool koneksi dengan satu koneksi bersama pada 1, 8 dan 64 pengguna bersamaan.",
+    )
+    parser.add_argument(
+        "--geo-benchmark", type=int, metavar="N", help="Hanya mengukur pencarian kandidat terdekat pada N profil yang mengelompok."
+    )
+    parser.add_argument(
+        "--deck-benchmark", type=int, metavar="N", help="Hanya membandingkan deck kandidat dengan ORDER BY RANDOM() pada N profil."
+    )
+    parser.add_argument(
+        "--admission-check",
+        action="store_true",
+        help="Membandingkan penulisan database dengan dan tanpa pembatasan per pengguna saat badai tombol.",
+    )
+    parser.add_argument(
+        "--restart-check",
+        action="store_true",
+        help="Memeriksa bahwa restart hanya memuat percakapan yang sedang berjalan dan pengguna lain tetap bisa melanjutkan.",
+    )
+    parser.add_argument(
+        "--outbox-check",
+        action="store_true",
+        help="Hanya memeriksa rate limit, prioritas, RetryAfter dan close() antrean pesan keluar.",
+    )
+    parser.add_argument("--shards", type=int, metavar="N", help="Menjalankan bot sebagai N proses worker.")
+    parser.add_argument(
+        "--restart-shard", action="store_true", help="Dengan --shards: menjalankan ulang worker 0 di tengah fase swipe."
+    )
+    parser.add_argument("--shard-worker", type=int, metavar="I", help=argparse.SUPPRESS)
+    parser.add_argument("--socket-dir", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    logging.getLogger("telegram_bot_2025").setLevel(logging.WARNING)
+    if args.shard_worker is not None:
+        run_shard_worker(args)
+        return
+    if args.shards:
+        report = asyncio.run(ShardedLoadTest(args).run())
+        print(json.dumps({key: value for key, value in report.items() if key != "config"}, indent=2))
+    elif args.scoring_benchmark:
+        report = benchmark_scoring(args.scoring_benchmark)
+        print(json.dumps(report, indent=2))
+    elif args.filter_benchmark:
+        report = asyncio.run(benchmark_filters(args.filter_benchmark))
+        print(json.dumps(report, indent=2))
+    elif args.pool_benchmark:
+        report = asyncio.run(benchmark_pool(args))
+        print(json.dumps(report, indent=2))
+    elif args.geo_benchmark:
+        report = asyncio.run(benchmark_geo(args.geo_benchmark))
+        print(json.dumps(report, indent=2))
+    elif args.deck_benchmark:
+        report = asyncio.run(benchmark_decks(args.deck_benchmark))
+        print(json.dumps(report, indent=2))
+    elif args.restart_check:
+        report = asyncio.run(check_restart(args))
+        print(json.dumps(report, indent=2))
+    elif args.admission_check:
+        report = asyncio.run(check_admission(args))
+        print(json.dumps(report, indent=2))
+    elif args.outbox_check:
+        report = asyncio.run(check_outbox())
+        print(json.dumps(report, indent=2))
+    else:
+        report = asyncio.run(LoadTest(args).run())
+        print_report(report)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+    if report.get("failures"):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
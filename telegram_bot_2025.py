@@ -1,8 +1,30 @@
+import argparse
+import csv
 import logging
 import os
 import asyncio
+import datetime
+import functools
+import heapq
+import html
+import itertools
+import json
+import math
+import random
+import re
+import signal
+import subprocess
+import sys
+import time
+import unicodedata
+import urllib.parse
+import zlib
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Dict, Any
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, Any, Iterable, List, NamedTuple, Optional, Set, Tuple
 
 import aiosqlite
 from telegram import (
@@ -15,14 +37,22 @@ from telegram import (
 )
 from telegram.ext import (
     Application,
+    ApplicationBuilder,
+    ApplicationHandlerStop,
+    BaseHandler,
+    BasePersistence,
+    BaseUpdateProcessor,
     CommandHandler,
     MessageHandler,
     ConversationHandler,
     CallbackQueryHandler,
     ContextTypes,
+    PersistenceInput,
+    TypeHandler,
     filters,
 )
 from telegram.constants import ParseMode
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
 
 # Konfigurasi Logging
 # Mengatur format log untuk menyertakan waktu, nama logger, level log, dan pesan.
@@ -48,55 +78,658 @@ logger = logging.getLogger(__name__)
 ) = range(9)
 
 DATABASE_FILE = "dating_bot_2025.db"
+# Jumlah koneksi baca-saja di pool. Semua penulisan melewati satu koneksi penulis.
+DB_READER_COUNT = int(os.getenv("DB_READER_COUNT", "4"))
+
+
+class DatabasePool:
+    """
+    Pool koneksi SQLite dengan pemisahan pembaca/penulis.
+
+    SQLite dalam mode WAL mengizinkan banyak pembaca berjalan bersamaan dengan satu
+    penulis. Setiap koneksi aiosqlite punya satu worker thread, jadi beberapa koneksi
+    baca mencegah satu query kandidat yang lambat menahan tampilan profil lain.
+
+    Penggunaan:
+        async with pool.read() as db:
+            ...
+        async with pool.write() as db:
+            ...  # commit dilakukan oleh pemanggil, rollback otomatis jika terjadi error
+    """
+
+    def __init__(self, path: str, readers: int = DB_READER_COUNT, metrics: Optional["MetricsRegistry"] = None):
+        self.path = path
+        self.reader_count = readers
+        # Jika metrics aktif, koneksi dibungkus agar setiap query dan commit diukur.
+        self.metrics = metrics
+        self.writer: Optional[aiosqlite.Connection] = None
+        self._readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all_readers: List[aiosqlite.Connection] = []
+        self._write_lock = asyncio.Lock()
+        # kind -> [jumlah, total detik menunggu, detik menunggu terlama]
+        self._wait_stats: Dict[str, List[float]] = {"read": [0, 0.0, 0.0], "write": [0, 0.0, 0.0]}
+
+    async def open(self) -> None:
+        """Membuka koneksi penulis lebih dulu (agar mode WAL aktif), lalu koneksi pembaca."""
+        self.writer = await aiosqlite.connect(self.path)
+        # Hanya berlaku untuk file database baru: halaman kosong bisa dikembalikan bertahap
+        # lewat `PRAGMA incremental_vacuum` oleh pekerjaan malam, tanpa VACUUM penuh.
+        await self.writer.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        # WAL membuat pembaca tidak terblokir oleh penulis, dan synchronous=NORMAL hanya
+        # melakukan fsync saat checkpoint, bukan pada setiap commit.
+        await self.writer.execute("PRAGMA journal_mode=WAL")
+        await self.writer.execute("PRAGMA synchronous=NORMAL")
+        for _ in range(self.reader_count):
+            reader = await aiosqlite.connect(self.path)
+            await reader.execute("PRAGMA query_only=ON")
+            self._all_readers.append(reader)
+            self._readers.put_nowait(reader)
+
+    def idle_readers(self) -> int:
+        """Jumlah koneksi baca yang sedang tidak dipinjam."""
+        return self._readers.qsize()
+
+    def _record_wait(self, kind: str, waited: float) -> None:
+        stats = self._wait_stats[kind]
+        stats[0] += 1
+        stats[1] += waited
+        stats[2] = max(stats[2], waited)
+        if self.metrics is not None:
+            self.metrics.observe("bot_db_pool_wait_seconds", {"kind": kind}, waited)
+
+    def _wrap(self, db: aiosqlite.Connection) -> aiosqlite.Connection:
+        if self.metrics is None:
+            return db
+        return InstrumentedConnection(db, self.metrics)  # type: ignore[return-value]
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Meminjam satu koneksi baca-saja."""
+        started = time.perf_counter()
+        db = await self._readers.get()
+        self._record_wait("read", time.perf_counter() - started)
+        try:
+            yield self._wrap(db)
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Meminjam koneksi penulis secara eksklusif."""
+        started = time.perf_counter()
+        async with self._write_lock:
+            self._record_wait("write", time.perf_counter() - started)
+            try:
+                yield self._wrap(self.writer)
+            except BaseException:
+                await self.writer.rollback()
+                raise
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """Statistik waktu tunggu untuk mendapatkan koneksi, per jenis koneksi."""
+        return {
+            kind: {
+                "count": count,
+                "avg_wait_ms": (total / count * 1000) if count else 0.0,
+                "max_wait_ms": longest * 1000,
+                "idle_connections": self._readers.qsize() if kind == "read" else int(not self._write_lock.locked()),
+            }
+            for kind, (count, total, longest) in self._wait_stats.items()
+        }
+
+    async def close(self) -> None:
+        for reader in self._all_readers:
+            await reader.close()
+        if self.writer is not None:
+            await self.writer.close()
 
 
 async def setup_database(app: Application):
     """
-    Inisialisasi koneksi database dan membuat tabel jika belum ada.
+    Inisialisasi pool koneksi database dan membuat tabel jika belum ada.
     Fungsi ini dijalankan sekali saat bot startup menggunakan `post_init`.
     """
-    db = await aiosqlite.connect(DATABASE_FILE)
-    # Membuat tabel 'users' untuk menyimpan data profil pengguna.
-    # user_id dibuat UNIQUE untuk memastikan tidak ada duplikasi.
-    # photo_id digunakan untuk menyimpan file_id dari Telegram, bukan path file lokal.
-    # latitude dan longitude disimpan sebagai REAL untuk query geografis di masa depan.
+    pool = DatabasePool(DATABASE_FILE, metrics=app.bot_data.get("metrics"))
+    await pool.open()
+    async with pool.write() as db:
+        features = await create_tables(db)
+    # Menyimpan pool database ke dalam context bot untuk digunakan di seluruh aplikasi.
+    app.bot_data["pool"] = pool
+    app.bot_data["likes"] = LikeIndex()
+    await app.bot_data["likes"].hydrate(pool)
+    app.bot_data["seen"] = SeenSetStore(pool)
+    app.bot_data["swipes"] = SwipeBuffer(
+        pool, app.bot_data["likes"], app.bot_data["seen"], peers=app.bot_data.get("shards")
+    )
+    app.bot_data["swipes"].start()
+    app.bot_data["cards"] = ProfileCardCache(pool)
+    app.bot_data["decks"] = CandidateDeckManager(
+        pool,
+        app.bot_data["swipes"],
+        app.bot_data["cards"],
+        geo_enabled=features.geo,
+        search_enabled=features.search,
+        scorer=CompatibilityScorer(app.bot_data["likes"]),
+    )
+    app.bot_data["activity"] = ActivityTracker(app.bot_data.get("shards"))
+    schedule_jobs(app)
+    logger.info("Database connected and tables are ready.")
+
+
+# Migrasi skema berurutan: (versi, deskripsi, daftar langkah). Setiap langkah berupa
+# statement SQL atau fungsi async yang menerima koneksi (untuk backfill yang butuh Python).
+# Migrasi yang sudah dirilis tidak boleh diubah; perubahan skema selalu ditambahkan
+# sebagai migrasi baru dengan versi berikutnya.
+MigrationStep = Any  # str | Callable[[aiosqlite.Connection], Awaitable[None]]
+
+# Mengisi tabel 'matches' dari pasangan like dua arah di log swipe (juga dipakai impor massal).
+MATCHES_BACKFILL_SQL = """
+    INSERT OR IGNORE INTO matches (user_id, match_id, matched_at)
+    SELECT a.swiper_id, a.swiped_id, MAX(a.swipe_date, b.swipe_date)
+    FROM swipes a JOIN swipes b ON b.swiper_id = a.swiped_id AND b.swiped_id = a.swiper_id
+    WHERE a.action = 'like' AND b.action = 'like'
+"""
+
+SCHEMA_MIGRATIONS: List[Tuple[int, str, List[MigrationStep]]] = [
+    (
+        1,
+        "initial users and swipes tables",
+        [
+            # user_id adalah PRIMARY KEY untuk memastikan tidak ada duplikasi.
+            # photo_id digunakan untuk menyimpan file_id dari Telegram, bukan path file lokal.
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                gender TEXT,
+                age INTEGER,
+                hobby TEXT,
+                latitude REAL,
+                longitude REAL,
+                photo_id TEXT,
+                description TEXT,
+                registration_date DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+            """,
+            # PRIMARY KEY (swiper_id, swiped_id) mencegah satu pengguna swipe orang yang sama berkali-kali.
+            """
+            CREATE TABLE IF NOT EXISTS swipes (
+                swiper_id INTEGER NOT NULL,
+                swiped_id INTEGER NOT NULL,
+                action TEXT NOT NULL, -- 'like' or 'dislike'
+                swipe_date DATETIME DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (swiper_id, swiped_id)
+            )
+            """,
+        ],
+    ),
+    (
+        2,
+        "covering index for incoming swipes",
+        # "Siapa yang menyukai saya" dan pengecekan arah sebaliknya cukup membaca indeks ini.
+        ["CREATE INDEX IF NOT EXISTS idx_swipes_swiped ON swipes (swiped_id, action, swiper_id)"],
+    ),
+    (
+        3,
+        "materialized matches table",
+        [
+            # Setiap match disimpan dua arah agar daftar match seorang pengguna cukup
+            # dibaca lewat PRIMARY KEY tanpa UNION.
+            """
+            CREATE TABLE IF NOT EXISTS matches (
+                user_id INTEGER NOT NULL,
+                match_id INTEGER NOT NULL,
+                matched_at DATETIME NOT NULL,
+                PRIMARY KEY (user_id, match_id)
+            ) WITHOUT ROWID
+            """,
+            MATCHES_BACKFILL_SQL,
+        ],
+    ),
+    (
+        4,
+        "compressed per-user seen sets",
+        [
+            # Daftar user_id yang sudah di-swipe, terurut dan dikodekan delta + zlib (lihat SeenSet).
+            """
+            CREATE TABLE IF NOT EXISTS seen_sets (
+                user_id INTEGER PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL
+            )
+            """,
+            lambda db: backfill_seen_sets(db, LEGACY_SEEN_SETS_INSERT_SQL),
+        ],
+    ),
+    (
+        5,
+        "keyset indexes for match and incoming like lists",
+        [
+            # Menggantikan idx_swipes_swiped: urutan (swipe_date, swiper_id) di dalam indeks membuat
+            # halaman "yang menyukai saya" cukup dilanjutkan dari kunci terakhir tanpa OFFSET.
+            "DROP INDEX IF EXISTS idx_swipes_swiped",
+            "CREATE INDEX IF NOT EXISTS idx_swipes_liked_by ON swipes (swiped_id, action, swipe_date, swiper_id)",
+            "CREATE INDEX IF NOT EXISTS idx_matches_recent ON matches (user_id, matched_at)",
+        ],
+    ),
+    (
+        6,
+        "user activity tracking and precomputed recommendations",
+        [
+            # Diperbarui berkala oleh ActivityTracker; dipakai untuk memilih pengguna aktif
+            # saat precompute dan memangkas profil tidak aktif dari pencarian kandidat.
+            "ALTER TABLE users ADD COLUMN last_active DATETIME",
+            """
+            UPDATE users SET last_active = COALESCE(
+                (SELECT MAX(swipe_date) FROM swipes WHERE swiper_id = users.user_id), registration_date
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS idx_users_last_active ON users (last_active)",
+            # Deck kandidat yang dihitung malam hari, sebagai array user_id 64-bit little-endian.
+            """
+            CREATE TABLE IF NOT EXISTS recommendations (
+                user_id INTEGER PRIMARY KEY,
+                candidates BLOB NOT NULL,
+                computed_at DATETIME NOT NULL
+            )
+            """,
+        ],
+    ),
+    (
+        7,
+        "per-user search filters",
+        [
+            # Filter kandidat yang diatur lewat /filter; kolom NULL berarti filter tersebut tidak aktif.
+            """
+            CREATE TABLE IF NOT EXISTS user_filters (
+                user_id INTEGER PRIMARY KEY,
+                min_age INTEGER,
+                max_age INTEGER,
+                gender TEXT,
+                keyword TEXT
+            )
+            """,
+            # Kandidat dengan filter usia/gender dibaca dari indeks ini saja (lihat FILTERED_CANDIDATES_SQL);
+            # last_active ikut disimpan agar pengecekan profil tidak aktif tidak perlu membaca tabel.
+            "CREATE INDEX IF NOT EXISTS idx_users_filter ON users (gender, age, user_id, last_active)",
+        ],
+    ),
+    (
+        8,
+        "append-only seen set chunks",
+        [
+            # Seen-set disimpan sebagai beberapa chunk per pengguna: setiap flush hanya menambah
+            # chunk berisi id baru, dan chunk-chunk digabung sesekali (lihat SeenSetStore).
+            """
+            CREATE TABLE IF NOT EXISTS seen_set_chunks (
+                user_id INTEGER NOT NULL,
+                chunk INTEGER NOT NULL,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                PRIMARY KEY (user_id, chunk)
+            )
+            """,
+            "INSERT INTO seen_set_chunks (user_id, chunk, data, size) SELECT user_id, 0, data, size FROM seen_sets",
+            "DROP TABLE seen_sets",
+        ],
+    ),
+    (
+        9,
+        "undelivered inter-shard messages",
+        [
+            # Pesan ke shard lain yang belum dibalas saat worker berhenti; dikirim ulang saat start
+            # (lihat ShardPeers.deliver). Selalu kosong tanpa sharding.
+            """
+            CREATE TABLE IF NOT EXISTS shard_outbox (
+                id INTEGER PRIMARY KEY,
+                shard INTEGER NOT NULL,
+                message TEXT NOT NULL
+            )
+            """,
+        ],
+    ),
+]
+
+# Halaman daftar "yang menyukai saya" dan "match saya", diurutkan dari yang terbaru.
+# Posisi halaman dilanjutkan dari kunci (tanggal, user_id) baris terakhir/pertama (keyset),
+# jadi halaman ke-500 sama cepatnya dengan halaman pertama. {op} adalah "<" untuk halaman
+# yang lebih lama dan ">" untuk yang lebih baru, {order} arah urutan yang sesuai.
+LIKES_PAGE_SQL = """
+    SELECT s.swipe_date, s.swiper_id, u.age, u.hobby
+    FROM swipes s JOIN users u ON u.user_id = s.swiper_id
+    WHERE s.swiped_id = ? AND s.action = 'like' AND (s.swipe_date, s.swiper_id) {op} (?, ?)
+    ORDER BY s.swipe_date {order}, s.swiper_id {order}
+    LIMIT ?
+"""
+MATCHES_PAGE_SQL = """
+    SELECT m.matched_at, m.match_id, u.age, u.hobby
+    FROM matches m JOIN users u ON u.user_id = m.match_id
+    WHERE m.user_id = ? AND (m.matched_at, m.match_id) {op} (?, ?)
+    ORDER BY m.matched_at {order}, m.match_id {order}
+    LIMIT ?
+"""
+
+# Rentang user_id untuk titik awal acak. Dua subquery terpisah agar masing-masing cukup membaca
+# satu ujung PRIMARY KEY; MIN() dan MAX() dalam satu SELECT membuat SQLite membaca seluruh tabel.
+USER_ID_RANGE_SQL = "SELECT (SELECT MIN(user_id) FROM users), (SELECT MAX(user_id) FROM users)"
+# Kandidat acak tanpa filter: rentang user_id dari titik acak pada PRIMARY KEY. Profil yang lama
+# tidak aktif dilewati, sama seperti yang sudah dipangkas dari indeks lokasi.
+RANDOM_CANDIDATES_SQL = """
+    SELECT user_id FROM users
+    WHERE user_id > ? AND user_id < ? AND (last_active IS NULL OR last_active >= ?)
+    ORDER BY user_id LIMIT ?
+"""
+# Satu segmen pengambilan acak (lihat CandidateDeckManager._sample_by_id), diberi nomor segmen.
+SAMPLE_SEGMENT_SQL = "SELECT ?, * FROM ({query})"
+# Kandidat di dalam satu bounding box, langsung dari indeks R*Tree (titik disimpan sebagai
+# kotak dengan min == max). Lingkaran yang melewati garis bujur ±180 memakai dua kotak (UNION ALL).
+NEARBY_CANDIDATES_SQL = """
+    SELECT user_id, min_lat, min_lon FROM users_geo
+    WHERE min_lat >= ? AND max_lat <= ? AND min_lon >= ? AND max_lon <= ? AND user_id != ?
+"""
+# Kandidat terdekat untuk pengguna dengan filter: kotak R*Tree yang sama, lalu baris 'users' dibaca
+# lewat PRIMARY KEY (CROSS JOIN menjaga urutan ini). Kolom keempat menandai apakah usia/gender
+# cocok, sehingga LIMIT membatasi baris kotak yang dibaca, bukan jumlah yang cocok; kata kunci
+# dicek di Python pada hobi dan deskripsi (lihat matches_keyword), karena MATCH FTS5 per baris
+# membuka daftar dokumen dari awal (~0.2 ms per baris).
+FILTERED_NEARBY_CANDIDATES_SQL = """
+    SELECT g.user_id, g.min_lat, g.min_lon,
+           u.age BETWEEN ? AND ? AND (? IS NULL OR u.gender = ?), u.hobby, u.description
+    FROM users_geo g CROSS JOIN users u
+    WHERE g.min_lat >= ? AND g.max_lat <= ? AND g.min_lon >= ? AND g.max_lon <= ? AND g.user_id != ?
+      AND u.user_id = g.user_id
+"""
+# Kandidat dengan filter usia/gender, dibaca per "ember" (gender, usia tertentu) dari rentang
+# user_id: satu seek pada covering index idx_users_filter. Beberapa ember digabung dengan
+# UNION ALL dalam satu query (lihat CandidateDeckManager._fetch_filtered_candidates).
+FILTERED_CANDIDATES_SQL = """
+    SELECT gender, age, user_id FROM users
+    WHERE gender = ? AND age = ? AND user_id > ? AND user_id < ?
+      AND (last_active IS NULL OR last_active >= ?)
+    ORDER BY user_id LIMIT ?
+"""
+# Kandidat dengan filter kata kunci: rowid dari indeks FTS5 (terurut) dilanjutkan dari titik acak,
+# lalu usia/gender dicek lewat PRIMARY KEY 'users'. Parameter gender NULL berarti semua gender.
+KEYWORD_CANDIDATES_SQL = """
+    SELECT u.user_id FROM users_fts f JOIN users u ON u.user_id = f.rowid
+    WHERE f.rowid > ? AND f.rowid < ? AND users_fts MATCH ?
+      AND u.age BETWEEN ? AND ? AND (? IS NULL OR u.gender = ?)
+      AND (u.last_active IS NULL OR u.last_active >= ?)
+    ORDER BY f.rowid LIMIT ?
+"""
+
+# Query yang dijalankan pada setiap swipe, pengisian deck, atau tampilan profil. Rencana
+# eksekusinya diperiksa saat startup (full scan dilaporkan sebagai warning) dan oleh
+# perintah `check-plans` (full scan membuat perintah gagal).
+HOT_QUERIES: Dict[str, str] = {
+    "seen_set": "SELECT chunk, data FROM seen_set_chunks WHERE user_id = ? ORDER BY chunk",
+    "likes_received": "SELECT swiper_id FROM swipes WHERE swiped_id = ? AND action = 'like'",
+    "matches_of_user": "SELECT match_id, matched_at FROM matches WHERE user_id = ?",
+    "user_profile": "SELECT photo_id, description FROM users WHERE user_id = ?",
+    "likes_page": LIKES_PAGE_SQL.format(op="<", order="DESC"),
+    "matches_page": MATCHES_PAGE_SQL.format(op="<", order="DESC"),
+    "filtered_candidates": FILTERED_CANDIDATES_SQL,
+    "random_candidates": SAMPLE_SEGMENT_SQL.format(query=RANDOM_CANDIDATES_SQL),
+    "keyword_candidates": SAMPLE_SEGMENT_SQL.format(query=KEYWORD_CANDIDATES_SQL),
+    "nearby_candidates": NEARBY_CANDIDATES_SQL,
+    "filtered_nearby_candidates": FILTERED_NEARBY_CANDIDATES_SQL,
+}
+
+
+class SchemaFeatures(NamedTuple):
+    """Indeks opsional yang tersedia, tergantung modul yang dikompilasi ke SQLite."""
+
+    geo: bool
+    search: bool
+
+
+async def create_tables(db: aiosqlite.Connection) -> SchemaFeatures:
+    """Menyiapkan skema (lihat `create_schema`) lalu memeriksa rencana query HOT_QUERIES."""
+    features = await create_schema(db)
+    await check_query_plans(db)
+    return features
+
+
+async def create_schema(db: aiosqlite.Connection) -> SchemaFeatures:
+    """Menjalankan migrasi skema lalu membuat indeks lokasi dan indeks teks lengkap."""
+    await run_migrations(db)
+    features = SchemaFeatures(geo=await setup_geo_index(db), search=await setup_search_index(db))
+    await db.commit()
+    return features
+
+
+async def run_migrations(db: aiosqlite.Connection) -> None:
+    """
+    Menerapkan migrasi yang belum tercatat di tabel 'schema_version', satu transaksi
+    per migrasi. Jika satu migrasi gagal, perubahannya dibatalkan dan bot berhenti.
+    """
     await db.execute(
         """
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            gender TEXT,
-            age INTEGER,
-            hobby TEXT,
-            latitude REAL,
-            longitude REAL,
-            photo_id TEXT,
-            description TEXT,
-            registration_date DATETIME DEFAULT CURRENT_TIMESTAMP
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
         )
         """
     )
-    # Membuat tabel 'swipes' untuk melacak interaksi antar pengguna.
-    # PRIMARY KEY (swiper_id, swiped_id) mencegah satu pengguna swipe orang yang sama berkali-kali.
+    await db.commit()
+    async with db.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version") as cursor:
+        (current,) = await cursor.fetchone()
+
+    for version, description, statements in SCHEMA_MIGRATIONS:
+        if version <= current:
+            continue
+        # BEGIN eksplisit agar DDL ikut di dalam transaksi (sqlite3 tidak membukanya otomatis).
+        await db.execute("BEGIN")
+        try:
+            for step in statements:
+                if callable(step):
+                    await step(db)
+                else:
+                    await db.execute(step)
+            await db.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)", (version, description)
+            )
+            await db.commit()
+        except aiosqlite.Error as e:
+            await db.rollback()
+            logger.error(f"Schema migration {version} ({description}) failed: {e}")
+            raise
+        logger.info(f"Applied schema migration {version}: {description}")
+
+
+def is_full_scan(detail: str) -> bool:
+    """Apakah satu baris EXPLAIN QUERY PLAN membaca seluruh tabel atau indeks."""
+    # "SCAN tabel" tanpa indeks (atau hanya lewat indeks penuh) berarti seluruh tabel dibaca;
+    # "SCAN (subquery-N)" hanya membaca hasil subquery yang sudah dibatasi.
+    if not detail.startswith("SCAN ") or detail.startswith("SCAN (subquery-"):
+        return False
+    # Tabel virtual (R*Tree, FTS5) selalu tampil sebagai SCAN; tanpa constraint (idxStr kosong
+    # setelah "INDEX n:") seluruh indeksnya dibaca.
+    if " VIRTUAL TABLE INDEX " in detail:
+        return detail.endswith(":")
+    return True
+
+
+async def check_query_plans(db: aiosqlite.Connection) -> Dict[str, List[str]]:
+    """
+    Mencatat EXPLAIN QUERY PLAN dari HOT_QUERIES dan memberi warning untuk setiap
+    full table scan, agar indeks yang hilang langsung terlihat di log startup.
+    Mengembalikan full scan per query (kosong jika semuanya memakai indeks).
+    """
+    scans: Dict[str, List[str]] = {}
+    for name, sql in HOT_QUERIES.items():
+        params = (0,) * sql.count("?")
+        try:
+            async with db.execute(f"EXPLAIN QUERY PLAN {sql}", params) as cursor:
+                plan = [row[3] for row in await cursor.fetchall()]
+        except aiosqlite.OperationalError as e:
+            # users_geo/users_fts tidak ada jika SQLite tanpa R*Tree/FTS5; fiturnya memang nonaktif.
+            logger.info(f"Query plan for {name} not checked: {e}")
+            continue
+        logger.debug(f"Query plan for {name}: {'; '.join(plan)}")
+        full = [detail for detail in plan if is_full_scan(detail)]
+        if full:
+            scans[name] = full
+            logger.warning(f"Hot query '{name}' does a full scan: {'; '.join(full)}")
+    return scans
+
+
+async def check_plans_command(path: str) -> bool:
+    """Perintah `check-plans`: menyiapkan skema pada `path` lalu memeriksa HOT_QUERIES."""
+    db = await aiosqlite.connect(path)
+    try:
+        await create_schema(db)
+        scans = await check_query_plans(db)
+    finally:
+        await db.close()
+    if scans:
+        logger.error(f"{len(scans)} of {len(HOT_QUERIES)} hot queries do a full scan: {', '.join(scans)}")
+    else:
+        logger.info(f"All {len(HOT_QUERIES)} hot queries use an index.")
+    return not scans
+
+
+async def setup_geo_index(db: aiosqlite.Connection) -> bool:
+    """
+    Membuat indeks spasial R*Tree 'users_geo' yang disinkronkan dengan tabel 'users' lewat trigger.
+    Mengembalikan False jika SQLite tidak dikompilasi dengan modul R*Tree.
+    """
+    try:
+        await db.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_geo USING rtree(
+                user_id, min_lat, max_lat, min_lon, max_lon
+            )
+            """
+        )
+    except aiosqlite.OperationalError as e:
+        logger.warning(f"R*Tree module unavailable, location-based matching disabled: {e}")
+        return False
+
+    # Setiap pengguna disimpan sebagai titik (kotak dengan min == max).
+    # Trigger menjaga indeks tetap sinkron saat profil dibuat, dipindah, atau dihapus.
+    await db.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS users_geo_insert AFTER INSERT ON users
+        WHEN NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL
+        BEGIN
+            DELETE FROM users_geo WHERE user_id = NEW.user_id;
+            INSERT INTO users_geo VALUES (NEW.user_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS users_geo_update AFTER UPDATE OF latitude, longitude ON users
+        BEGIN
+            DELETE FROM users_geo WHERE user_id = OLD.user_id;
+            INSERT INTO users_geo
+                SELECT NEW.user_id, NEW.latitude, NEW.latitude, NEW.longitude, NEW.longitude
+                WHERE NEW.latitude IS NOT NULL AND NEW.longitude IS NOT NULL;
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS users_geo_delete AFTER DELETE ON users
+        BEGIN
+            DELETE FROM users_geo WHERE user_id = OLD.user_id;
+        END;
+        """
+    )
+    # Mengisi indeks untuk pengguna yang terdaftar sebelum indeks ini ada. Profil yang sudah
+    # dipangkas karena tidak aktif (lihat prune_inactive_profiles) tidak dimasukkan kembali.
     await db.execute(
         """
-        CREATE TABLE IF NOT EXISTS swipes (
-            swiper_id INTEGER NOT NULL,
-            swiped_id INTEGER NOT NULL,
-            action TEXT NOT NULL, -- 'like' or 'dislike'
-            swipe_date DATETIME DEFAULT CURRENT_TIMESTAMP,
-            PRIMARY KEY (swiper_id, swiped_id)
+        INSERT INTO users_geo
+        SELECT user_id, latitude, latitude, longitude, longitude FROM users
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+          AND (last_active IS NULL OR last_active >= ?)
+          AND user_id NOT IN (SELECT user_id FROM users_geo)
+        """,
+        (inactive_cutoff(),),
+    )
+    return True
+
+
+async def setup_search_index(db: aiosqlite.Connection) -> bool:
+    """
+    Membuat indeks teks lengkap FTS5 'users_fts' atas hobi dan deskripsi, disinkronkan
+    dengan tabel 'users' lewat trigger. Mengembalikan False jika SQLite tidak dikompilasi
+    dengan modul FTS5.
+    """
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE name = 'users_fts'") as cursor:
+        exists = await cursor.fetchone() is not None
+    try:
+        # External content: teks hanya disimpan di 'users', indeks ini hanya menyimpan token.
+        # remove_diacritics membuat "kafe" juga cocok dengan "kafé".
+        await db.execute(
+            """
+            CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                hobby, description, content='users', content_rowid='user_id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            """
         )
+    except aiosqlite.OperationalError as e:
+        logger.warning(f"FTS5 module unavailable, keyword filters disabled: {e}")
+        return False
+
+    # Tabel external content harus diberi tahu isi lama lewat perintah 'delete' sebelum
+    # baris diubah, termasuk saat hobi atau deskripsi diedit dari menu profil.
+    await db.executescript(
+        """
+        CREATE TRIGGER IF NOT EXISTS users_fts_insert AFTER INSERT ON users
+        BEGIN
+            INSERT INTO users_fts (rowid, hobby, description) VALUES (NEW.user_id, NEW.hobby, NEW.description);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS users_fts_update AFTER UPDATE OF hobby, description ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, hobby, description)
+                VALUES ('delete', OLD.user_id, OLD.hobby, OLD.description);
+            INSERT INTO users_fts (rowid, hobby, description) VALUES (NEW.user_id, NEW.hobby, NEW.description);
+        END;
+
+        CREATE TRIGGER IF NOT EXISTS users_fts_delete AFTER DELETE ON users
+        BEGIN
+            INSERT INTO users_fts (users_fts, rowid, hobby, description)
+                VALUES ('delete', OLD.user_id, OLD.hobby, OLD.description);
+        END;
         """
     )
-    await db.commit()
-    # Menyimpan objek koneksi database ke dalam context bot untuk digunakan di seluruh aplikasi.
-    app.bot_data["db"] = db
-    logger.info("Database connected and tables are ready.")
+    # Mengisi indeks untuk pengguna yang terdaftar sebelum indeks ini ada.
+    if not exists:
+        await db.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+    return True
+
+
+async def post_init(app: Application):
+    """Menyiapkan database, antrean pesan keluar, dan endpoint metrics saat bot mulai."""
+    await setup_database(app)
+    # Batas global Telegram berlaku per token bot, jadi dalam mode sharding dibagi rata antar worker.
+    # Batas per chat tidak perlu dibagi karena setiap chat hanya dilayani oleh satu shard.
+    peers: Optional[ShardPeers] = app.bot_data.get("shards")
+    app.bot_data["outbox"] = MessageScheduler(
+        global_rate=OUTBOX_GLOBAL_RATE / (peers.count if peers is not None else 1),
+        metrics=app.bot_data.get("metrics"),
+    )
+    app.bot_data["outbox"].start()
+    if app.bot_data.get("metrics") is not None and METRICS_PORT:
+        app.bot_data["metrics_server"] = await start_metrics_server(app, METRICS_HOST, METRICS_PORT)
+
+
+async def post_shutdown(app: Application):
+    """Mengirim sisa pesan di antrean lalu menutup database saat bot berhenti."""
+    metrics_server = app.bot_data.get("metrics_server")
+    if metrics_server is not None:
+        metrics_server.close()
+        await metrics_server.wait_closed()
+    await app.bot_data["outbox"].close()
+    await close_database(app)
 
 
 async def close_database(app: Application):
     """Menutup koneksi database saat bot berhenti."""
-    await app.bot_data["db"].close()
+    app.bot_data["decks"].close()
+    # Swipe dan waktu aktif yang masih di buffer harus ditulis sebelum koneksi ditutup.
+    await app.bot_data["swipes"].close()
+    await run_job(app, "flush_activity", flush_activity)
+    await app.bot_data["pool"].close()
     logger.info("Database connection closed.")
 
 
@@ -111,17 +744,24 @@ async def user_exists(user_id: int, db: aiosqlite.Connection) -> bool:
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Memulai bot. Memeriksa apakah pengguna sudah terdaftar atau memulai proses registrasi."""
     user = update.effective_user
-    db = context.bot_data["db"]
 
-    if await user_exists(user.id, db):
-        await update.message.reply_text(
+    async with context.bot_data["pool"].read() as db:
+        registered = await user_exists(user.id, db)
+
+    if registered:
+        context.bot_data["activity"].touch(user.id)
+        await reply(
+            update,
+            context,
             "Selamat datang kembali! 🎉\n\n"
             "Gunakan menu di bawah untuk mulai mencari pasangan atau mengelola profil Anda.",
             reply_markup=main_menu_keyboard(),
         )
         return MENU
     else:
-        await update.message.reply_text(
+        await reply(
+            update,
+            context,
             f"Halo, {user.first_name}! Selamat datang di bot kencan. Mari kita buat profil Anda.\n\n"
             "Silakan pilih jenis kelamin Anda.",
             reply_markup=ReplyKeyboardMarkup([["Pria", "Wanita"]], one_time_keyboard=True, resize_keyboard=True),
@@ -132,7 +772,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 async def gender(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Menyimpan jenis kelamin dan meminta usia."""
     context.user_data["gender"] = update.message.text
-    await update.message.reply_text("Hebat! Sekarang, berapa usia Anda?", reply_markup=ReplyKeyboardRemove())
+    await reply(update, context, "Hebat! Sekarang, berapa usia Anda?", reply_markup=ReplyKeyboardRemove())
     return AGE
 
 
@@ -143,10 +783,10 @@ async def age(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
         if not 18 <= age_value <= 99:
             raise ValueError("Usia harus antara 18 dan 99.")
         context.user_data["age"] = age_value
-        await update.message.reply_text("OK. Apa hobi utama Anda? (Contoh: Membaca, Olahraga, Nonton Film)")
+        await reply(update, context, "OK. Apa hobi utama Anda? (Contoh: Membaca, Olahraga, Nonton Film)")
         return HOBBY
     except ValueError:
-        await update.message.reply_text("Mohon masukkan usia yang valid (angka antara 18-99).")
+        await reply(update, context, "Mohon masukkan usia yang valid (angka antara 18-99).")
         return AGE
 
 
@@ -154,7 +794,9 @@ async def hobby(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Menyimpan hobi dan meminta lokasi."""
     context.user_data["hobby"] = update.message.text
     location_keyboard = [[KeyboardButton("Bagikan Lokasi Saat Ini", request_location=True)]]
-    await update.message.reply_text(
+    await reply(
+        update,
+        context,
         "Hobi yang menarik! Sekarang, silakan bagikan lokasi Anda agar kami bisa menemukan pasangan di sekitar Anda.",
         reply_markup=ReplyKeyboardMarkup(location_keyboard, one_time_keyboard=True, resize_keyboard=True),
     )
@@ -166,7 +808,9 @@ async def location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_location = update.message.location
     context.user_data["latitude"] = user_location.latitude
     context.user_data["longitude"] = user_location.longitude
-    await update.message.reply_text(
+    await reply(
+        update,
+        context,
         "Lokasi diterima! Terakhir, unggah foto terbaik Anda untuk profil.",
         reply_markup=ReplyKeyboardRemove(),
     )
@@ -177,7 +821,7 @@ async def photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Menyimpan file_id foto dan meminta deskripsi."""
     # Menyimpan file_id, bukan men-download fotonya. Ini lebih efisien dan portabel.
     context.user_data["photo_id"] = update.message.photo[-1].file_id
-    await update.message.reply_text("Foto yang bagus! Sekarang tulis deskripsi singkat tentang diri Anda.")
+    await reply(update, context, "Foto yang bagus! Sekarang tulis deskripsi singkat tentang diri Anda.")
     return DESCRIPTION
 
 
@@ -185,7 +829,6 @@ async def description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     """Menyimpan deskripsi, menyimpan seluruh profil ke DB, dan masuk ke menu utama."""
     user_id = update.effective_user.id
     context.user_data["description"] = update.message.text
-    db = context.bot_data["db"]
 
     # Mengumpulkan semua data dari context.user_data
     user_profile: Dict[str, Any] = {
@@ -201,17 +844,22 @@ async def description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
     try:
         # Menyimpan data pengguna ke database
-        await db.execute(
-            """
-            INSERT INTO users (user_id, gender, age, hobby, latitude, longitude, photo_id, description)
-            VALUES (:user_id, :gender, :age, :hobby, :latitude, :longitude, :photo_id, :description)
-            """,
-            user_profile,
-        )
-        await db.commit()
+        async with context.bot_data["pool"].write() as db:
+            await db.execute(
+                """
+                INSERT INTO users (user_id, gender, age, hobby, latitude, longitude, photo_id, description, last_active)
+                VALUES (:user_id, :gender, :age, :hobby, :latitude, :longitude, :photo_id, :description, CURRENT_TIMESTAMP)
+                """,
+                user_profile,
+            )
+            await db.commit()
         logger.info(f"User profile for {user_id} saved successfully.")
+        # Profil direplikasi ke semua shard agar pengguna ini muncul di deck pengguna shard lain.
+        await publish_profile(context.bot_data, user_id)
 
-        await update.message.reply_text(
+        await reply(
+            update,
+            context,
             "Pendaftaran selesai! Profil Anda telah dibuat. ✨\n\n"
             "Sekarang Anda bisa mulai mencari pasangan atau melihat profil Anda.",
             reply_markup=main_menu_keyboard(),
@@ -222,7 +870,9 @@ async def description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 
     except aiosqlite.Error as e:
         logger.error(f"Database error on saving profile for {user_id}: {e}")
-        await update.message.reply_text(
+        await reply(
+            update,
+            context,
             "Maaf, terjadi kesalahan saat menyimpan profil Anda. Silakan coba lagi nanti."
         )
         return ConversationHandler.END
@@ -233,7 +883,8 @@ async def description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 def main_menu_keyboard() -> ReplyKeyboardMarkup:
     """Membuat keyboard untuk menu utama."""
     return ReplyKeyboardMarkup(
-        [["Cari Pasangan 💘"], ["Profil Saya 👤", "Edit Profil 📝"]], resize_keyboard=True
+        [["Cari Pasangan 💘"], ["Profil Saya 👤", "Edit Profil 📝"], ["Match Saya 💞", "Yang Menyukai Saya 😍"]],
+        resize_keyboard=True,
     )
 
 async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -244,278 +895,4652 @@ async def main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     elif choice == "Profil Saya �":
         return await my_profile(update, context)
     elif choice == "Edit Profil 📝":
-        await update.message.reply_text("Apa yang ingin Anda ubah?", reply_markup=edit_profile_keyboard())
+        await reply(update, context, "Apa yang ingin Anda ubah?", reply_markup=edit_profile_keyboard())
         return EDIT_PROFILE
     else:
-        await update.message.reply_text("Pilihan tidak valid. Silakan gunakan tombol di bawah.")
+        await reply(update, context, "Pilihan tidak valid. Silakan gunakan tombol di bawah.")
         return MENU
 
 
 async def my_profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Menampilkan profil pengguna saat ini."""
     user_id = update.effective_user.id
-    db = context.bot_data["db"]
-
-    async with db.execute("SELECT gender, age, hobby, description, photo_id FROM users WHERE user_id = ?", (user_id,)) as cursor:
-        profile = await cursor.fetchone()
-
-    if profile:
-        gender, age, hobby, description, photo_id = profile
-        caption = (
-            f"<b>Profil Anda</b>\n\n"
-            f"<b>🚻 Gender:</b> {gender}\n"
-            f"<b>🎂 Usia:</b> {age} tahun\n"
-            f"<b>🎨 Hobi:</b> {hobby}\n\n"
-            f"<b>📝 Deskripsi:</b>\n{description}"
-        )
-        await update.message.reply_photo(photo=photo_id, caption=caption, parse_mode=ParseMode.HTML)
+
+    card = await context.bot_data["cards"].get(user_id)
+
+    if card:
+        # Jumlah like berubah terus, jadi tidak ikut di-cache bersama kartu.
+        caption = f"{card.own_caption}\n\n<b>❤️ Disukai oleh:</b> {context.bot_data['likes'].count(user_id)} orang"
+        await reply_photo(update, context, card.photo_id, caption=caption, parse_mode=ParseMode.HTML)
     else:
-        await update.message.reply_text("Profil Anda tidak ditemukan. Mungkin Anda belum mendaftar? /start")
+        await reply(update, context, "Profil Anda tidak ditemukan. Mungkin Anda belum mendaftar? /start")
 
     return MENU # Kembali ke menu utama setelah menampilkan profil
 
-# --- Fitur Matching ---
+# --- Cache Kartu Profil ---
 
-async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Mencari dan menampilkan calon pasangan."""
-    user_id = update.effective_user.id
-    db = context.bot_data["db"]
-
-    # Mencari pengguna lain yang belum pernah di-swipe oleh pengguna saat ini.
-    # Diurutkan secara acak untuk variasi.
-    query = """
-        SELECT user_id, gender, age, hobby, description, photo_id
-        FROM users
-        WHERE user_id != ? AND user_id NOT IN (
-            SELECT swiped_id FROM swipes WHERE swiper_id = ?
-        )
-        ORDER BY RANDOM()
-        LIMIT 1
-    """
-    async with db.execute(query, (user_id, user_id)) as cursor:
-        potential_match = await cursor.fetchone()
+# Jumlah maksimum kartu profil di cache dan umur maksimum setiap kartu.
+PROFILE_CACHE_SIZE = 10_000
+PROFILE_CACHE_TTL_SECONDS = 10 * 60
+# Batas jumlah parameter per query `IN (...)` agar aman untuk SQLite versi lama.
+PROFILE_CACHE_WARM_CHUNK = 500
 
-    if potential_match:
-        match_id, gender, age, hobby, description, photo_id = potential_match
-        context.user_data["potential_match_id"] = match_id
+PROFILE_CARD_COLUMNS = "user_id, gender, age, hobby, description, photo_id"
 
-        caption = (
-            f"<b>🚻 {gender}, {age} tahun</b>\n"
-            f"<b>🎨 Hobi:</b> {hobby}\n\n"
-            f"<b>📝 Deskripsi:</b>\n{description}"
-        )
-        
-        # Menggunakan Inline Keyboard untuk aksi Suka/Tidak Suka
-        keyboard = InlineKeyboardMarkup(
+
+class ProfileCard(NamedTuple):
+    """Kartu profil yang sudah dirender dan siap dikirim."""
+
+    user_id: int
+    caption: str  # Tampilan sebagai calon pasangan
+    own_caption: str  # Tampilan di "Profil Saya"
+    photo_id: str
+    keyboard: InlineKeyboardMarkup
+
+
+def render_profile_card(row: Tuple) -> ProfileCard:
+    """Membuat caption HTML dan tombol Suka/Tidak Suka dari satu baris `PROFILE_CARD_COLUMNS`."""
+    user_id, gender, age, hobby, description, photo_id = row
+    gender, hobby, description = (html.escape(str(value)) for value in (gender, hobby, description))
+    caption = (
+        f"<b>🚻 {gender}, {age} tahun</b>\n"
+        f"<b>🎨 Hobi:</b> {hobby}\n\n"
+        f"<b>📝 Deskripsi:</b>\n{description}"
+    )
+    own_caption = (
+        f"<b>Profil Anda</b>\n\n"
+        f"<b>🚻 Gender:</b> {gender}\n"
+        f"<b>🎂 Usia:</b> {age} tahun\n"
+        f"<b>🎨 Hobi:</b> {hobby}\n\n"
+        f"<b>📝 Deskripsi:</b>\n{description}"
+    )
+    # Menggunakan Inline Keyboard untuk aksi Suka/Tidak Suka
+    keyboard = InlineKeyboardMarkup(
+        [
             [
-                [
-                    InlineKeyboardButton("❌ Tidak Suka", callback_data=f"match_dislike_{match_id}"),
-                    InlineKeyboardButton("❤️ Suka", callback_data=f"match_like_{match_id}"),
-                ]
+                InlineKeyboardButton("❌ Tidak Suka", callback_data=f"match_dislike_{user_id}"),
+                InlineKeyboardButton("❤️ Suka", callback_data=f"match_like_{user_id}"),
             ]
-        )
-        await update.message.reply_photo(
-            photo=photo_id,
-            caption=caption,
-            parse_mode=ParseMode.HTML,
-            reply_markup=keyboard,
-        )
-        return MATCHING
+        ]
+    )
+    return ProfileCard(user_id, caption, own_caption, photo_id, keyboard)
 
-    else:
-        await update.message.reply_text(
-            "Sepertinya sudah tidak ada calon pasangan lagi untuk saat ini. Coba lagi nanti! 😊",
-            reply_markup=main_menu_keyboard(),
-        )
-        return MENU
 
+class ProfileCardCache:
+    """
+    Cache LRU + TTL untuk kartu profil yang sudah dirender, dengan kunci user_id.
 
-async def match_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Menangani pilihan Suka/Tidak Suka dari Inline Keyboard."""
-    query = update.callback_query
-    await query.answer()
+    Setiap perubahan profil wajib memanggil `invalidate` agar kartu lama tidak pernah
+    ditampilkan; TTL hanya jaring pengaman tambahan. Pembacaan yang dimulai sebelum
+    `invalidate` tidak menyimpan hasilnya ke cache, karena bisa saja membaca baris
+    sebelum perubahan di-commit.
+    """
 
-    user_id = update.effective_user.id
-    db = context.bot_data["db"]
-    
-    # Parsing callback_data: "match_like_12345" atau "match_dislike_12345"
-    action, match_id_str = query.data.split("_")[1:]
-    match_id = int(match_id_str)
+    def __init__(
+        self,
+        pool: DatabasePool,
+        max_size: int = PROFILE_CACHE_SIZE,
+        ttl: float = PROFILE_CACHE_TTL_SECONDS,
+    ):
+        self.pool = pool
+        self.max_size = max_size
+        self.ttl = ttl
+        self._cards: "OrderedDict[int, Tuple[float, ProfileCard]]" = OrderedDict()
+        # Generasi naik setiap `invalidate`. Selama ada pembacaan yang berjalan, generasi
+        # invalidasi terakhir per pengguna dicatat; catatan dikosongkan saat tidak ada pembacaan.
+        self._generation = 0
+        self._invalidated: Dict[int, int] = {}
+        self._reads = 0
+        self.hits = 0
+        self.misses = 0
 
-    try:
-        # Mencatat aksi swipe ke database
-        await db.execute(
-            "INSERT INTO swipes (swiper_id, swiped_id, action) VALUES (?, ?, ?)",
-            (user_id, match_id, action),
-        )
-        await db.commit()
-    except aiosqlite.IntegrityError:
-        # Pengguna sudah pernah swipe orang ini, abaikan.
-        logger.warning(f"User {user_id} tried to swipe {match_id} again.")
-        await query.edit_message_text("Anda sudah pernah berinteraksi dengan profil ini.")
-        return await find_match(update, context) # Langsung cari yang baru
+    def _lookup(self, user_id: int) -> Optional[ProfileCard]:
+        entry = self._cards.get(user_id)
+        if entry is None:
+            return None
+        expires_at, card = entry
+        if expires_at < time.monotonic():
+            del self._cards[user_id]
+            return None
+        self._cards.move_to_end(user_id)
+        return card
 
-    # Mengedit pesan asli untuk menghilangkan tombol
-    original_caption = query.message.caption
-    if action == "like":
-        await query.edit_message_caption(caption=f"{original_caption}\n\n--- (Anda menyukai profil ini ❤️) ---", parse_mode=ParseMode.HTML)
-        # Cek apakah ada mutual like
-        async with db.execute("SELECT 1 FROM swipes WHERE swiper_id = ? AND swiped_id = ? AND action = 'like'", (match_id, user_id)) as cursor:
-            is_mutual = await cursor.fetchone()
-        
-        if is_mutual:
-            await context.bot.send_message(
-                chat_id=user_id,
-                text=f"Selamat! Anda dan pengguna lain saling suka! 🎉 Kalian sekarang match!",
-            )
-            await context.bot.send_message(
-                chat_id=match_id,
-                text=f"Selamat! Anda dan pengguna lain saling suka! 🎉 Kalian sekarang match!",
-            )
-    else: # dislike
-        await query.edit_message_caption(caption=f"{original_caption}\n\n--- (Anda melewati profil ini ❌) ---", parse_mode=ParseMode.HTML)
+    def _begin_read(self) -> int:
+        self._reads += 1
+        return self._generation
 
-    # Otomatis mencari pasangan berikutnya
-    return await find_match(update, context)
+    def _end_read(self) -> None:
+        self._reads -= 1
+        if not self._reads:
+            self._invalidated.clear()
 
+    def _store(self, card: ProfileCard, generation: int) -> None:
+        """Menyimpan kartu hasil pembacaan yang dimulai pada `generation`, kecuali profilnya sudah diinvalidasi."""
+        if self._invalidated.get(card.user_id, -1) > generation:
+            return
+        self._cards[card.user_id] = (time.monotonic() + self.ttl, card)
+        self._cards.move_to_end(card.user_id)
+        while len(self._cards) > self.max_size:
+            self._cards.popitem(last=False)
 
-# --- Fitur Edit Profil ---
+    async def get(self, user_id: int) -> Optional[ProfileCard]:
+        """Mengambil kartu profil, merender dari database jika belum ada di cache."""
+        card = self._lookup(user_id)
+        if card is not None:
+            self.hits += 1
+            return card
+        self.misses += 1
+        generation = self._begin_read()
+        try:
+            async with self.pool.read() as db:
+                async with db.execute(
+                    f"SELECT {PROFILE_CARD_COLUMNS} FROM users WHERE user_id = ?", (user_id,)
+                ) as cursor:
+                    row = await cursor.fetchone()
+            if row is None:
+                return None
+            card = render_profile_card(row)
+            self._store(card, generation)
+            return card
+        finally:
+            self._end_read()
 
-def edit_profile_keyboard() -> InlineKeyboardMarkup:
-    """Membuat keyboard untuk menu edit profil."""
-    return InlineKeyboardMarkup([
-        [InlineKeyboardButton("Ubah Deskripsi", callback_data="edit_description")],
-        [InlineKeyboardButton("Ubah Hobi", callback_data="edit_hobby")],
-        [InlineKeyboardButton("Kembali ke Menu", callback_data="edit_cancel")]
-    ])
+    async def warm(self, user_ids: Iterable[int]) -> None:
+        """Memuat kartu yang belum ada di cache dengan satu query `WHERE user_id IN (...)` per potongan."""
+        missing = [user_id for user_id in user_ids if self._lookup(user_id) is None]
+        if not missing:
+            return
+        generation = self._begin_read()
+        try:
+            async with self.pool.read() as db:
+                for i in range(0, len(missing), PROFILE_CACHE_WARM_CHUNK):
+                    chunk = missing[i : i + PROFILE_CACHE_WARM_CHUNK]
+                    placeholders = ",".join("?" * len(chunk))
+                    async with db.execute(
+                        f"SELECT {PROFILE_CARD_COLUMNS} FROM users WHERE user_id IN ({placeholders})", chunk
+                    ) as cursor:
+                        for row in await cursor.fetchall():
+                            self._store(render_profile_card(row), generation)
+        finally:
+            self._end_read()
 
-async def edit_profile_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Menangani pilihan dari menu edit profil."""
-    query = update.callback_query
-    await query.answer()
+    def invalidate(self, user_id: int) -> None:
+        """Membuang kartu pengguna dari cache; wajib dipanggil setelah profil diubah."""
+        self._cards.pop(user_id, None)
+        self._generation += 1
+        if self._reads:
+            self._invalidated[user_id] = self._generation
 
-    choice = query.data.split('_')[1] # "description", "hobby", atau "cancel"
-    
-    if choice == "description":
-        await query.message.reply_text("Silakan kirim deskripsi baru Anda.")
-        return DESCRIPTION # Menggunakan kembali state dari registrasi
-    elif choice == "hobby":
-        await query.message.reply_text("Silakan kirim hobi baru Anda.")
-        return HOBBY # Menggunakan kembali state dari registrasi
-    elif choice == "cancel":
-        await query.message.edit_text("Edit dibatalkan.", reply_markup=None)
-        await query.message.reply_text("Anda kembali di menu utama.", reply_markup=main_menu_keyboard())
-        return MENU
-    return EDIT_PROFILE
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._cards), "hits": self.hits, "misses": self.misses}
 
-async def save_new_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Menyimpan deskripsi profil yang baru."""
-    user_id = update.effective_user.id
-    new_description = update.message.text
-    db = context.bot_data["db"]
 
-    await db.execute("UPDATE users SET description = ? WHERE user_id = ?", (new_description, user_id))
-    await db.commit()
+# --- Skor Kecocokan ---
 
-    await update.message.reply_text("Deskripsi profil Anda telah berhasil diperbarui!", reply_markup=main_menu_keyboard())
-    return MENU
+# Jumlah kandidat yang diambil per pengisian deck adalah DECK_SIZE dikali faktor ini;
+# hanya DECK_SIZE kandidat dengan skor tertinggi yang masuk deck.
+RANK_POOL_FACTOR = int(os.getenv("RANK_POOL_FACTOR", "8"))
+# Bobot tiap komponen skor. Setiap komponen bernilai 0..1.
+RANK_WEIGHT_AGE = 1.0
+RANK_WEIGHT_DISTANCE = 1.0
+RANK_WEIGHT_HOBBY = 0.75
+RANK_WEIGHT_LIKE_BACK = 1.5
+# Selisih umur (tahun) dan jarak (km) saat komponennya turun menjadi 1/e.
+RANK_AGE_SCALE_YEARS = 5.0
+RANK_DISTANCE_SCALE_KM = 25.0
+# Nilai komponen jika data salah satu pihak kosong (misal belum berbagi lokasi).
+RANK_NEUTRAL = 0.5
+# Peluang like-back dihaluskan dengan prior ini agar pengguna dengan sedikit swipe tidak ekstrem.
+LIKE_BACK_PRIOR_RATE = 0.3
+LIKE_BACK_PRIOR_SWIPES = 10
+# Derau acak kecil agar kandidat dengan skor mirip tidak selalu muncul dalam urutan yang sama.
+RANK_JITTER = 0.1
+# Batas jumlah parameter per query IN (...).
+RANK_QUERY_CHUNK = 500
 
-async def save_new_hobby(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Menyimpan hobi yang baru."""
-    user_id = update.effective_user.id
-    new_hobby = update.message.text
-    db = context.bot_data["db"]
+try:
+    import numpy as np
+except ImportError:  # NumPy opsional; tanpa NumPy skor dihitung dengan Python murni.
+    np = None
 
-    await db.execute("UPDATE users SET hobby = ? WHERE user_id = ?", (new_hobby, user_id))
-    await db.commit()
 
-    await update.message.reply_text("Hobi Anda telah berhasil diperbarui!", reply_markup=main_menu_keyboard())
-    return MENU
+def hobby_signature(hobby: Optional[str]) -> int:
+    """Meringkas token hobi menjadi bitmask 64-bit; irisan token diukur dengan popcount."""
+    signature = 0
+    for token in re.findall(r"\w+", (hobby or "").lower()):
+        signature |= 1 << (zlib.crc32(token.encode()) & 63)
+    return signature
 
 
-# --- Fungsi Umum dan Fallback ---
+class ScoringProfile(NamedTuple):
+    """Fitur pengguna yang mencari pasangan."""
 
-async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    """Membatalkan proses saat ini (misal: registrasi) dan kembali ke awal."""
-    await update.message.reply_text(
-        "Proses dibatalkan. Ketik /start untuk memulai lagi.",
-        reply_markup=ReplyKeyboardRemove(),
-    )
-    context.user_data.clear()
-    return ConversationHandler.END
+    user_id: int
+    age: Optional[int]
+    latitude: Optional[float]
+    longitude: Optional[float]
+    hobby_signature: int
 
 
-async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Menangani perintah yang tidak dikenal."""
-    await update.message.reply_text("Maaf, saya tidak mengerti perintah itu. Coba /start.")
+class CandidateFeatures:
+    """
+    Fitur sekumpulan kandidat dalam bentuk kolom, siap dihitung sekaligus.
 
+    Kolom disimpan sebagai `array` bertipe agar NumPy bisa membacanya tanpa salinan
+    (np.frombuffer). Nilai yang kosong disimpan sebagai NaN.
+    """
 
-def main() -> None:
-    """Fungsi utama untuk menjalankan bot."""
-    # Mengambil token dari environment variable. Lebih aman daripada hardcoding.
-    token = os.getenv("TELEGRAM_TOKEN", "GANTI_DENGAN_TOKEN_BOT_ANDA")
-    if token == "GANTI_DENGAN_TOKEN_BOT_ANDA":
-        logger.error("TELEGRAM_TOKEN tidak diatur. Mohon atur environment variable atau ganti di dalam kode.")
-        return
+    def __init__(self):
+        self.user_ids = array("q")
+        self.ages = array("d")
+        self.latitudes = array("d")
+        self.longitudes = array("d")
+        self.hobby_signatures = array("Q")
+        self.swipe_counts = array("d")
+        self.like_counts = array("d")
+        # 1 jika kandidat sudah menyukai pengguna yang mencari.
+        self.liked_viewer = array("b")
 
-    # Menggunakan Application.builder() untuk membuat aplikasi bot.
-    application = (
-        Application.builder()
-        .token(token)
-        .post_init(setup_database) # Menjalankan setup DB saat bot mulai
-        .post_shutdown(close_database) # Menutup koneksi DB saat bot berhenti
-        .build()
-    )
+    def __len__(self) -> int:
+        return len(self.user_ids)
 
-    # ConversationHandler untuk alur registrasi dan menu utama
-    conv_handler = ConversationHandler(
-        entry_points=[CommandHandler("start", start)],
-        states={
-            # States untuk registrasi
-            GENDER: [MessageHandler(filters.Regex("^(Pria|Wanita)$"), gender)],
-            AGE: [MessageHandler(filters.TEXT & ~filters.COMMAND, age)],
-            HOBBY: [MessageHandler(filters.TEXT & ~filters.COMMAND, hobby)],
-            LOCATION: [MessageHandler(filters.LOCATION, location)],
-            PHOTO: [MessageHandler(filters.PHOTO, photo)],
-            DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, description)],
-            
-            # State untuk menu utama
-            MENU: [
-                MessageHandler(filters.Regex("^(Cari Pasangan 💘)$"), find_match),
-                MessageHandler(filters.Regex("^(Profil Saya 👤)$"), my_profile),
-                MessageHandler(filters.Regex("^(Edit Profil 📝)$"), edit_profile_choice),
-            ],
-            
-            # State untuk matching
-            MATCHING: [CallbackQueryHandler(match_choice, pattern="^match_")],
+    def append(
+        self,
+        user_id: int,
+        age: Optional[int],
+        latitude: Optional[float],
+        longitude: Optional[float],
+        hobby: Optional[str],
+        swipes: int,
+        likes: int,
+        liked_viewer: bool,
+    ) -> None:
+        has_location = latitude is not None and longitude is not None
+        self.user_ids.append(user_id)
+        self.ages.append(math.nan if age is None else age)
+        self.latitudes.append(latitude if has_location else math.nan)
+        self.longitudes.append(longitude if has_location else math.nan)
+        self.hobby_signatures.append(hobby_signature(hobby))
+        self.swipe_counts.append(swipes)
+        self.like_counts.append(likes)
+        self.liked_viewer.append(liked_viewer)
 
-            # State untuk edit profil
-            EDIT_PROFILE: [CallbackQueryHandler(edit_profile_choice, pattern="^edit_")],
-        },
-        fallbacks=[CommandHandler("cancel", cancel)],
-        # Mengizinkan pengguna untuk kembali ke menu utama dari state mana pun
-        map_to_parent={
-            MENU: MENU, # Kembali ke menu dari state edit atau matching
-            ConversationHandler.END: ConversationHandler.END
-        }
-    )
-    
-    # ConversationHandler terpisah untuk proses edit, agar lebih modular
-    edit_conv_handler = ConversationHandler(
-        entry_points=[CallbackQueryHandler(edit_profile_choice, pattern="^edit_")],
-        states={
-            DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_description)],
-            HOBBY: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_hobby)],
-        },
-        fallbacks=[CallbackQueryHandler(lambda u,c: MENU, pattern="^edit_cancel")],
-        map_to_parent={
-            MENU: MENU,
-            ConversationHandler.END: MENU
+
+class CompatibilityScorer:
+    """
+    Mengurutkan kandidat berdasarkan skor kecocokan:
+
+        skor = w_umur  * exp(-|selisih umur| / skala)
+             + w_jarak * exp(-jarak haversine / skala)
+             + w_hobi  * Jaccard token hobi
+             + w_like  * peluang kandidat menyukai balik
+
+    Peluang like-back bernilai 1 jika kandidat sudah menyukai pengguna, selain itu
+    rasio like kandidat dari riwayat swipe. Dengan NumPy seluruh batch dihitung
+    sebagai operasi array; tanpa NumPy dipakai loop Python dengan rumus yang sama.
+    """
+
+    def __init__(self, likes: "LikeIndex", use_numpy: bool = np is not None, jitter: float = RANK_JITTER):
+        self.likes = likes
+        self.use_numpy = use_numpy and np is not None
+        self.jitter = jitter
+
+    async def load(
+        self, db: aiosqlite.Connection, user_id: int, candidate_ids: List[int]
+    ) -> Tuple[Optional[ScoringProfile], CandidateFeatures]:
+        """Membaca fitur pengguna dan kandidat dari tabel 'users'."""
+        columns = "user_id, age, hobby, latitude, longitude"
+        async with db.execute(f"SELECT {columns} FROM users WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+        viewer = None
+        if row is not None:
+            viewer = ScoringProfile(row[0], row[1], row[3], row[4], hobby_signature(row[2]))
+
+        features = CandidateFeatures()
+        for start in range(0, len(candidate_ids), RANK_QUERY_CHUNK):
+            chunk = candidate_ids[start:start + RANK_QUERY_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            async with db.execute(
+                f"SELECT {columns} FROM users WHERE user_id IN ({placeholders})", chunk
+            ) as cursor:
+                rows = await cursor.fetchall()
+            for candidate_id, age, hobby, lat, lon in rows:
+                swipes, likes = self.likes.swipe_counts(candidate_id)
+                features.append(
+                    candidate_id, age, lat, lon, hobby, swipes, likes,
+                    self.likes.has_liked(candidate_id, user_id),
+                )
+        return viewer, features
+
+    def score(self, viewer: ScoringProfile, features: CandidateFeatures) -> List[float]:
+        """Skor setiap kandidat, dalam urutan yang sama dengan `features.user_ids`."""
+        if self.use_numpy:
+            return self._score_numpy(viewer, features).tolist()
+        return self._score_python(viewer, features)
+
+    def top_k(self, viewer: ScoringProfile, features: CandidateFeatures, k: int) -> List[int]:
+        """user_id dari k kandidat dengan skor tertinggi, terurut dari yang terbaik."""
+        if not len(features):
+            return []
+        if not self.use_numpy:
+            scores = self._score_python(viewer, features)
+            best = heapq.nlargest(k, range(len(scores)), key=scores.__getitem__)
+            return [features.user_ids[i] for i in best]
+
+        scores = self._score_numpy(viewer, features)
+        if k < len(scores):
+            # argpartition memilih k terbaik dalam O(n); hanya k itu yang diurutkan.
+            best = np.argpartition(-scores, k)[:k]
+        else:
+            best = np.arange(len(scores))
+        best = best[np.argsort(-scores[best])]
+        return np.frombuffer(features.user_ids, dtype=np.int64)[best].tolist()
+
+    def _score_python(self, viewer: ScoringProfile, features: CandidateFeatures) -> List[float]:
+        has_location = viewer.latitude is not None and viewer.longitude is not None
+        scores = []
+        for i in range(len(features)):
+            age = features.ages[i]
+            if viewer.age is None or math.isnan(age):
+                age_score = RANK_NEUTRAL
+            else:
+                age_score = math.exp(-abs(age - viewer.age) / RANK_AGE_SCALE_YEARS)
+
+            lat, lon = features.latitudes[i], features.longitudes[i]
+            if not has_location or math.isnan(lat):
+                distance_score = RANK_NEUTRAL
+            else:
+                distance = haversine_km(viewer.latitude, viewer.longitude, lat, lon)
+                distance_score = math.exp(-distance / RANK_DISTANCE_SCALE_KM)
+
+            signature = features.hobby_signatures[i]
+            union = bin(signature | viewer.hobby_signature).count("1")
+            hobby_score = bin(signature & viewer.hobby_signature).count("1") / union if union else 0.0
+
+            if features.liked_viewer[i]:
+                like_back = 1.0
+            else:
+                like_back = (features.like_counts[i] + LIKE_BACK_PRIOR_RATE * LIKE_BACK_PRIOR_SWIPES) / (
+                    features.swipe_counts[i] + LIKE_BACK_PRIOR_SWIPES
+                )
+
+            scores.append(
+                RANK_WEIGHT_AGE * age_score
+                + RANK_WEIGHT_DISTANCE * distance_score
+                + RANK_WEIGHT_HOBBY * hobby_score
+                + RANK_WEIGHT_LIKE_BACK * like_back
+                + self.jitter * random.random()
+            )
+        return scores
+
+    def _score_numpy(self, viewer: ScoringProfile, features: CandidateFeatures) -> "np.ndarray":
+        n = len(features)
+        # NaN (data kosong) diganti nilai netral di akhir setiap komponen.
+        ages = np.frombuffer(features.ages, dtype=np.float64)
+        viewer_age = np.nan if viewer.age is None else float(viewer.age)
+        age_score = np.exp(-np.abs(ages - viewer_age) / RANK_AGE_SCALE_YEARS)
+        age_score = np.where(np.isnan(age_score), RANK_NEUTRAL, age_score)
+
+        if viewer.latitude is None or viewer.longitude is None:
+            distance_score = np.full(n, RANK_NEUTRAL)
+        else:
+            lat = np.radians(np.frombuffer(features.latitudes, dtype=np.float64))
+            lon = np.radians(np.frombuffer(features.longitudes, dtype=np.float64))
+            viewer_lat, viewer_lon = math.radians(viewer.latitude), math.radians(viewer.longitude)
+            a = (
+                np.sin((lat - viewer_lat) / 2) ** 2
+                + math.cos(viewer_lat) * np.cos(lat) * np.sin((lon - viewer_lon) / 2) ** 2
+            )
+            distance = 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+            distance_score = np.exp(-distance / RANK_DISTANCE_SCALE_KM)
+            distance_score = np.where(np.isnan(distance_score), RANK_NEUTRAL, distance_score)
+
+        signatures = np.frombuffer(features.hobby_signatures, dtype=np.uint64)
+        viewer_signature = np.uint64(viewer.hobby_signature)
+        intersection = _popcount64(signatures & viewer_signature)
+        union = _popcount64(signatures | viewer_signature)
+        hobby_score = np.divide(intersection, union, out=np.zeros(n), where=union > 0)
+
+        swipes = np.frombuffer(features.swipe_counts, dtype=np.float64)
+        likes = np.frombuffer(features.like_counts, dtype=np.float64)
+        like_back = (likes + LIKE_BACK_PRIOR_RATE * LIKE_BACK_PRIOR_SWIPES) / (swipes + LIKE_BACK_PRIOR_SWIPES)
+        like_back = np.where(np.frombuffer(features.liked_viewer, dtype=np.int8) != 0, 1.0, like_back)
+
+        scores = (
+            RANK_WEIGHT_AGE * age_score
+            + RANK_WEIGHT_DISTANCE * distance_score
+            + RANK_WEIGHT_HOBBY * hobby_score
+            + RANK_WEIGHT_LIKE_BACK * like_back
+        )
+        if self.jitter:
+            scores += self.jitter * np.random.random(n)
+        return scores
+
+
+def _popcount64(values: "np.ndarray") -> "np.ndarray":
+    """Jumlah bit 1 per elemen uint64 (np.bitwise_count hanya ada di NumPy >= 2.0)."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(values).astype(np.float64)
+    bits = np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1)
+    return bits.sum(axis=1).astype(np.float64)
+
+
+# --- Deck Kandidat ---
+
+# Jumlah kandidat yang diambil dalam satu kali pengisian deck.
+DECK_SIZE = 50
+# Deck diisi ulang di background saat sisa kandidat di bawah batas ini.
+DECK_REFILL_THRESHOLD = 10
+# Deck yang lebih tua dari ini dianggap basi dan dibangun ulang dari awal.
+DECK_TTL_SECONDS = 15 * 60
+
+# Radius awal pencarian kandidat di sekitar pengguna (km).
+MATCH_RADIUS_KM = float(os.getenv("MATCH_RADIUS_KM", "10"))
+# Faktor perluasan radius saat kandidat di sekitar sudah habis, dan batas radius terjauh.
+MATCH_RADIUS_GROWTH = 4
+MATCH_MAX_RADIUS_KM = 2000
+# Satu cincin dibaca seluruhnya agar kandidat bisa diurutkan dari yang terdekat. Jika kotaknya
+# berisi lebih dari NEARBY_ROWS_FACTOR kali jumlah kandidat yang dibutuhkan, cincin dipersempit,
+# tetapi tidak lebih tipis dari NEARBY_MIN_RING_KM.
+NEARBY_ROWS_FACTOR = 2
+NEARBY_MIN_RING_KM = 0.5
+# Jumlah titik acak maksimum per pengambilan kandidat acak (paling banyak satu per kandidat).
+# Setiap titik hanya menyumbang satu-dua kandidat, sehingga id yang berdekatan jarang ikut
+# bersama dan id setelah celah besar tidak mendominasi batch.
+SAMPLE_PIVOTS = 64
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Menghitung jarak lingkaran besar antara dua titik dalam kilometer."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(lat: float, lon: float, radius_km: float) -> List[Tuple[float, float, float, float]]:
+    """
+    Kotak pembatas (min_lat, max_lat, min_lon, max_lon) yang pasti memuat lingkaran radius_km.
+    Lingkaran yang melewati garis bujur ±180 dipecah menjadi dua kotak, satu di setiap sisi.
+    """
+    # Batas bujur yang tepat pada bola: lingkaran yang memuat kutub mencakup semua bujur.
+    angle = radius_km / EARTH_RADIUS_KM
+    d_lat = math.degrees(angle)
+    min_lat, max_lat = max(-90.0, lat - d_lat), min(90.0, lat + d_lat)
+    cos_lat = math.cos(math.radians(lat))
+    if min_lat <= -90.0 or max_lat >= 90.0 or math.sin(angle) >= cos_lat:
+        d_lon = 180.0
+    else:
+        d_lon = math.degrees(math.asin(math.sin(angle) / cos_lat))
+    if d_lon >= 180.0:
+        return [(min_lat, max_lat, -180.0, 180.0)]
+    west, east = lon - d_lon, lon + d_lon
+    if west < -180.0:
+        return [(min_lat, max_lat, -180.0, east), (min_lat, max_lat, west + 360.0, 180.0)]
+    if east > 180.0:
+        return [(min_lat, max_lat, west, 180.0), (min_lat, max_lat, -180.0, east - 360.0)]
+    return [(min_lat, max_lat, west, east)]
+
+
+class CandidateDeck:
+    """Antrean kandidat teracak milik satu pengguna."""
+
+    def __init__(self):
+        self.candidates: Deque[int] = deque()
+        # Kandidat yang masih valid di dalam antrean. Kandidat yang dihapus dari set ini
+        # (misal: sudah di-swipe lewat pesan lama) dilewati saat diambil (lazy deletion).
+        self.queued: Set[int] = set()
+        # Kandidat yang sudah ditampilkan tetapi belum di-swipe; tidak boleh masuk deck lagi.
+        self.served: Set[int] = set()
+        self.built_at = time.monotonic()
+        self.exhausted = False
+        self.lock = asyncio.Lock()
+        self.refill_task: Optional[asyncio.Task] = None
+        # Kandidat berikutnya yang sudah dipilih (dan kartunya dimuat) selagi pengguna melihat kartu saat ini.
+        self.prefetch_task: Optional[asyncio.Task] = None
+
+
+class CandidateDeckManager:
+    """
+    Menyimpan deck kandidat per pengguna di memori.
+
+    Setiap deck berisi batch kandidat yang belum pernah di-swipe, sudah diurutkan
+    sekali saat diisi, sehingga `find_match` cukup mengambil elemen terdepan (O(1))
+    alih-alih menjalankan `ORDER BY RANDOM()` atas seluruh tabel `users` pada setiap swipe.
+    Jika `scorer` diberikan, deck diisi dengan kandidat terbaik dari kumpulan yang
+    `rank_pool_factor` kali lebih besar.
+    """
+
+    def __init__(
+        self,
+        pool: DatabasePool,
+        swipes: "SwipeBuffer",
+        cards: ProfileCardCache,
+        deck_size: int = DECK_SIZE,
+        refill_threshold: int = DECK_REFILL_THRESHOLD,
+        ttl: float = DECK_TTL_SECONDS,
+        geo_enabled: bool = True,
+        search_enabled: bool = True,
+        radius_km: float = MATCH_RADIUS_KM,
+        max_radius_km: float = MATCH_MAX_RADIUS_KM,
+        scorer: Optional["CompatibilityScorer"] = None,
+        rank_pool_factor: int = RANK_POOL_FACTOR,
+    ):
+        self.pool = pool
+        self.swipes = swipes
+        self.cards = cards
+        self.deck_size = deck_size
+        self.refill_threshold = refill_threshold
+        self.ttl = ttl
+        self.geo_enabled = geo_enabled
+        self.search_enabled = search_enabled
+        self.radius_km = radius_km
+        self.max_radius_km = max_radius_km
+        self.scorer = scorer
+        self.rank_pool_factor = max(1, rank_pool_factor) if scorer is not None else 1
+        self._decks: Dict[int, CandidateDeck] = {}
+        # Sumber isi deck: rekomendasi hasil precompute malam hari atau query langsung.
+        self.fill_stats = {"precomputed": 0, "live": 0}
+
+    async def next_candidate(self, user_id: int) -> Optional[int]:
+        """Mengambil kandidat berikutnya untuk pengguna, atau None jika sudah habis."""
+        deck = self._decks.get(user_id)
+        if deck is None or time.monotonic() - deck.built_at > self.ttl:
+            if deck is not None:
+                self._cancel_tasks(deck)
+            deck = self._decks[user_id] = CandidateDeck()
+
+        task, deck.prefetch_task = deck.prefetch_task, None
+        if task is not None:
+            try:
+                candidate_id = await task
+            except aiosqlite.Error as e:
+                logger.error(f"Database error on prefetching next candidate for {user_id}: {e}")
+                candidate_id = None
+            # Kandidat yang sudah di-swipe atau dibuang selama prefetch tidak dipakai lagi.
+            if candidate_id is not None and candidate_id in deck.served:
+                return candidate_id
+        return await self._pop_candidate(user_id, deck)
+
+    def prefetch(self, user_id: int) -> None:
+        """
+        Memilih kandidat berikutnya di background dan memuat kartunya ke cache,
+        sehingga swipe berikutnya tidak perlu menunggu deck maupun database.
+        """
+        deck = self._decks.get(user_id)
+        if deck is not None and deck.prefetch_task is None:
+            deck.prefetch_task = asyncio.create_task(self._prefetch(user_id, deck))
+
+    async def _prefetch(self, user_id: int, deck: CandidateDeck) -> Optional[int]:
+        while True:
+            candidate_id = await self._pop_candidate(user_id, deck)
+            if candidate_id is None:
+                return None
+            # Hanya id yang disimpan; kartu diambil ulang dari cache saat ditampilkan, jadi
+            # profil yang diedit atau dihapus sementara itu tetap terdeteksi oleh find_match.
+            if await self.cards.get(candidate_id) is not None:
+                return candidate_id
+            self.discard_candidate(candidate_id)
+
+    async def _pop_candidate(self, user_id: int, deck: CandidateDeck) -> Optional[int]:
+        while True:
+            while deck.candidates:
+                candidate_id = deck.candidates.popleft()
+                if candidate_id in deck.queued:
+                    deck.queued.discard(candidate_id)
+                    deck.served.add(candidate_id)
+                    self._schedule_refill(user_id, deck)
+                    return candidate_id
+            # Deck kosong: isi langsung (tidak di background) karena pengguna sedang menunggu.
+            if not await self._refill(user_id, deck):
+                return None
+
+    def mark_seen(self, user_id: int, candidate_id: int) -> None:
+        """Membuang kandidat yang sudah di-swipe dari deck pengguna."""
+        deck = self._decks.get(user_id)
+        if deck is not None:
+            deck.queued.discard(candidate_id)
+            deck.served.discard(candidate_id)
+
+    def discard_candidate(self, candidate_id: int) -> None:
+        """Membuang kandidat dari semua deck, misal karena profilnya tidak ada lagi."""
+        for deck in self._decks.values():
+            deck.queued.discard(candidate_id)
+            deck.served.discard(candidate_id)
+
+    def reset(self, user_id: int) -> None:
+        """Membuang deck pengguna agar kandidat berikutnya diambil ulang, misal setelah filter diubah."""
+        deck = self._decks.pop(user_id, None)
+        if deck is not None:
+            self._cancel_tasks(deck)
+
+    def _schedule_refill(self, user_id: int, deck: CandidateDeck) -> None:
+        """Menjadwalkan pengisian ulang di background jika deck hampir habis."""
+        if len(deck.queued) >= self.refill_threshold or deck.exhausted:
+            return
+        if deck.refill_task is None or deck.refill_task.done():
+            deck.refill_task = asyncio.create_task(self._refill(user_id, deck))
+
+    async def _refill(self, user_id: int, deck: CandidateDeck) -> bool:
+        """Menambahkan batch kandidat baru ke deck. Mengembalikan True jika ada kandidat baru."""
+        async with deck.lock:
+            if len(deck.queued) >= self.refill_threshold:
+                return True
+            exclude = deck.queued | deck.served
+            try:
+                # Deck baru lebih dulu diisi dari rekomendasi yang sudah dihitung malam hari.
+                batch = await self._take_precomputed(user_id) if not exclude else []
+                if batch:
+                    self.fill_stats["precomputed"] += 1
+                    deck.exhausted = False
+                else:
+                    batch = await self._fetch_candidates(user_id, exclude)
+                    self.fill_stats["live"] += 1
+                    deck.exhausted = len(batch) < self.deck_size
+            except aiosqlite.Error as e:
+                logger.error(f"Database error on refilling deck for {user_id}: {e}")
+                return False
+            deck.candidates.extend(batch)
+            deck.queued.update(batch)
+        # Kartu profil seluruh batch dimuat sekaligus agar find_match tidak perlu query per kandidat.
+        try:
+            await self.cards.warm(batch)
+        except aiosqlite.Error as e:
+            logger.error(f"Database error on warming profile cards for {user_id}: {e}")
+        return bool(batch)
+
+    async def _take_precomputed(self, user_id: int) -> List[int]:
+        """
+        Mengambil rekomendasi precompute yang masih segar, tanpa kandidat yang sudah di-swipe
+        sejak dihitung. Mengembalikan list kosong jika sisanya terlalu sedikit untuk satu deck.
+        """
+        seen = await self.swipes.seen.get(user_id)
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT candidates FROM recommendations WHERE user_id = ? AND computed_at >= ?",
+                (user_id, sql_timestamp(RECOMMENDATION_TTL_SECONDS)),
+            ) as cursor:
+                row = await cursor.fetchone()
+        if row is None:
+            return []
+        batch = [candidate_id for candidate_id in decode_id_array(row[0]) if candidate_id not in seen]
+        return batch if len(batch) >= self.refill_threshold else []
+
+    async def precompute(self, user_id: int) -> List[int]:
+        """Menghitung deck lengkap untuk pengguna (dipakai oleh pekerjaan precompute malam hari)."""
+        return await self._fetch_candidates(user_id, set())
+
+    def prune_expired(self) -> int:
+        """Membuang deck yang sudah melewati TTL, misal milik pengguna yang sudah pergi."""
+        now = time.monotonic()
+        expired = [user_id for user_id, deck in self._decks.items() if now - deck.built_at > self.ttl]
+        for user_id in expired:
+            self._cancel_tasks(self._decks.pop(user_id))
+        return len(expired)
+
+    async def _fetch_candidates(self, user_id: int, exclude: Set[int]) -> List[int]:
+        """
+        Mengambil hingga `deck_size` kandidat yang belum pernah di-swipe.
+
+        Jika pengguna punya lokasi, kandidat terdekat diambil lebih dulu; sisanya
+        dilengkapi dengan kandidat acak dari seluruh tabel. Pengguna dengan filter
+        (lihat /filter) hanya mendapat kandidat yang cocok: yang terdekat dibaca dari kotak
+        lokasi yang sama, sisanya lewat indeks usia/gender atau indeks teks lengkap. Dengan
+        scorer, kumpulan kandidat yang lebih besar diambil lalu hanya yang skornya tertinggi
+        (termasuk kedekatan lokasi) dipakai; untuk pengguna dengan filter kumpulan ini lebih
+        kecil (FILTER_RANK_POOL_FACTOR), karena kandidatnya sudah disaring.
+        """
+        # Seen-set dimuat sebelum meminjam koneksi baca, karena pemuatannya juga memakai pool.
+        seen = await self.swipes.seen.get(user_id)
+        batch: List[int] = []
+        async with self.pool.read() as db:
+            async with db.execute(
+                """
+                SELECT u.latitude, u.longitude, f.min_age, f.max_age, f.gender, f.keyword
+                FROM users u LEFT JOIN user_filters f ON f.user_id = u.user_id
+                WHERE u.user_id = ?
+                """,
+                (user_id,),
+            ) as cursor:
+                row = await cursor.fetchone()
+            match_filters = MatchFilters.from_row(row[2:]) if row is not None else MatchFilters()
+            active_filters = match_filters if match_filters.active else None
+            count = self.deck_size * (
+                min(self.rank_pool_factor, FILTER_RANK_POOL_FACTOR) if active_filters else self.rank_pool_factor
+            )
+
+            if self.geo_enabled and row is not None and row[0] is not None and row[1] is not None:
+                batch = await self._fetch_nearby_candidates(
+                    db, user_id, row[0], row[1], exclude, seen, count, active_filters
+                )
+            if len(batch) < count:
+                taken = exclude | set(batch)
+                if active_filters:
+                    batch.extend(await self._fetch_filtered_candidates(
+                        db, user_id, match_filters, taken, seen, count - len(batch)
+                    ))
+                else:
+                    batch.extend(
+                        await self._fetch_random_candidates(db, user_id, taken, seen, count - len(batch))
+                    )
+
+            if self.scorer is not None and len(batch) > 1:
+                viewer, features = await self.scorer.load(db, user_id, batch)
+                if viewer is not None:
+                    return self.scorer.top_k(viewer, features, self.deck_size)
+        return batch[: self.deck_size]
+
+    async def _fetch_nearby_candidates(
+        self,
+        db: aiosqlite.Connection,
+        user_id: int,
+        lat: float,
+        lon: float,
+        exclude: Set[int],
+        seen: "SeenSet",
+        count: int,
+        match_filters: Optional["MatchFilters"] = None,
+    ) -> List[int]:
+        """
+        Mengambil kandidat terdekat lebih dulu, dalam cincin radius yang makin lebar.
+
+        Setiap cincin lebih dulu dipangkas dengan bounding box lewat indeks R*Tree, baru
+        kemudian jarak haversine yang tepat dihitung untuk baris yang lolos. Baris dalam
+        kotak dibaca seluruhnya lalu diurutkan menurut jarak; kotak yang terlalu padat
+        (kota besar) membuat cincin dipersempit alih-alih memotong hasil secara acak.
+
+        Dengan `match_filters`, hanya kandidat yang cocok yang diambil, dan pencarian berhenti
+        setelah FILTER_NEARBY_ROWS_FACTOR kali `count` baris kotak dibaca: filter yang jarang
+        cocok tidak boleh memperlebar cincin sampai seluruh tabel terbaca. Sisanya diisi oleh
+        _fetch_filtered_candidates.
+        """
+        batch: List[int] = []
+        taken = set(exclude)
+        # Semua kandidat dalam radius `inner` sudah dipertimbangkan.
+        inner = 0.0
+        radius = min(self.radius_km, self.max_radius_km)
+        limit = NEARBY_ROWS_FACTOR * (count + len(taken))
+        if match_filters is None:
+            query, filter_params, words = NEARBY_CANDIDATES_SQL, (), []
+            budget = math.inf
+        else:
+            query = FILTERED_NEARBY_CANDIDATES_SQL
+            filter_params = (match_filters.min_age, match_filters.max_age, match_filters.gender, match_filters.gender)
+            words = keyword_tokens(match_filters.keyword) if self.search_enabled and match_filters.keyword else []
+            budget = limit = FILTER_NEARBY_ROWS_FACTOR * count
+        while len(batch) < count and inner < self.max_radius_km and budget > 0:
+            boxes = bounding_boxes(lat, lon, radius)
+            sql = " UNION ALL ".join([query] * len(boxes)) + " LIMIT ?"
+            params = [value for box in boxes for value in (*filter_params, *box, user_id)] + [limit + 1]
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+            budget -= len(rows)
+            if len(rows) > limit and match_filters is not None:
+                # Kotak yang padat tidak dipersempit untuk pengguna dengan filter: baris yang sudah
+                # terbaca tetap berada dalam radius pencarian, dan anggaran baca sudah habis.
+                rows = rows[:limit]
+            elif len(rows) > limit:
+                if radius - inner > NEARBY_MIN_RING_KM:
+                    radius = inner + max(NEARBY_MIN_RING_KM, (radius - inner) / MATCH_RADIUS_GROWTH)
+                else:
+                    # Cincin setipis ini pun terlalu padat (banyak yang sudah dilihat): baca lebih banyak.
+                    limit *= 2
+                continue
+            if match_filters is not None:
+                rows = [
+                    row[:3] for row in rows
+                    if row[3] and (not words or matches_keyword(words, row[4], row[5]))
+                ]
+            ring = sorted(
+                (distance, candidate_id)
+                for candidate_id, c_lat, c_lon in rows
+                if candidate_id not in taken
+                and candidate_id not in seen
+                and (distance := haversine_km(lat, lon, c_lat, c_lon)) <= radius
+            )
+            ring_ids = [candidate_id for _, candidate_id in ring[: count - len(batch)]]
+            batch.extend(ring_ids)
+            taken.update(ring_ids)
+            inner = radius
+            radius = min(self.max_radius_km, radius * MATCH_RADIUS_GROWTH)
+        return batch
+
+    async def _fetch_random_candidates(
+        self, db: aiosqlite.Connection, user_id: int, exclude: Set[int], seen: "SeenSet", count: int
+    ) -> List[int]:
+        """
+        Mengambil hingga `count` kandidat acak yang belum pernah di-swipe.
+
+        Alih-alih mengurutkan seluruh tabel secara acak, query dimulai dari titik acak
+        pada PRIMARY KEY lalu berputar ke awal tabel bila belum cukup, sehingga biayanya
+        sebanding dengan ukuran batch, bukan jumlah pengguna.
+        """
+        return await self._sample_by_id(
+            db, user_id, RANDOM_CANDIDATES_SQL, (inactive_cutoff(),), exclude, seen, count
+        )
+
+    async def _fetch_filtered_candidates(
+        self,
+        db: aiosqlite.Connection,
+        user_id: int,
+        match_filters: "MatchFilters",
+        exclude: Set[int],
+        seen: "SeenSet",
+        count: int,
+    ) -> List[int]:
+        """
+        Mengambil hingga `count` kandidat acak yang cocok dengan filter pengguna.
+
+        Filter kata kunci dibaca dari indeks FTS5. Filter usia/gender saja dibaca per
+        ember (gender, usia) dalam urutan acak; setiap ember dimulai dari user_id acak lalu
+        berputar ke awal, dan hingga FILTER_SAMPLE_BUCKETS ember dibaca dalam satu query.
+        Kandidat jadi tersebar di seluruh rentang usia dengan biaya satu seek per ember.
+        """
+        cutoff = inactive_cutoff()
+        min_age, max_age = match_filters.min_age, match_filters.max_age
+        match = fts_query(match_filters.keyword) if self.search_enabled and match_filters.keyword else None
+        if match is not None:
+            return await self._sample_by_id(
+                db,
+                user_id,
+                KEYWORD_CANDIDATES_SQL,
+                (match, min_age, max_age, match_filters.gender, match_filters.gender, cutoff),
+                exclude,
+                seen,
+                count,
+                KEYWORD_SAMPLE_PIVOTS,
+            )
+
+        async with db.execute(USER_ID_RANGE_SQL) as cursor:
+            min_id, max_id = await cursor.fetchone()
+        if min_id is None:
+            return []
+        genders = [match_filters.gender] if match_filters.gender else GENDER_OPTIONS
+        buckets = [(gender, age) for gender in genders for age in range(min_age, max_age + 1)]
+        random.shuffle(buckets)
+        # ember -> [batas bawah, batas atas, pivot]; pivot None berarti sudah berputar ke awal.
+        ranges: Dict[Tuple[str, int], List[Any]] = {}
+        for bucket in buckets:
+            pivot = random.randint(min_id, max_id)
+            ranges[bucket] = [pivot - 1, max_id + 1, pivot]
+        pending = deque(buckets)
+        batch: List[int] = []
+        while len(batch) < count and pending:
+            active = [pending.popleft() for _ in range(min(FILTER_SAMPLE_BUCKETS, len(pending)))]
+            page_size = -(-(count - len(batch)) // len(active))
+            sql = " UNION ALL ".join([f"SELECT * FROM ({FILTERED_CANDIDATES_SQL})"] * len(active))
+            params: List[Any] = []
+            for gender, age in active:
+                low, high, _ = ranges[(gender, age)]
+                params += [gender, age, low, high, cutoff, page_size]
+            async with db.execute(sql, params) as cursor:
+                rows = await cursor.fetchall()
+
+            # ember -> (jumlah baris, user_id terakhir) untuk melanjutkan halaman berikutnya.
+            read: Dict[Tuple[str, int], Tuple[int, int]] = {}
+            for gender, age, candidate_id in rows:
+                read[(gender, age)] = (read.get((gender, age), (0, 0))[0] + 1, candidate_id)
+                if candidate_id != user_id and candidate_id not in exclude and candidate_id not in seen:
+                    batch.append(candidate_id)
+            for bucket in active:
+                state = ranges[bucket]
+                rows_read, last_id = read.get(bucket, (0, 0))
+                if rows_read == page_size:
+                    state[0] = last_id
+                elif state[2] is not None:
+                    state[:] = [min_id - 1, state[2], None]
+                else:
+                    continue
+                # Ember yang belum habis mendapat giliran lagi setelah ember lain.
+                pending.append(bucket)
+        random.shuffle(batch)
+        return batch[:count]
+
+    async def _sample_by_id(
+        self,
+        db: aiosqlite.Connection,
+        user_id: int,
+        query: str,
+        params: Tuple[Any, ...],
+        exclude: Set[int],
+        seen: "SeenSet",
+        count: int,
+        max_pivots: int = SAMPLE_PIVOTS,
+    ) -> List[int]:
+        """
+        Menjalankan `query` dari banyak user_id acak sekaligus (UNION ALL, hingga `max_pivots`).
+
+        Query menerima batas user_id (bawah, atas) eksklusif, lalu `params`, lalu LIMIT.
+        Titik-titik acak membagi tabel menjadi segmen yang tidak saling tumpang tindih;
+        setiap segmen dibaca dari awalnya dengan halaman kecil, dan segmen yang belum habis
+        dilanjutkan dari id terakhir (keyset) selama kandidat yang belum dilihat belum cukup.
+        Segmen sebelum titik acak pertama dibaca paling akhir, seperti berputar ke awal tabel.
+        """
+        async with db.execute(USER_ID_RANGE_SQL) as cursor:
+            min_id, max_id = await cursor.fetchone()
+        if min_id is None:
+            return []
+
+        pivots = sorted(random.randint(min_id, max_id) for _ in range(max(1, min(max_pivots, count))))
+        # segmen -> [batas bawah, batas atas], keduanya eksklusif.
+        segments = [[pivot - 1, end] for pivot, end in zip(pivots, pivots[1:] + [max_id + 1])]
+        segments.append([min_id - 1, pivots[0]])
+        pending = deque(range(len(segments)))
+        batch: List[int] = []
+        while len(batch) < count and pending:
+            active = [pending.popleft() for _ in range(min(max_pivots, len(pending)))]
+            page_size = -(-(count - len(batch) + len(exclude)) // len(active))
+            sql = " UNION ALL ".join([SAMPLE_SEGMENT_SQL.format(query=query)] * len(active))
+            sql_params: List[Any] = []
+            for segment in active:
+                sql_params += [segment, *segments[segment], *params, page_size]
+            async with db.execute(sql, sql_params) as cursor:
+                rows = await cursor.fetchall()
+
+            # segmen -> (jumlah baris, user_id terakhir)
+            read: Dict[int, Tuple[int, int]] = {}
+            for segment, candidate_id in rows:
+                read[segment] = (read.get(segment, (0, 0))[0] + 1, candidate_id)
+                if candidate_id != user_id and candidate_id not in exclude and candidate_id not in seen:
+                    batch.append(candidate_id)
+            for segment in active:
+                rows_read, last_id = read.get(segment, (0, 0))
+                if rows_read == page_size:
+                    segments[segment][0] = last_id
+                    pending.append(segment)
+        random.shuffle(batch)
+        return batch[:count]
+
+    @staticmethod
+    def _cancel_tasks(deck: CandidateDeck) -> None:
+        for task in (deck.refill_task, deck.prefetch_task):
+            if task:
+                task.cancel()
+
+    def close(self) -> None:
+        """Membatalkan semua pengisian ulang dan prefetch yang masih berjalan."""
+        for deck in self._decks.values():
+            self._cancel_tasks(deck)
+        self._decks.clear()
+
+
+# --- Indeks Like Masuk ---
+
+# Pengguna dengan like masuk lebih dari ini mendapat Bloom filter di depan pencarian biner.
+LIKE_INDEX_BLOOM_THRESHOLD = 10_000
+LIKE_INDEX_BLOOM_ERROR_RATE = 0.01
+# Jumlah baris yang dibaca per langkah saat mengisi indeks dari tabel 'swipes'.
+LIKE_INDEX_HYDRATE_CHUNK = 10_000
+
+_MASK_64 = (1 << 64) - 1
+
+
+class BloomFilter:
+    """Bloom filter sederhana untuk bilangan bulat (tanpa false negative)."""
+
+    def __init__(self, capacity: int, error_rate: float = LIKE_INDEX_BLOOM_ERROR_RATE):
+        self.capacity = capacity
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(self.size // 8 + 1)
+
+    def _positions(self, value: int):
+        # Double hashing: dua hash multiplikatif menghasilkan k posisi bit.
+        h1 = (value * 0x9E3779B97F4A7C15) & _MASK_64
+        h2 = ((value * 0xC2B2AE3D27D4EB4F) & _MASK_64) | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value: int) -> None:
+        for pos in self._positions(value):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value: int) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(value))
+
+
+class LikeIndex:
+    """
+    Indeks "siapa yang menyukai saya" di memori.
+
+    Untuk setiap pengguna disimpan array bilangan bulat 64-bit yang terurut berisi
+    user_id yang menyukainya (8 byte per like), sehingga pemeriksaan mutual like
+    cukup dengan pencarian biner tanpa query ke database.
+
+    Indeks ini juga menghitung jumlah swipe dan like keluar per pengguna, yang dipakai
+    CompatibilityScorer sebagai peluang like-back, serta jumlah match per pengguna
+    untuk daftar "Match Saya".
+    """
+
+    def __init__(self, bloom_threshold: int = LIKE_INDEX_BLOOM_THRESHOLD):
+        self.bloom_threshold = bloom_threshold
+        self._incoming: Dict[int, array] = {}
+        self._blooms: Dict[int, BloomFilter] = {}
+        # swiper_id -> (jumlah swipe, jumlah like)
+        self._swipe_counts: Dict[int, Tuple[int, int]] = {}
+        self._match_counts: Dict[int, int] = {}
+
+    async def hydrate(self, pool: DatabasePool) -> None:
+        """Mengisi indeks dari tabel 'swipes' secara bertahap agar memori tetap kecil."""
+        started = time.perf_counter()
+        edges = 0
+        async with pool.read() as db:
+            async with db.execute("SELECT swiped_id, swiper_id FROM swipes WHERE action = 'like'") as cursor:
+                while True:
+                    rows = await cursor.fetchmany(LIKE_INDEX_HYDRATE_CHUNK)
+                    if not rows:
+                        break
+                    for swiped_id, swiper_id in rows:
+                        likers = self._incoming.get(swiped_id)
+                        if likers is None:
+                            likers = self._incoming[swiped_id] = array("q")
+                        likers.append(swiper_id)
+                    edges += len(rows)
+            async with db.execute(
+                "SELECT swiper_id, COUNT(*), SUM(action = 'like') FROM swipes GROUP BY swiper_id"
+            ) as cursor:
+                while True:
+                    rows = await cursor.fetchmany(LIKE_INDEX_HYDRATE_CHUNK)
+                    if not rows:
+                        break
+                    for swiper_id, total, liked in rows:
+                        self._swipe_counts[swiper_id] = (total, liked)
+            async with db.execute("SELECT user_id, COUNT(*) FROM matches GROUP BY user_id") as cursor:
+                while True:
+                    rows = await cursor.fetchmany(LIKE_INDEX_HYDRATE_CHUNK)
+                    if not rows:
+                        break
+                    self._match_counts.update(rows)
+
+        # Diurutkan sekali di akhir; jauh lebih murah daripada menyisipkan satu per satu.
+        for user_id, likers in self._incoming.items():
+            self._incoming[user_id] = array("q", sorted(likers))
+            if len(likers) >= self.bloom_threshold:
+                self._build_bloom(user_id)
+        logger.info(f"Like index hydrated with {edges} likes in {time.perf_counter() - started:.2f}s.")
+
+    def _build_bloom(self, user_id: int) -> None:
+        likers = self._incoming[user_id]
+        bloom = BloomFilter(capacity=len(likers) * 2)
+        for liker in likers:
+            bloom.add(liker)
+        self._blooms[user_id] = bloom
+
+    def add_like(self, swiper_id: int, swiped_id: int) -> None:
+        """Mencatat bahwa swiper_id menyukai swiped_id."""
+        likers = self._incoming.get(swiped_id)
+        if likers is None:
+            likers = self._incoming[swiped_id] = array("q")
+        pos = bisect_left(likers, swiper_id)
+        if pos < len(likers) and likers[pos] == swiper_id:
+            return
+        likers.insert(pos, swiper_id)
+
+        bloom = self._blooms.get(swiped_id)
+        # Bloom filter dibangun ulang saat isinya melewati kapasitas agar false positive tetap rendah.
+        if bloom is None and len(likers) < self.bloom_threshold:
+            return
+        if bloom is None or len(likers) > bloom.capacity:
+            self._build_bloom(swiped_id)
+        else:
+            bloom.add(swiper_id)
+
+    def record_swipe(self, swiper_id: int, action: str) -> None:
+        """Menambah hitungan swipe keluar milik swiper_id."""
+        total, liked = self._swipe_counts.get(swiper_id, (0, 0))
+        self._swipe_counts[swiper_id] = (total + 1, liked + (action == "like"))
+
+    def record_match(self, user_id: int, match_id: int) -> None:
+        """Menambah hitungan match kedua pengguna."""
+        for uid in (user_id, match_id):
+            self._match_counts[uid] = self._match_counts.get(uid, 0) + 1
+
+    def match_count(self, user_id: int) -> int:
+        """Jumlah match pengguna."""
+        return self._match_counts.get(user_id, 0)
+
+    def swipe_counts(self, user_id: int) -> Tuple[int, int]:
+        """(jumlah swipe, jumlah like) yang dilakukan pengguna."""
+        return self._swipe_counts.get(user_id, (0, 0))
+
+    def has_liked(self, swiper_id: int, swiped_id: int) -> bool:
+        """Memeriksa apakah swiper_id pernah menyukai swiped_id."""
+        likers = self._incoming.get(swiped_id)
+        if not likers:
+            return False
+        bloom = self._blooms.get(swiped_id)
+        if bloom is not None and swiper_id not in bloom:
+            return False
+        pos = bisect_left(likers, swiper_id)
+        return pos < len(likers) and likers[pos] == swiper_id
+
+    def count(self, user_id: int) -> int:
+        """Jumlah like yang diterima pengguna."""
+        likers = self._incoming.get(user_id)
+        return len(likers) if likers is not None else 0
+
+
+# --- Daftar Profil yang Sudah Dilihat ---
+
+# Jumlah seen-set pengguna yang disimpan di memori (LRU). Seen-set yang belum
+# tersimpan ke database tidak pernah dibuang dari cache.
+SEEN_CACHE_USERS = int(os.getenv("SEEN_CACHE_USERS", "10000"))
+# Jumlah baris swipes yang dibaca per langkah saat membangun seen-set dari log swipe.
+SEEN_BACKFILL_CHUNK = 50_000
+# Chunk per pengguna di database sebelum chunk-chunk tambahan digabung saat flush berikutnya.
+SEEN_MAX_CHUNKS = 16
+# Chunk dasar (chunk 0) baru ditulis ulang jika id di chunk tambahan melebihi 1/N seluruh
+# seen-set, sehingga biaya penggabungan per id baru tetap konstan.
+SEEN_COMPACT_FRACTION = 8
+# id baru ditampung di set kecil dan digabung ke array terurut setelah sebanyak ini,
+# atau 1/8 ukuran array jika lebih besar, agar biaya penggabungan O(n) jarang terjadi.
+SEEN_MERGE_MIN = 64
+
+SEEN_CHUNK_INSERT_SQL = "INSERT OR REPLACE INTO seen_set_chunks (user_id, chunk, data, size) VALUES (?, ?, ?, ?)"
+# Format lama (satu blob per pengguna), hanya dipakai oleh migrasi versi 4.
+LEGACY_SEEN_SETS_INSERT_SQL = "INSERT OR REPLACE INTO seen_sets (user_id, data, size) VALUES (?, ?, ?)"
+
+
+class SeenSet:
+    """
+    Himpunan user_id yang sudah di-swipe seorang pengguna.
+
+    Di memori berupa array 64-bit terurut ditambah set kecil berisi id terbaru, sehingga
+    `add` tidak perlu menggeser array. Di database berupa beberapa chunk; setiap chunk
+    adalah id terurut yang disimpan sebagai selisih antar-id (delta) lalu dikompresi zlib,
+    sehingga satu id rata-rata hanya memakan beberapa byte.
+
+    `unsaved` berisi id yang belum diserahkan ke flush, `flushing` id yang sedang ditulis,
+    `chunks` jumlah chunk pengguna ini di database, dan `tail` id yang tersimpan di luar
+    chunk dasar (chunk 0).
+    """
+
+    __slots__ = ("ids", "recent", "unsaved", "flushing", "chunks", "tail")
+
+    def __init__(self, ids: Optional[array] = None, chunks: int = 0, tail: Optional[array] = None):
+        self.ids = ids if ids is not None else array("q")
+        self.recent: Set[int] = set()
+        self.unsaved: List[int] = []
+        self.flushing: List[int] = []
+        self.chunks = chunks
+        self.tail = tail if tail is not None else array("q")
+
+    def __len__(self) -> int:
+        return len(self.ids) + len(self.recent)
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self.recent:
+            return True
+        pos = bisect_left(self.ids, user_id)
+        return pos < len(self.ids) and self.ids[pos] == user_id
+
+    def add(self, user_id: int) -> bool:
+        """Menambahkan user_id; mengembalikan False jika sudah ada."""
+        if user_id in self:
+            return False
+        self.recent.add(user_id)
+        self.unsaved.append(user_id)
+        if len(self.recent) >= max(SEEN_MERGE_MIN, len(self.ids) >> 3):
+            self._merge()
+        return True
+
+    def _merge(self) -> None:
+        self.ids = array("q", heapq.merge(self.ids, sorted(self.recent)))
+        self.recent.clear()
+
+    def encode(self) -> bytes:
+        """Seluruh isi seen-set sebagai satu chunk."""
+        self._merge()
+        return self.encode_ids(self.ids)
+
+    @staticmethod
+    def encode_ids(ids: array) -> bytes:
+        """Mengodekan id yang sudah terurut sebagai delta + zlib."""
+        deltas = array("q", ids[:1])
+        deltas.extend(b - a for a, b in zip(ids, ids[1:]))
+        if sys.byteorder == "big":
+            deltas.byteswap()
+        return zlib.compress(deltas.tobytes())
+
+    @staticmethod
+    def decode_ids(data: bytes) -> array:
+        deltas = array("q")
+        deltas.frombytes(zlib.decompress(data))
+        if sys.byteorder == "big":
+            deltas.byteswap()
+        return array("q", itertools.accumulate(deltas))
+
+    @classmethod
+    def decode(cls, rows: List[Tuple[int, bytes]]) -> "SeenSet":
+        """Menggabungkan baris (chunk, data) dari database, terurut per chunk, menjadi satu seen-set."""
+        chunks = [(chunk, cls.decode_ids(data)) for chunk, data in rows]
+        tail = array("q", itertools.chain.from_iterable(ids for chunk, ids in chunks if chunk > 0))
+        if len(chunks) == 1:
+            return cls(chunks[0][1], chunks[0][0] + 1, tail)
+        # Chunk tidak saling tumpang tindih, tetapi duplikat tetap dibuang agar aman.
+        merged = sorted(itertools.chain.from_iterable(ids for _, ids in chunks))
+        ids = array("q", (user_id for user_id, _ in itertools.groupby(merged)))
+        return cls(ids, chunks[-1][0] + 1, tail)
+
+
+class SeenWrites(NamedTuple):
+    """Perubahan seen-set untuk satu flush SwipeBuffer."""
+
+    # (user_id, chunk pertama) yang chunk-chunknya dihapus karena digantikan satu chunk gabungan.
+    deletes: List[Tuple[int, int]]
+    # (user_id, chunk, data, size) untuk SEEN_CHUNK_INSERT_SQL.
+    rows: List[Tuple[int, int, bytes, int]]
+    # user_id -> (jumlah chunk, id di luar chunk 0) setelah transaksi berhasil.
+    layouts: Dict[int, Tuple[int, array]]
+
+
+class SeenSetStore:
+    """
+    Seen-set per pengguna, dimuat dari tabel 'seen_set_chunks' saat pertama dibutuhkan.
+
+    Pengecekan swipe ganda dan pengecualian kandidat cukup memeriksa seen-set di
+    memori, tanpa menyentuh tabel 'swipes'. Tabel 'swipes' tetap menjadi sumber data
+    (LikeIndex, backfill match, dan daftar like membacanya); seen-set adalah indeks
+    ringkas di sampingnya.
+
+    Swipe baru langsung masuk ke seen-set; SwipeBuffer menulis perubahannya dalam transaksi
+    yang sama dengan batch swipe-nya: satu chunk baru berisi id yang ditambahkan sejak flush
+    terakhir, sehingga biaya flush sebanding dengan jumlah id baru. Setelah SEEN_MAX_CHUNKS
+    chunk, chunk-chunk tambahan digabung menjadi chunk 1; chunk dasar baru ditulis ulang
+    setelah chunk tambahan berisi lebih dari 1/SEEN_COMPACT_FRACTION seluruh seen-set.
+
+    Seen-set yang berubah atau sedang ditulis tidak pernah dibuang dari cache sampai
+    transaksinya selesai, agar tidak dimuat ulang dari database dalam keadaan lama.
+    """
+
+    def __init__(self, pool: DatabasePool, capacity: int = SEEN_CACHE_USERS):
+        self.pool = pool
+        self.capacity = capacity
+        self._sets: "OrderedDict[int, SeenSet]" = OrderedDict()
+        self._dirty: Set[int] = set()
+        self._flushing: Set[int] = set()
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, user_id: int) -> SeenSet:
+        seen = self._sets.get(user_id)
+        if seen is not None:
+            self._sets.move_to_end(user_id)
+            self.hits += 1
+            return seen
+        self.misses += 1
+        async with self.pool.read() as db:
+            async with db.execute(
+                "SELECT chunk, data FROM seen_set_chunks WHERE user_id = ? ORDER BY chunk", (user_id,)
+            ) as cursor:
+                rows = await cursor.fetchall()
+        # Cek ulang: pemanggil lain bisa sudah memuat (dan mengubah) seen-set yang sama.
+        seen = self._sets.get(user_id)
+        if seen is None:
+            seen = self._sets[user_id] = SeenSet.decode(rows) if rows else SeenSet()
+            self._evict()
+        return seen
+
+    async def add(self, user_id: int, seen_id: int) -> bool:
+        """Mencatat bahwa user_id sudah melihat seen_id. False jika sudah tercatat sebelumnya."""
+        seen = await self.get(user_id)
+        if not seen.add(seen_id):
+            return False
+        self._dirty.add(user_id)
+        return True
+
+    def take_dirty(self) -> SeenWrites:
+        """
+        Perubahan seen-set sejak flush terakhir. Pengguna yang bersangkutan tetap di cache
+        sampai `finish_flush` dipanggil dengan hasil transaksinya.
+        """
+        writes = SeenWrites([], [], {})
+        for user_id in self._dirty:
+            seen = self._sets[user_id]
+            seen.flushing, seen.unsaved = seen.unsaved, []
+            tail = seen.tail + array("q", seen.flushing)
+            if seen.chunks < SEEN_MAX_CHUNKS:
+                # Kasus biasa: satu chunk baru berisi id baru saja.
+                chunk = array("q", sorted(seen.flushing))
+                writes.rows.append((user_id, seen.chunks, SeenSet.encode_ids(chunk), len(chunk)))
+                writes.layouts[user_id] = (seen.chunks + 1, tail if seen.chunks else array("q"))
+            elif len(tail) * SEEN_COMPACT_FRACTION < len(seen):
+                # Terlalu banyak chunk: gabungkan chunk tambahan (kecil) menjadi chunk 1.
+                tail = array("q", sorted(tail))
+                writes.deletes.append((user_id, 1))
+                writes.rows.append((user_id, 1, SeenSet.encode_ids(tail), len(tail)))
+                writes.layouts[user_id] = (2, tail)
+            else:
+                # Chunk tambahan sudah besar: tulis ulang seluruh seen-set sebagai chunk 0.
+                writes.deletes.append((user_id, 0))
+                writes.rows.append((user_id, 0, seen.encode(), len(seen)))
+                writes.layouts[user_id] = (1, array("q"))
+        self._flushing |= self._dirty
+        self._dirty.clear()
+        return writes
+
+    def finish_flush(self, writes: SeenWrites, committed: bool) -> None:
+        """Mencatat hasil transaksi; jika gagal, id yang tadi ditulis dikembalikan untuk dicoba lagi."""
+        for user_id, (chunks, tail) in writes.layouts.items():
+            seen = self._sets[user_id]
+            if committed:
+                seen.chunks, seen.tail = chunks, tail
+            else:
+                seen.unsaved = seen.flushing + seen.unsaved
+                self._dirty.add(user_id)
+            seen.flushing = []
+            self._flushing.discard(user_id)
+        self._evict()
+
+    def _evict(self) -> None:
+        if len(self._sets) <= self.capacity:
+            return
+        for user_id in list(self._sets):
+            if len(self._sets) <= self.capacity:
+                break
+            if user_id not in self._dirty and user_id not in self._flushing:
+                del self._sets[user_id]
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._sets),
+            "dirty": len(self._dirty),
+            "flushing": len(self._flushing),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+async def backfill_seen_sets(db: aiosqlite.Connection, insert_sql: str) -> None:
+    """
+    Membangun seen-set semua pengguna dari log swipe, satu blob per pengguna, lalu menulisnya
+    dengan `insert_sql` yang menerima (user_id, data, size).
+    """
+    rows: List[Tuple[int, bytes, int]] = []
+    current_user: Optional[int] = None
+    current = array("q")
+
+    def finish() -> None:
+        if current_user is not None:
+            rows.append((current_user, SeenSet.encode_ids(current), len(current)))
+
+    # Urutan PRIMARY KEY (swiper_id, swiped_id) membuat id setiap pengguna sudah terurut.
+    async with db.execute("SELECT swiper_id, swiped_id FROM swipes ORDER BY swiper_id, swiped_id") as cursor:
+        while True:
+            chunk = await cursor.fetchmany(SEEN_BACKFILL_CHUNK)
+            if not chunk:
+                break
+            for swiper_id, swiped_id in chunk:
+                if swiper_id != current_user:
+                    finish()
+                    current_user, current = swiper_id, array("q")
+                current.append(swiped_id)
+            await db.executemany(insert_sql, rows)
+            rows.clear()
+    finish()
+    await db.executemany(insert_sql, rows)
+
+
+async def rebuild_seen_sets(db: aiosqlite.Connection) -> None:
+    """Mengganti semua chunk seen-set dengan satu chunk per pengguna dari log swipe (impor massal)."""
+    await db.execute("DELETE FROM seen_set_chunks")
+    await backfill_seen_sets(
+        db, "INSERT INTO seen_set_chunks (user_id, chunk, data, size) VALUES (?, 0, ?, ?)"
+    )
+
+
+# --- Buffer Swipe ---
+
+# Buffer swipe ditulis ke database setiap interval ini, atau lebih cepat jika sudah penuh.
+SWIPE_FLUSH_INTERVAL_MS = 200
+SWIPE_FLUSH_MAX_ROWS = 500
+
+
+class SwipeBuffer:
+    """
+    Menampung swipe di memori lalu menuliskannya sekaligus dalam satu transaksi.
+
+    Satu `executemany` + `commit` per batch jauh lebih murah daripada satu transaksi
+    per swipe. Pemeriksaan swipe ganda memakai SeenSetStore, yang langsung mencatat
+    swipe yang masih di buffer, dan like langsung dicatat ke LikeIndex. Like yang
+    membentuk mutual like dan seen-set yang berubah ditulis dalam transaksi yang sama.
+
+    Dalam mode sharding, like untuk pengguna di shard lain juga diteruskan ke shard
+    pemiliknya (lihat `add_remote_like`).
+    """
+
+    def __init__(
+        self,
+        pool: DatabasePool,
+        likes: LikeIndex,
+        seen: SeenSetStore,
+        flush_interval_ms: int = SWIPE_FLUSH_INTERVAL_MS,
+        max_rows: int = SWIPE_FLUSH_MAX_ROWS,
+        peers: Optional["ShardPeers"] = None,
+    ):
+        self.pool = pool
+        self.likes = likes
+        self.seen = seen
+        self.peers = peers
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_rows = max_rows
+        # (swiper_id, swiped_id) -> (action, swipe_date)
+        self._pending: Dict[Tuple[int, int], Tuple[str, str]] = {}
+        # (user_id, match_id) -> matched_at, disimpan dua arah.
+        self._pending_matches: Dict[Tuple[int, int], str] = {}
+        # Pengguna yang menerima like atau match yang belum tertulis ke database.
+        self._pending_recipients: Set[int] = set()
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Menjalankan loop flush di background."""
+        self._task = asyncio.create_task(self._run())
+
+    async def add(self, swiper_id: int, swiped_id: int, action: str) -> bool:
+        """
+        Mencatat swipe ke buffer.
+        Mengembalikan False jika pengguna sudah pernah swipe profil yang sama.
+        """
+        if not await self.seen.add(swiper_id, swiped_id):
+            return False
+
+        # swipe_date diisi sekarang (format sama dengan CURRENT_TIMESTAMP) agar urutan
+        # waktu swipe tidak bergeser karena penundaan flush.
+        swipe_date = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+        self._pending[(swiper_id, swiped_id)] = (action, swipe_date)
+        self.likes.record_swipe(swiper_id, action)
+        if action == "like":
+            self.likes.add_like(swiper_id, swiped_id)
+            self._pending_recipients.add(swiped_id)
+            matched = self.likes.has_liked(swiped_id, swiper_id)
+            if matched:
+                self._record_match(swiper_id, swiped_id, swipe_date)
+            if self.peers is not None and not self.peers.owns(swiped_id):
+                # Dikirim ulang sampai dibalas; add_remote_like mengabaikan like yang sudah tercatat.
+                self.peers.deliver_to_owner(
+                    swiped_id,
+                    {
+                        "op": "like",
+                        "swiper_id": swiper_id,
+                        "swiped_id": swiped_id,
+                        "swipe_date": swipe_date,
+                        "matched": matched,
+                    },
+                )
+        if len(self._pending) >= self.max_rows:
+            self._wakeup.set()
+        return True
+
+    def add_remote_like(self, swiper_id: int, swiped_id: int, swipe_date: str, matched: bool) -> bool:
+        """
+        Mencatat like dari pengguna di shard lain untuk pengguna milik shard ini.
+
+        `matched` berarti shard pengirim sudah mendeteksi mutual like dan mengirim notifikasi.
+        Jika kedua pengguna saling like hampir bersamaan, kedua shard baru melihat mutual like
+        saat menerima like dari shard lain; hanya shard pemilik user_id yang lebih kecil yang
+        memberi notifikasi. Mengembalikan True jika shard ini yang harus memberi notifikasi match.
+        """
+        if self.likes.has_liked(swiper_id, swiped_id):
+            return False
+        self._pending[(swiper_id, swiped_id)] = ("like", swipe_date)
+        self.likes.add_like(swiper_id, swiped_id)
+        self._pending_recipients.add(swiped_id)
+        if len(self._pending) >= self.max_rows:
+            self._wakeup.set()
+        if not self.likes.has_liked(swiped_id, swiper_id):
+            return False
+        self._record_match(swiper_id, swiped_id, swipe_date)
+        return not matched and swiped_id < swiper_id
+
+    def _record_match(self, swiper_id: int, swiped_id: int, matched_at: str) -> None:
+        self._pending_matches[(swiper_id, swiped_id)] = matched_at
+        self._pending_matches[(swiped_id, swiper_id)] = matched_at
+        self._pending_recipients.add(swiper_id)
+        self.likes.record_match(swiper_id, swiped_id)
+
+    def has_pending_for(self, user_id: int) -> bool:
+        """Apakah ada like atau match untuk pengguna ini yang masih di buffer."""
+        return user_id in self._pending_recipients
+
+    async def flush(self) -> None:
+        """Menulis semua swipe di buffer dalam satu transaksi."""
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            flushing, self._pending = self._pending, {}
+            matches, self._pending_matches = self._pending_matches, {}
+            recipients, self._pending_recipients = self._pending_recipients, set()
+            rows = [
+                (swiper_id, swiped_id, action, swipe_date)
+                for (swiper_id, swiped_id), (action, swipe_date) in flushing.items()
+            ]
+            seen_writes = self.seen.take_dirty()
+            committed = False
+            try:
+                async with self.pool.write() as db:
+                    await db.executemany(
+                        "INSERT OR IGNORE INTO swipes (swiper_id, swiped_id, action, swipe_date) VALUES (?, ?, ?, ?)",
+                        rows,
+                    )
+                    await db.executemany(
+                        "INSERT OR IGNORE INTO matches (user_id, match_id, matched_at) VALUES (?, ?, ?)",
+                        [(user_id, match_id, matched_at) for (user_id, match_id), matched_at in matches.items()],
+                    )
+                    await db.executemany(
+                        "DELETE FROM seen_set_chunks WHERE user_id = ? AND chunk >= ?", seen_writes.deletes
+                    )
+                    await db.executemany(SEEN_CHUNK_INSERT_SQL, seen_writes.rows)
+                    await db.commit()
+                committed = True
+            except aiosqlite.Error as e:
+                logger.error(f"Database error on flushing {len(rows)} swipes: {e}")
+            finally:
+                # Gagal atau dibatalkan: kembalikan ke buffer agar dicoba lagi pada flush berikutnya.
+                if not committed:
+                    self._pending = {**flushing, **self._pending}
+                    self._pending_matches = {**matches, **self._pending_matches}
+                    self._pending_recipients |= recipients
+                self.seen.finish_flush(seen_writes, committed)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def close(self) -> None:
+        """Menghentikan loop flush dan menulis sisa buffer."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        await self.flush()
+
+
+# --- Antrean Pesan Keluar ---
+
+# Batas resmi Telegram: sekitar 30 pesan/detik secara global dan 1 pesan/detik per chat.
+# Batas per chat berlaku untuk pesan baru (kartu berikutnya, notifikasi).
+OUTBOX_GLOBAL_RATE = 30
+OUTBOX_CHAT_RATE = 1
+OUTBOX_CHAT_BURST = 3
+# Edit pesan yang sudah ada (caption kartu yang baru di-swipe) tidak menambah pesan di chat,
+# jadi punya bucket per chat sendiri; tanpa ini satu swipe (edit + kartu baru) memakai dua
+# token dan user tertahan di ~0.5 swipe/detik. Edit tetap dihitung dalam batas global.
+OUTBOX_CHAT_EDIT_RATE = 1
+OUTBOX_CHAT_EDIT_BURST = 3
+OUTBOX_WORKERS = 8
+OUTBOX_MAX_RETRIES = 5
+OUTBOX_BACKOFF_BASE_SECONDS = 0.5
+
+# Prioritas: angka kecil dikirim lebih dulu.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_NOTIFICATION = 1
+# Method yang tidak dihitung dalam batas pesan Telegram; tetap lewat antrean (dan ikut jeda flood).
+OUTBOX_UNLIMITED_METHODS = {"answer_callback_query"}
+OUTBOX_EDIT_METHODS = {"edit_message_caption", "edit_message_text", "edit_message_reply_markup", "edit_message_media"}
+
+
+class TokenBucket:
+    """Token bucket sederhana: `rate` token per detik, maksimal `capacity` token."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Mengambil satu token. Mengembalikan 0 jika berhasil, atau detik yang harus ditunggu."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class OutboundMessage:
+    """Satu panggilan Bot API yang menunggu giliran dikirim."""
+
+    def __init__(self, method: Callable[..., Awaitable[Any]], kwargs: Dict[str, Any], future: Optional[asyncio.Future]):
+        self.method = method
+        self.kwargs = kwargs
+        self.chat_id = kwargs.get("chat_id")
+        name = getattr(method, "__name__", "")
+        self.limited = name not in OUTBOX_UNLIMITED_METHODS
+        # Kunci bucket per chat: (chat_id, apakah edit). None jika tidak dibatasi per chat.
+        self.chat_key: Optional[Tuple[int, bool]] = (
+            (self.chat_id, name in OUTBOX_EDIT_METHODS) if self.limited and self.chat_id is not None else None
+        )
+        self.future = future
+        self.attempts = 0
+        # True jika pesan baru dilepas dari antrean tunggu chat-nya dan boleh mendahului.
+        self.released = False
+
+
+class MessageScheduler:
+    """
+    Antrean pesan keluar dengan rate limit global dan per chat (pesan baru dan edit
+    masing-masing punya bucket per chat sendiri).
+
+    - `send()` untuk balasan interaktif: prioritas tinggi, hasilnya ditunggu oleh handler.
+    - `notify()` untuk notifikasi: prioritas rendah, fire-and-forget.
+
+    RetryAfter dari Telegram menghentikan semua pengiriman selama waktu yang diminta lalu
+    pesan dicoba lagi; error jaringan dicoba ulang dengan exponential backoff.
+
+    Setiap pesan dihitung belum selesai sampai terkirim atau gagal, termasuk selama
+    menunggu di antrean chat atau menunggu retry, sehingga `close()` bisa menunggu semuanya.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = OUTBOX_GLOBAL_RATE,
+        chat_rate: float = OUTBOX_CHAT_RATE,
+        chat_burst: float = OUTBOX_CHAT_BURST,
+        edit_rate: float = OUTBOX_CHAT_EDIT_RATE,
+        edit_burst: float = OUTBOX_CHAT_EDIT_BURST,
+        workers: int = OUTBOX_WORKERS,
+        max_retries: int = OUTBOX_MAX_RETRIES,
+        metrics: Optional["MetricsRegistry"] = None,
+    ):
+        self.metrics = metrics
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.edit_rate = edit_rate
+        self.edit_burst = edit_burst
+        self.worker_count = workers
+        self.max_retries = max_retries
+        self._chat_buckets: Dict[Tuple[int, bool], TokenBucket] = {}
+        # Pesan untuk chat yang sedang terkena rate limit, menunggu giliran sesuai urutan masuk.
+        self._chat_waiting: Dict[Tuple[int, bool], Deque[Tuple[int, OutboundMessage]]] = {}
+        self._queue: "asyncio.PriorityQueue[Tuple[int, int, OutboundMessage]]" = asyncio.PriorityQueue()
+        self._sequence = itertools.count()
+        self._paused_until = 0.0
+        self._workers: List[asyncio.Task] = []
+        self._unfinished: Set[OutboundMessage] = set()
+        self._drained = asyncio.Event()
+        self._drained.set()
+        self._closed = False
+        self.stats = {"sent": 0, "retried": 0, "failed": 0, "flood_waits": 0}
+
+    def start(self) -> None:
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+
+    async def send(self, method: Callable[..., Awaitable[Any]], **kwargs: Any) -> Any:
+        """Mengirim balasan interaktif dan menunggu hasilnya (misal: objek Message)."""
+        future = asyncio.get_running_loop().create_future()
+        self._submit(PRIORITY_INTERACTIVE, OutboundMessage(method, kwargs, future))
+        return await future
+
+    def notify(self, method: Callable[..., Awaitable[Any]], **kwargs: Any) -> None:
+        """Menjadwalkan notifikasi tanpa menunggu hasilnya; error hanya dicatat di log."""
+        self._submit(PRIORITY_NOTIFICATION, OutboundMessage(method, kwargs, None))
+
+    def _submit(self, priority: int, message: OutboundMessage) -> None:
+        if self._closed:
+            self._drop(message)
+            return
+        self._unfinished.add(message)
+        self._drained.clear()
+        self._enqueue(priority, message)
+
+    def _enqueue(self, priority: int, message: OutboundMessage) -> None:
+        # Retry atau pelepasan antrean chat yang jatuh tempo setelah close() tidak dikirim lagi.
+        if not self._closed:
+            self._queue.put_nowait((priority, next(self._sequence), message))
+
+    def _finish(self, message: OutboundMessage) -> None:
+        self._unfinished.discard(message)
+        if not self._unfinished:
+            self._drained.set()
+
+    def _drop(self, message: OutboundMessage) -> None:
+        """Membatalkan pesan saat scheduler berhenti; handler yang menunggu mendapat CancelledError."""
+        self._finish(message)
+        if message.future is not None:
+            message.future.cancel()
+
+    def _requeue_later(self, delay: float, priority: int, message: OutboundMessage) -> None:
+        asyncio.get_running_loop().call_later(delay, self._enqueue, priority, message)
+
+    def _release_chat(self, chat_key: Tuple[int, bool]) -> None:
+        """Memasukkan kembali pesan terdepan dari antrean tunggu sebuah chat."""
+        waiting = self._chat_waiting.get(chat_key)
+        if not waiting:
+            self._chat_waiting.pop(chat_key, None)
+            return
+        priority, message = waiting.popleft()
+        message.released = True
+        self._enqueue(priority, message)
+
+    def _chat_bucket(self, chat_key: Tuple[int, bool]) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_key)
+        if bucket is None:
+            # Bucket yang sudah penuh kembali sama saja dengan bucket baru, jadi aman dibuang.
+            if len(self._chat_buckets) > 10_000:
+                now = time.monotonic()
+                self._chat_buckets = {
+                    key: b for key, b in self._chat_buckets.items()
+                    if b.tokens + (now - b.updated) * b.rate < b.capacity
+                }
+            if chat_key[1]:
+                bucket = TokenBucket(self.edit_rate, self.edit_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chat_buckets[chat_key] = bucket
+        return bucket
+
+    async def _worker(self) -> None:
+        while True:
+            priority, _, message = await self._queue.get()
+            try:
+                await self._process(priority, message)
+            except Exception as e:  # Worker tidak boleh mati karena satu pesan.
+                logger.exception(f"Unexpected error in outbound worker: {e}")
+                self._fail(message, e)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, priority: int, message: OutboundMessage) -> None:
+        # Pesan untuk chat yang sedang dibatasi ditahan di antrean tunggu chat tersebut
+        # (urutan tetap terjaga) agar worker bebas melayani chat lain.
+        chat_key = message.chat_key
+        if chat_key is not None:
+            waiting = self._chat_waiting.get(chat_key)
+            if waiting is not None and not message.released:
+                waiting.append((priority, message))
+                return
+            message.released = False
+            wait = self._chat_bucket(chat_key).try_acquire()
+            if wait > 0:
+                if waiting is None:
+                    waiting = self._chat_waiting[chat_key] = deque()
+                waiting.appendleft((priority, message))
+                asyncio.get_running_loop().call_later(wait, self._release_chat, chat_key)
+                return
+            if waiting is not None:
+                self._release_chat(chat_key)
+
+        while True:
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if not message.limited:
+                break
+            wait = self.global_bucket.try_acquire()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+
+        message.attempts += 1
+        started = time.perf_counter()
+        try:
+            result = await message.method(**message.kwargs)
+        except RetryAfter as e:
+            retry_after = e.retry_after
+            if isinstance(retry_after, datetime.timedelta):
+                retry_after = retry_after.total_seconds()
+            logger.warning(f"Flood limit hit, pausing outbound messages for {retry_after}s.")
+            self.stats["flood_waits"] += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            self._retry_or_fail(priority, message, e, delay=retry_after)
+            return
+        except BadRequest as e:
+            # Turunan NetworkError di PTB, tetapi request yang salah tidak akan berhasil jika diulang.
+            self._fail(message, e)
+            return
+        except NetworkError as e:
+            self._retry_or_fail(
+                priority, message, e, delay=OUTBOX_BACKOFF_BASE_SECONDS * 2 ** (message.attempts - 1)
+            )
+            return
+        except TelegramError as e:
+            # BadRequest, Forbidden (bot diblokir), dll. tidak akan berhasil jika diulang.
+            self._fail(message, e)
+            return
+
+        self.stats["sent"] += 1
+        self._finish(message)
+        if self.metrics is not None:
+            method_name = getattr(message.method, "__name__", "unknown")
+            self.metrics.observe(
+                "bot_telegram_api_duration_seconds", {"method": method_name}, time.perf_counter() - started
+            )
+        if message.future is not None and not message.future.done():
+            message.future.set_result(result)
+
+    def _retry_or_fail(self, priority: int, message: OutboundMessage, error: Exception, delay: float) -> None:
+        if message.attempts > self.max_retries:
+            self._fail(message, error)
+            return
+        self.stats["retried"] += 1
+        self._requeue_later(delay, priority, message)
+
+    def _fail(self, message: OutboundMessage, error: Exception) -> None:
+        self.stats["failed"] += 1
+        self._finish(message)
+        if message.future is not None:
+            if not message.future.done():
+                message.future.set_exception(error)
+        else:
+            logger.warning(f"Dropping notification to {message.chat_id}: {error}")
+
+    def pending(self) -> int:
+        """Jumlah pesan yang belum terkirim atau gagal, termasuk yang menunggu giliran chat atau retry."""
+        return len(self._unfinished)
+
+    async def close(self, timeout: float = 5.0) -> None:
+        """
+        Menunggu semua pesan selesai (termasuk yang ditahan rate limit chat atau menunggu retry)
+        sebelum menghentikan worker. Pesan yang belum selesai setelah `timeout` dibatalkan.
+        """
+        try:
+            await asyncio.wait_for(self._drained.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Outbound queue not drained on shutdown, {len(self._unfinished)} messages dropped.")
+        self._closed = True
+        for message in list(self._unfinished):
+            self._drop(message)
+        for worker in self._workers:
+            worker.cancel()
+
+
+# Pembungkus untuk balasan dari handler. Semuanya lewat antrean pesan keluar (prioritas
+# interaktif) dengan chat_id eksplisit, agar ikut rate limit global dan per chat.
+async def reply(update: Update, context: ContextTypes.DEFAULT_TYPE, text: str, **kwargs: Any) -> Any:
+    """Mengirim pesan teks ke chat asal update."""
+    return await context.bot_data["outbox"].send(
+        context.bot.send_message, chat_id=update.effective_chat.id, text=text, **kwargs
+    )
+
+
+async def reply_photo(update: Update, context: ContextTypes.DEFAULT_TYPE, photo: str, **kwargs: Any) -> Any:
+    """Mengirim foto ke chat asal update."""
+    return await context.bot_data["outbox"].send(
+        context.bot.send_photo, chat_id=update.effective_chat.id, photo=photo, **kwargs
+    )
+
+
+async def answer_query(context: ContextTypes.DEFAULT_TYPE, query: Any, **kwargs: Any) -> Any:
+    """Menjawab callback query (menghentikan indikator loading di aplikasi Telegram)."""
+    return await context.bot_data["outbox"].send(
+        context.bot.answer_callback_query, callback_query_id=query.id, **kwargs
+    )
+
+
+async def edit_query_text(context: ContextTypes.DEFAULT_TYPE, query: Any, text: str, **kwargs: Any) -> Any:
+    """Mengganti teks pesan yang tombolnya ditekan."""
+    return await context.bot_data["outbox"].send(
+        context.bot.edit_message_text,
+        chat_id=query.message.chat.id,
+        message_id=query.message.message_id,
+        text=text,
+        **kwargs,
+    )
+
+
+async def edit_query_caption(context: ContextTypes.DEFAULT_TYPE, query: Any, caption: str, **kwargs: Any) -> Any:
+    """Mengganti caption pesan foto yang tombolnya ditekan."""
+    return await context.bot_data["outbox"].send(
+        context.bot.edit_message_caption,
+        chat_id=query.message.chat.id,
+        message_id=query.message.message_id,
+        caption=caption,
+        **kwargs,
+    )
+
+
+# --- Pembatasan Update per Pengguna ---
+
+# Setiap pengguna boleh mengirim burst hingga USER_BURST update, lalu USER_RATE update/detik.
+USER_RATE = float(os.getenv("USER_RATE", "3"))
+USER_BURST = float(os.getenv("USER_BURST", "10"))
+# callback_data yang sama dari pengguna yang sama dalam jendela ini dianggap duplikat.
+# Hanya tombol swipe: tombol lain (misal halaman daftar) boleh ditekan ulang dengan sengaja.
+CALLBACK_DEDUPE_SECONDS = 5.0
+CALLBACK_DEDUPE_KEYS = 8
+CALLBACK_DEDUPE_PREFIXES = ("match_",)
+# Jumlah pengguna yang state-nya disimpan; pengguna yang paling lama diam dibuang lebih dulu.
+ADMISSION_MAX_USERS = int(os.getenv("ADMISSION_MAX_USERS", "50000"))
+
+
+class UserAdmission:
+    """State pembatasan satu pengguna: token bucket dan callback_data yang baru diterima."""
+
+    __slots__ = ("bucket", "recent_callbacks")
+
+    def __init__(self, rate: float, burst: float):
+        self.bucket = TokenBucket(rate, burst)
+        # callback_data -> waktu diterima (monotonic), urut dari yang terlama
+        self.recent_callbacks: "OrderedDict[str, float]" = OrderedDict()
+
+
+class AdmissionController:
+    """
+    Lapisan penerimaan di memori yang dijalankan sebelum semua handler.
+
+    Update ditolak (tanpa menyentuh database maupun Bot API) jika:
+    - callback_data tombol swipe yang sama sudah diterima dari pengguna ini dalam
+      CALLBACK_DEDUPE_SECONDS terakhir, misal tombol ❤️ yang ditekan berulang kali sebelum
+      kartunya diganti; atau
+    - token bucket pengguna sedang kosong.
+
+    Callback query yang ditolak tetap dijawab oleh `admission_check` agar indikator
+    loading di aplikasi Telegram berhenti.
+
+    State disimpan per pengguna dalam LRU berkapasitas `max_users`. Bucket pengguna yang
+    diam akan penuh kembali, jadi membuangnya tidak mengubah perilaku bagi pengguna itu.
+    """
+
+    def __init__(
+        self,
+        rate: float = USER_RATE,
+        burst: float = USER_BURST,
+        dedupe_seconds: float = CALLBACK_DEDUPE_SECONDS,
+        max_users: int = ADMISSION_MAX_USERS,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.dedupe_seconds = dedupe_seconds
+        self.max_users = max_users
+        self._users: "OrderedDict[int, UserAdmission]" = OrderedDict()
+        self.stats = {"admitted": 0, "throttled": 0, "deduplicated": 0, "evicted": 0}
+
+    def _state(self, user_id: int) -> UserAdmission:
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = UserAdmission(self.rate, self.burst)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.stats["evicted"] += 1
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def admit(self, update: Update) -> bool:
+        """Mengembalikan True jika update boleh diproses handler."""
+        if update.effective_user is None:
+            return True
+        state = self._state(update.effective_user.id)
+
+        data = update.callback_query.data if update.callback_query is not None else None
+        if data is not None and not data.startswith(CALLBACK_DEDUPE_PREFIXES):
+            data = None
+        if data is not None:
+            now = time.monotonic()
+            recent = state.recent_callbacks
+            while recent and now - next(iter(recent.values())) > self.dedupe_seconds:
+                recent.popitem(last=False)
+            if data in recent:
+                self.stats["deduplicated"] += 1
+                return False
+
+        # Duplikat tidak memakai token, agar tombol yang ditekan berkali-kali tidak ikut
+        # menghabiskan jatah update lain dari pengguna yang sama.
+        if state.bucket.try_acquire() > 0:
+            self.stats["throttled"] += 1
+            return False
+
+        if data is not None:
+            recent[data] = now
+            if len(recent) > CALLBACK_DEDUPE_KEYS:
+                recent.popitem(last=False)
+        self.stats["admitted"] += 1
+        return True
+
+    def tracked_users(self) -> int:
+        return len(self._users)
+
+
+async def admission_check(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handler grup -1: menghentikan update yang ditolak sebelum sampai ke handler lain."""
+    admission: Optional[AdmissionController] = context.bot_data.get("admission")
+    if admission is not None and not admission.admit(update):
+        logger.debug(f"Dropped update {update.update_id} from user {update.effective_user.id}.")
+        if update.callback_query is not None:
+            # Fire-and-forget: jawaban kosong hanya menghentikan indikator loading tombol.
+            context.bot_data["outbox"].notify(
+                context.bot.answer_callback_query, callback_query_id=update.callback_query.id
+            )
+        raise ApplicationHandlerStop
+
+
+# --- Instrumentasi Performa ---
+
+# Instrumentasi hanya dipasang jika diaktifkan; saat nonaktif tidak ada pembungkus sama sekali.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+# Endpoint HTTP Prometheus hanya mendengarkan di localhost. Port 0 menonaktifkan endpoint.
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+# Query yang lebih lambat dari ini dicatat sebagai peringatan di log.
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "50"))
+# User ID (dipisah koma) yang boleh memakai perintah /metrics.
+ADMIN_USER_IDS = {int(x) for x in os.getenv("ADMIN_USER_IDS", "").split(",") if x.strip()}
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+STATE_NAMES = {
+    GENDER: "GENDER",
+    AGE: "AGE",
+    HOBBY: "HOBBY",
+    LOCATION: "LOCATION",
+    PHOTO: "PHOTO",
+    DESCRIPTION: "DESCRIPTION",
+    MENU: "MENU",
+    MATCHING: "MATCHING",
+    EDIT_PROFILE: "EDIT_PROFILE",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Histogram kumulatif dengan bucket tetap, kompatibel dengan format Prometheus."""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+
+def _escape_label(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+class MetricsRegistry:
+    """Kumpulan histogram dan counter berlabel, dirender dalam format teks Prometheus."""
+
+    def __init__(self):
+        self.histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self.counters: Dict[str, Dict[Labels, float]] = {}
+
+    def observe(self, name: str, labels: Dict[str, str], value: float) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self.histograms.setdefault(name, {})
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, labels: Dict[str, str], amount: float = 1) -> None:
+        key = tuple(sorted(labels.items()))
+        series = self.counters.setdefault(name, {})
+        series[key] = series.get(key, 0) + amount
+
+    @staticmethod
+    def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{_escape_label(value)}"' for key, value in pairs) + "}"
+
+    def render(self, gauges: Optional[Dict[str, Dict[Labels, float]]] = None) -> str:
+        lines: List[str] = []
+        for name, series in self.histograms.items():
+            lines.append(f"# TYPE {name} histogram")
+            for labels, histogram in series.items():
+                cumulative = 0
+                for bound, count in zip(histogram.buckets, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._format_labels(labels, ('le', str(bound)))} {cumulative}")
+                lines.append(f"{name}_bucket{self._format_labels(labels, ('le', '+Inf'))} {histogram.count}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {histogram.count}")
+        for kind, families in (("counter", self.counters), ("gauge", gauges or {})):
+            for name, series in families.items():
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in series.items():
+                    lines.append(f"{name}{self._format_labels(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+_SQL_LITERAL = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SQL_IN_LIST = re.compile(r"IN \((?:\?, ?)*\?\)", re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=1024)
+def sql_fingerprint(sql: str) -> str:
+    """Menormalkan SQL (spasi, literal, daftar IN) agar query sejenis berbagi satu label."""
+    normalized = " ".join(sql.split())
+    normalized = _SQL_LITERAL.sub("?", normalized)
+    normalized = _SQL_IN_LIST.sub("IN (...)", normalized)
+    return normalized[:160]
+
+
+class _TimedCursor:
+    """
+    Membungkus cursor aiosqlite agar durasi query dihitung sejak execute sampai hasilnya
+    habis dibaca (fetchone mengembalikan None, fetchall, fetchmany yang tidak penuh,
+    iterasi selesai) atau cursor ditutup/dibuang, bukan hanya sampai execute kembali.
+    """
+
+    def __init__(self, cursor: aiosqlite.Cursor, started: float, record: Callable[[float, bool], None]):
+        self._cursor = cursor
+        self._started = started
+        self._record: Optional[Callable[[float, bool], None]] = record
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._cursor, name)
+
+    def _finish(self, failed: bool = False) -> None:
+        record, self._record = self._record, None
+        if record is not None:
+            record(time.perf_counter() - self._started, failed)
+
+    async def _fetch(self, fetch: Awaitable[Any]) -> Any:
+        try:
+            return await fetch
+        except Exception:
+            self._finish(failed=True)
+            raise
+
+    async def fetchone(self) -> Any:
+        row = await self._fetch(self._cursor.fetchone())
+        if row is None:
+            self._finish()
+        return row
+
+    async def fetchmany(self, size: Optional[int] = None) -> Any:
+        size = self._cursor.arraysize if size is None else size
+        rows = await self._fetch(self._cursor.fetchmany(size))
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    async def fetchall(self) -> Any:
+        rows = await self._fetch(self._cursor.fetchall())
+        self._finish()
+        return rows
+
+    async def __aiter__(self) -> AsyncIterator[Any]:
+        while True:
+            rows = await self.fetchmany()
+            for row in rows:
+                yield row
+            if len(rows) < self._cursor.arraysize:
+                return
+
+    async def close(self) -> None:
+        try:
+            await self._cursor.close()
+        finally:
+            self._finish()
+
+    async def __aenter__(self) -> "_TimedCursor":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    def __del__(self) -> None:
+        # Cursor yang dibuang tanpa dibaca sampai habis (misal hasil UPDATE) tetap tercatat.
+        self._finish()
+
+
+class _TimedResult:
+    """Membungkus hasil `execute` aiosqlite: bisa di-await maupun dipakai dengan `async with`."""
+
+    def __init__(self, result: Any, record: Callable[[float, bool], None]):
+        self._result = result
+        self._record = record
+        self._cursor: Any = None
+
+    async def _run(self) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await self._result
+        except Exception:
+            self._record(time.perf_counter() - started, True)
+            raise
+        if isinstance(result, aiosqlite.Cursor):
+            return _TimedCursor(result, started, self._record)
+        # commit/rollback tidak menghasilkan cursor, jadi langsung dicatat.
+        self._record(time.perf_counter() - started, False)
+        return result
+
+    def __await__(self):
+        return self._run().__await__()
+
+    async def __aenter__(self) -> Any:
+        self._cursor = await self._run()
+        return self._cursor
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self._cursor.close()
+
+
+class InstrumentedConnection:
+    """
+    Proxy koneksi aiosqlite yang mengukur setiap execute/commit per fingerprint SQL,
+    termasuk waktu membaca hasilnya (lihat `_TimedCursor`).
+    """
+
+    def __init__(self, db: aiosqlite.Connection, metrics: MetricsRegistry):
+        self._db = db
+        self._metrics = metrics
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._db, name)
+
+    def _recorder(self, statement: str) -> Callable[[float, bool], None]:
+        def record(elapsed: float, failed: bool) -> None:
+            labels = {"statement": statement}
+            self._metrics.observe("bot_db_query_duration_seconds", labels, elapsed)
+            if failed:
+                self._metrics.inc("bot_db_query_errors_total", labels)
+            if elapsed * 1000 > SLOW_QUERY_MS:
+                logger.warning(f"Slow query ({elapsed * 1000:.1f} ms): {statement}")
+
+        return record
+
+    def execute(self, sql: str, parameters: Any = None) -> _TimedResult:
+        return _TimedResult(self._db.execute(sql, parameters), self._recorder(sql_fingerprint(sql)))
+
+    def executemany(self, sql: str, parameters: Any) -> _TimedResult:
+        return _TimedResult(self._db.executemany(sql, parameters), self._recorder(sql_fingerprint(sql)))
+
+    def executescript(self, sql_script: str) -> _TimedResult:
+        return _TimedResult(self._db.executescript(sql_script), self._recorder(sql_fingerprint(sql_script)))
+
+    async def commit(self) -> None:
+        await _TimedResult(self._db.commit(), self._recorder("COMMIT"))
+
+    async def rollback(self) -> None:
+        await _TimedResult(self._db.rollback(), self._recorder("ROLLBACK"))
+
+
+def _timed_callback(callback: Callable, handler_name: str, state_name: str, metrics: MetricsRegistry) -> Callable:
+    @functools.wraps(callback)
+    async def wrapper(update: object, context: ContextTypes.DEFAULT_TYPE) -> Any:
+        labels = {"handler": handler_name, "state": state_name}
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            metrics.inc("bot_handler_errors_total", labels)
+            raise
+        finally:
+            metrics.observe("bot_handler_duration_seconds", labels, time.perf_counter() - started)
+
+    return wrapper
+
+
+def instrument_handler(handler: BaseHandler, metrics: MetricsRegistry, state_name: str = "none") -> None:
+    """
+    Membungkus callback setiap handler (termasuk di dalam ConversationHandler bertingkat)
+    agar latensi dan error-nya tercatat dengan label nama handler dan state percakapan.
+    """
+    if isinstance(handler, ConversationHandler):
+        for entry in handler.entry_points:
+            instrument_handler(entry, metrics, "ENTRY")
+        for state, handlers in handler.states.items():
+            for child in handlers:
+                instrument_handler(child, metrics, STATE_NAMES.get(state, str(state)))
+        for fallback in handler.fallbacks:
+            instrument_handler(fallback, metrics, "FALLBACK")
+        return
+    callback = getattr(handler, "callback", None)
+    # Callback sinkron (misal lambda) tidak di-await oleh PTB, jadi dibiarkan apa adanya.
+    if callback is not None and asyncio.iscoroutinefunction(callback):
+        handler.callback = _timed_callback(callback, callback.__name__, state_name, metrics)
+
+
+def collect_gauges(app: Application) -> Dict[str, Dict[Labels, float]]:
+    """Mengambil statistik komponen lain (pool, cache, antrean pesan) sebagai gauge."""
+    gauges: Dict[str, Dict[Labels, float]] = {}
+    pool: Optional[DatabasePool] = app.bot_data.get("pool")
+    if pool is not None:
+        for kind, stats in pool.stats().items():
+            for stat, value in stats.items():
+                gauges.setdefault(f"bot_db_pool_{stat}", {})[(("kind", kind),)] = value
+    cards: Optional[ProfileCardCache] = app.bot_data.get("cards")
+    if cards is not None:
+        for stat, value in cards.stats().items():
+            gauges[f"bot_profile_cache_{stat}"] = {(): value}
+    seen: Optional[SeenSetStore] = app.bot_data.get("seen")
+    if seen is not None:
+        for stat, value in seen.stats().items():
+            gauges[f"bot_seen_cache_{stat}"] = {(): value}
+    decks: Optional[CandidateDeckManager] = app.bot_data.get("decks")
+    if decks is not None:
+        for source, value in decks.fill_stats.items():
+            gauges.setdefault("bot_deck_fills_total", {})[(("source", source),)] = value
+    admission: Optional[AdmissionController] = app.bot_data.get("admission")
+    if admission is not None:
+        for stat, value in admission.stats.items():
+            gauges[f"bot_admission_{stat}_total"] = {(): value}
+        gauges["bot_admission_tracked_users"] = {(): admission.tracked_users()}
+    jobs: Optional[JobStats] = app.bot_data.get("jobs")
+    if jobs is not None:
+        for name, stats in jobs.stats().items():
+            for stat, value in stats.items():
+                gauges.setdefault(f"bot_job_{stat}", {})[(("job", name),)] = value
+    outbox: Optional[MessageScheduler] = app.bot_data.get("outbox")
+    if outbox is not None:
+        for stat, value in outbox.stats.items():
+            gauges[f"bot_outbox_{stat}"] = {(): value}
+        gauges["bot_outbox_queue_size"] = {(): outbox.pending()}
+    return gauges
+
+
+def render_metrics(app: Application) -> str:
+    return app.bot_data["metrics"].render(collect_gauges(app))
+
+
+async def start_metrics_server(app: Application, host: str, port: int) -> asyncio.AbstractServer:
+    """Endpoint HTTP minimal yang menyajikan metrics dalam format teks Prometheus."""
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            # Cukup baca header request; isi request tidak dipakai.
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5)
+            body = render_metrics(app).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Content-Type: text/plain; version=0.0.4\r\n"
+                + f"Content-Length: {len(body)}\r\n".encode()
+                + b"Connection: close\r\n\r\n"
+                + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    server = await asyncio.start_server(handle, host, port)
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return server
+
+
+# --- Persistensi State Percakapan ---
+
+# Interval (detik) Application mengirim perubahan user_data dan state percakapan ke persistence.
+PERSISTENCE_INTERVAL_SECONDS = float(os.getenv("PERSISTENCE_INTERVAL_SECONDS", "1"))
+# State tempat pengguna terdaftar menetap, per nama ConversationHandler. State ini tidak
+# disimpan; setelah restart dipulihkan dari tabel users (lihat ResumingConversationHandler).
+SETTLED_CONVERSATION_STATES: Dict[str, Tuple[int, ...]] = {"main": (MENU, MATCHING)}
+
+
+class SQLitePersistence(BasePersistence):
+    """
+    Menyimpan state ConversationHandler dan `context.user_data` ke SQLite agar pengguna
+    tidak terlempar ke /start setiap kali bot di-restart.
+
+    - user_data dimuat per pengguna saat update pertamanya masuk (`refresh_user_data`),
+      bukan seluruhnya saat startup, sehingga waktu startup tidak ikut tumbuh.
+    - Hanya percakapan yang sedang berjalan (registrasi, edit profil) yang disimpan dan
+      dimuat saat startup. State menetap di SETTLED_CONVERSATION_STATES tidak disimpan;
+      pengguna terdaftar tanpa state dipulihkan ke state itu pada update pertamanya,
+      bersamaan dengan pemuatan user_data-nya, sehingga waktu startup tidak ikut tumbuh
+      dengan jumlah pengguna terdaftar.
+    - Hanya baris yang benar-benar berubah yang ditulis, dan semua perubahan dari satu
+      siklus `update_persistence` ditulis dalam satu transaksi.
+
+    bot_data, chat_data, dan callback_data tidak disimpan: bot_data berisi objek runtime
+    (pool, cache, antrean) yang dibuat ulang oleh `post_init`.
+
+    Persistence diinisialisasi sebelum `post_init`, jadi kelas ini memakai koneksinya
+    sendiri ke file database, terpisah dari DatabasePool.
+    """
+
+    def __init__(self, path: Optional[str] = None, update_interval: float = PERSISTENCE_INTERVAL_SECONDS):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self.path = path
+        self._db: Optional[aiosqlite.Connection] = None
+        self._connect_lock = asyncio.Lock()
+        self._write_lock = asyncio.Lock()
+        self._write_task: Optional[asyncio.Task] = None
+        # user_id -> JSON terakhir yang dimuat/ditulis; sekaligus penanda pengguna yang sudah dimuat.
+        self._stored_user_data: Dict[int, str] = {}
+        # user_id -> JSON baru, atau None untuk dihapus.
+        self._pending_users: Dict[int, Optional[str]] = {}
+        # (nama percakapan, key JSON) -> state JSON baru, atau None untuk dihapus.
+        self._pending_conversations: Dict[Tuple[str, str], Optional[str]] = {}
+        # (nama percakapan, key JSON) yang punya baris di database.
+        self._stored_conversations: Set[Tuple[str, str]] = set()
+        # Pengguna terdaftar yang sudah dimuat tetapi state percakapannya belum dipulihkan.
+        self._resumable_users: Set[int] = set()
+
+    async def _connection(self) -> aiosqlite.Connection:
+        async with self._connect_lock:
+            if self._db is None:
+                # Path dibaca saat koneksi dibuka agar DATABASE_FILE yang diubah (misal oleh load test) ikut terpakai.
+                db = await aiosqlite.connect(self.path or DATABASE_FILE)
+                # Koneksi ini bisa jadi yang pertama membuat file database (lihat DatabasePool.open).
+                await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                await db.execute("PRAGMA journal_mode=WAL")
+                await db.execute("PRAGMA synchronous=NORMAL")
+                await db.executescript(
+                    """
+                    CREATE TABLE IF NOT EXISTS persisted_user_data (
+                        user_id INTEGER PRIMARY KEY,
+                        data TEXT NOT NULL
+                    );
+                    CREATE TABLE IF NOT EXISTS persisted_conversations (
+                        name TEXT NOT NULL,
+                        conversation_key TEXT NOT NULL,
+                        state TEXT NOT NULL,
+                        PRIMARY KEY (name, conversation_key)
+                    ) WITHOUT ROWID;
+                    """
+                )
+                await db.commit()
+                self._db = db
+            return self._db
+
+    # State percakapan
+
+    async def get_conversations(self, name: str) -> Dict[Tuple[Any, ...], object]:
+        db = await self._connection()
+        settled = [json.dumps(state) for state in SETTLED_CONVERSATION_STATES.get(name, ())]
+        if settled:
+            # Baris state menetap dari versi yang masih menyimpannya; hanya terhapus sekali.
+            await db.execute(
+                f"DELETE FROM persisted_conversations WHERE name = ? AND state IN ({', '.join('?' * len(settled))})",
+                (name, *settled),
+            )
+            await db.commit()
+        async with db.execute(
+            "SELECT conversation_key, state FROM persisted_conversations WHERE name = ?", (name,)
+        ) as cursor:
+            rows = await cursor.fetchall()
+        self._stored_conversations.update((name, key) for key, _ in rows)
+        logger.info(f"Restored {len(rows)} in-progress '{name}' conversations.")
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def update_conversation(self, name: str, key: Tuple[Any, ...], new_state: Optional[object]) -> None:
+        if new_state in SETTLED_CONVERSATION_STATES.get(name, ()):
+            new_state = None
+        entry = (name, json.dumps(list(key)))
+        # Menghapus baris yang memang tidak ada (misal setiap pindah MENU <-> MATCHING) dilewati.
+        if new_state is None and entry not in self._stored_conversations and entry not in self._pending_conversations:
+            return
+        self._pending_conversations[entry] = None if new_state is None else json.dumps(new_state)
+        self._schedule_write()
+
+    def take_resumable(self, user_id: int) -> bool:
+        """
+        True sekali untuk pengguna terdaftar yang dimuat oleh `refresh_user_data`: state
+        menetapnya boleh dipulihkan jika percakapannya tidak punya state tersimpan.
+        """
+        if user_id in self._resumable_users:
+            self._resumable_users.discard(user_id)
+            return True
+        return False
+
+    # user_data
+
+    async def get_user_data(self) -> Dict[int, Dict[Any, Any]]:
+        # Sengaja kosong: data dimuat per pengguna di refresh_user_data.
+        return {}
+
+    async def refresh_user_data(self, user_id: int, user_data: Dict[Any, Any]) -> None:
+        if user_id in self._stored_user_data:
+            return
+        db = await self._connection()
+        async with db.execute(
+            "SELECT (SELECT data FROM persisted_user_data WHERE user_id = ?), "
+            "EXISTS (SELECT 1 FROM users WHERE user_id = ?)",
+            (user_id, user_id),
+        ) as cursor:
+            data, registered = await cursor.fetchone()
+        # Dicek ulang karena update lain dari pengguna yang sama bisa memuatnya lebih dulu.
+        if user_id in self._stored_user_data:
+            return
+        self._stored_user_data[user_id] = data if data is not None else "{}"
+        if registered:
+            self._resumable_users.add(user_id)
+        if data is not None:
+            for key, value in json.loads(data).items():
+                user_data.setdefault(key, value)
+
+    async def update_user_data(self, user_id: int, data: Dict[Any, Any]) -> None:
+        try:
+            encoded = json.dumps(data, sort_keys=True)
+        except (TypeError, ValueError) as e:
+            logger.error(f"user_data of user {user_id} is not JSON serializable, not persisted: {e}")
+            return
+        # Application menandai setiap pengguna yang mengirim update; tulis hanya jika isinya berubah.
+        if self._pending_users.get(user_id, self._stored_user_data.get(user_id)) == encoded:
+            return
+        self._pending_users[user_id] = encoded
+        self._schedule_write()
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._pending_users[user_id] = None
+        self._schedule_write()
+
+    # Penulisan
+
+    def _schedule_write(self) -> None:
+        # Semua update_* dari satu siklus update_persistence berjalan bersamaan; task tunggal
+        # ini baru menulis setelah semuanya selesai mengisi antrean. Perubahan yang masuk
+        # selagi task ini menulis diambil oleh putaran berikutnya dari task yang sama.
+        if self._write_task is None or self._write_task.done():
+            self._write_task = asyncio.create_task(self._write_pending())
+
+    async def _write_pending(self) -> None:
+        await asyncio.sleep(0)
+        async with self._write_lock:
+            while self._pending_users or self._pending_conversations:
+                if not await self._write_batch():
+                    # Gagal: sisanya dicoba lagi pada siklus update_persistence berikutnya.
+                    return
+                await asyncio.sleep(0)
+
+    async def _write_batch(self) -> bool:
+        """Menulis semua perubahan yang sedang antre dalam satu transaksi."""
+        users, self._pending_users = self._pending_users, {}
+        conversations, self._pending_conversations = self._pending_conversations, {}
+        # Ditandai tersimpan sebelum ditulis agar penghapusan yang masuk selama penulisan
+        # tidak dilewati oleh update_conversation.
+        self._stored_conversations.update(entry for entry, state in conversations.items() if state is not None)
+        db = await self._connection()
+        try:
+            await db.executemany(
+                "INSERT OR REPLACE INTO persisted_user_data (user_id, data) VALUES (?, ?)",
+                [(user_id, data) for user_id, data in users.items() if data is not None],
+            )
+            await db.executemany(
+                "DELETE FROM persisted_user_data WHERE user_id = ?",
+                [(user_id,) for user_id, data in users.items() if data is None],
+            )
+            await db.executemany(
+                "INSERT OR REPLACE INTO persisted_conversations (name, conversation_key, state) VALUES (?, ?, ?)",
+                [(name, key, state) for (name, key), state in conversations.items() if state is not None],
+            )
+            await db.executemany(
+                "DELETE FROM persisted_conversations WHERE name = ? AND conversation_key = ?",
+                [(name, key) for (name, key), state in conversations.items() if state is None],
+            )
+            await db.commit()
+        except aiosqlite.Error as e:
+            # Kembalikan ke antrean agar dicoba lagi pada siklus berikutnya.
+            logger.error(f"Database error on persisting {len(users)} user_data and {len(conversations)} conversations: {e}")
+            await db.rollback()
+            self._pending_users = {**users, **self._pending_users}
+            self._pending_conversations = {**conversations, **self._pending_conversations}
+            return False
+        for user_id, data in users.items():
+            if data is None:
+                self._stored_user_data.pop(user_id, None)
+            else:
+                self._stored_user_data[user_id] = data
+        self._stored_conversations.difference_update(entry for entry, state in conversations.items() if state is None)
+        return True
+
+    async def flush(self) -> None:
+        """Dipanggil Application saat berhenti: menulis sisa perubahan lalu menutup koneksi."""
+        if self._write_task is not None:
+            await self._write_task
+        await self._write_pending()
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    # Data yang tidak disimpan (lihat store_data di __init__)
+
+    async def get_bot_data(self) -> Dict[Any, Any]:
+        return {}
+
+    async def update_bot_data(self, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def get_chat_data(self) -> Dict[int, Dict[Any, Any]]:
+        return {}
+
+    async def update_chat_data(self, chat_id: int, data: Dict[Any, Any]) -> None:
+        pass
+
+    async def refresh_chat_data(self, chat_id: int, chat_data: Dict[Any, Any]) -> None:
+        pass
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        pass
+
+    async def get_callback_data(self) -> None:
+        return None
+
+    async def update_callback_data(self, data: Any) -> None:
+        pass
+
+
+class ResumingConversationHandler(ConversationHandler):
+    """
+    ConversationHandler yang state menetapnya (SETTLED_CONVERSATION_STATES) tidak disimpan
+    oleh SQLitePersistence. Pada update pertama pengguna terdaftar setelah restart, key yang
+    tidak punya state diisi dengan `resume_state(update)` sebelum handler dipilih.
+
+    `refresh_user_data` yang menandai pengguna terdaftar selalu berjalan lebih dulu, karena
+    `admission_check` di grup -1 cocok untuk setiap update.
+    """
+
+    def __init__(self, *args: Any, persistence: Optional[SQLitePersistence], resume_state: Callable[[Update], object], **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.persistence = persistence
+        self.resume_state = resume_state
+
+    def check_update(self, update: object) -> Optional[object]:
+        if (
+            self.persistence is not None
+            and isinstance(update, Update)
+            and update.effective_chat is not None
+            and update.effective_user is not None
+            and self.persistence.take_resumable(update.effective_user.id)
+        ):
+            key = self._get_key(update)
+            if key not in self._conversations:
+                self._conversations.update_no_track({key: self.resume_state(update)})
+        return super().check_update(update)
+
+
+# --- Pekerjaan Terjadwal ---
+
+# Interval pekerjaan pemeliharaan ringan (menulis waktu aktif, PRAGMA optimize, checkpoint WAL).
+MAINTENANCE_INTERVAL_SECONDS = int(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "300"))
+# Jumlah baris per indeks yang dibaca PRAGMA optimize saat memperbarui statistik query planner.
+MAINTENANCE_ANALYSIS_LIMIT = 1000
+# Jam (UTC) pekerjaan malam: pemangkasan profil tidak aktif, precompute, dan incremental vacuum.
+NIGHTLY_JOB_HOUR = int(os.getenv("NIGHTLY_JOB_HOUR", "3"))
+# Profil yang tidak aktif selama ini dikeluarkan dari pencarian kandidat (0 = nonaktif).
+INACTIVE_PRUNE_DAYS = int(os.getenv("INACTIVE_PRUNE_DAYS", "30"))
+PRUNE_BATCH_ROWS = 1000
+# Hanya pengguna yang aktif dalam rentang ini yang mendapat rekomendasi precompute.
+ACTIVE_USER_DAYS = int(os.getenv("ACTIVE_USER_DAYS", "7"))
+# Rekomendasi lebih tua dari ini diabaikan dan deck dihitung langsung.
+RECOMMENDATION_TTL_SECONDS = 36 * 60 * 60
+# Precompute diproses per batch pengguna dengan jeda di antaranya, dan menunggu selama
+# lebih dari separuh koneksi baca sedang dipakai trafik live.
+PRECOMPUTE_BATCH_USERS = 200
+PRECOMPUTE_BATCH_PAUSE_SECONDS = 1.0
+PRECOMPUTE_BACKOFF_SECONDS = 0.05
+# Jumlah halaman kosong yang dikembalikan ke sistem file per malam.
+VACUUM_PAGES_PER_RUN = 2000
+
+
+def sql_timestamp(seconds_ago: float = 0.0) -> str:
+    """Waktu UTC dalam format yang sama dengan CURRENT_TIMESTAMP di SQLite."""
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time() - seconds_ago))
+
+
+def inactive_cutoff() -> str:
+    """Batas last_active; profil yang terakhir aktif sebelum ini dianggap tidak aktif."""
+    return sql_timestamp(INACTIVE_PRUNE_DAYS * 86400) if INACTIVE_PRUNE_DAYS > 0 else ""
+
+
+def encode_id_array(ids: Iterable[int]) -> bytes:
+    data = array("q", ids)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data.tobytes()
+
+
+def decode_id_array(blob: bytes) -> array:
+    data = array("q")
+    data.frombytes(blob)
+    if sys.byteorder == "big":
+        data.byteswap()
+    return data
+
+
+class ActivityTracker:
+    """
+    Mencatat waktu aktif terakhir setiap pengguna di memori.
+
+    Menulis kolom users.last_active pada setiap interaksi akan menambah satu penulisan
+    per swipe; sebagai gantinya perubahan dikumpulkan dan ditulis sekaligus oleh
+    pekerjaan pemeliharaan. Dalam mode sharding, waktu aktif pengguna milik shard ini
+    juga dikirim ke shard lain agar filter pengguna aktif tetap sama di semua shard.
+    """
+
+    def __init__(self, peers: Optional["ShardPeers"] = None):
+        self._pending: Dict[int, str] = {}
+        self.peers = peers
+
+    def touch(self, user_id: int) -> None:
+        self._pending[user_id] = sql_timestamp()
+
+    def merge(self, items: Dict[str, str]) -> None:
+        """Menggabungkan waktu aktif dari shard lain (kunci dari JSON berupa string)."""
+        for user_id, active_at in items.items():
+            user_id = int(user_id)
+            if active_at > self._pending.get(user_id, ""):
+                self._pending[user_id] = active_at
+
+    async def flush(self, pool: DatabasePool, geo_enabled: bool) -> int:
+        """Menulis waktu aktif yang tertunda. Mengembalikan jumlah pengguna yang diperbarui."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        try:
+            async with pool.write() as db:
+                await db.executemany(
+                    "UPDATE users SET last_active = ? WHERE user_id = ?",
+                    [(active_at, user_id) for user_id, active_at in pending.items()],
+                )
+                if geo_enabled:
+                    # Pengguna yang aktif lagi setelah dipangkas dimasukkan kembali ke indeks lokasi.
+                    await db.executemany(
+                        """
+                        INSERT INTO users_geo
+                        SELECT user_id, latitude, latitude, longitude, longitude FROM users
+                        WHERE user_id = ? AND latitude IS NOT NULL AND longitude IS NOT NULL
+                          AND NOT EXISTS (SELECT 1 FROM users_geo WHERE user_id = users.user_id)
+                        """,
+                        [(user_id,) for user_id in pending],
+                    )
+                await db.commit()
+        except aiosqlite.Error:
+            self._pending = {**pending, **self._pending}
+            raise
+        if self.peers is not None:
+            owned = {user_id: active_at for user_id, active_at in pending.items() if self.peers.owns(user_id)}
+            if owned:
+                self.peers.broadcast({"op": "active", "users": owned})
+        return len(pending)
+
+
+class JobStats:
+    """Statistik setiap pekerjaan terjadwal, diekspor sebagai gauge bot_job_*."""
+
+    def __init__(self):
+        self._stats: Dict[str, Dict[str, float]] = {}
+
+    def record(self, name: str, seconds: float, ok: bool, items: int) -> None:
+        stats = self._stats.setdefault(
+            name,
+            {
+                "runs": 0,
+                "failures": 0,
+                "last_duration_seconds": 0.0,
+                "total_duration_seconds": 0.0,
+                "last_items": 0,
+                "last_run_timestamp": 0.0,
+            },
+        )
+        stats["runs"] += 1
+        stats["failures"] += not ok
+        stats["last_duration_seconds"] = seconds
+        stats["total_duration_seconds"] += seconds
+        stats["last_items"] = items
+        stats["last_run_timestamp"] = time.time()
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        return {name: dict(stats) for name, stats in self._stats.items()}
+
+
+async def run_job(app: Application, name: str, func: Callable[[Application], Awaitable[int]]) -> None:
+    """Menjalankan satu pekerjaan, mencatat durasi dan jumlah item yang diproses."""
+    started = time.perf_counter()
+    items, ok = 0, False
+    try:
+        items = await func(app)
+        ok = True
+    except aiosqlite.Error as e:
+        logger.error(f"Database error in scheduled job {name}: {e}")
+    finally:
+        elapsed = time.perf_counter() - started
+        app.bot_data["jobs"].record(name, elapsed, ok, items)
+    logger.debug(f"Scheduled job {name} processed {items} items in {elapsed:.2f}s.")
+
+
+async def flush_activity(app: Application) -> int:
+    return await app.bot_data["activity"].flush(app.bot_data["pool"], app.bot_data["decks"].geo_enabled)
+
+
+async def optimize_database(app: Application) -> int:
+    """
+    Memperbarui statistik query planner secukupnya (PRAGMA optimize hanya menjalankan
+    ANALYZE untuk tabel yang berubah banyak) dan memindahkan isi WAL ke file database
+    tanpa menunggu pembaca. Mengembalikan jumlah halaman WAL yang di-checkpoint.
+    """
+    app.bot_data["decks"].prune_expired()
+    async with app.bot_data["pool"].write() as db:
+        await db.execute(f"PRAGMA analysis_limit={MAINTENANCE_ANALYSIS_LIMIT}")
+        await db.execute("PRAGMA optimize")
+        async with db.execute("PRAGMA wal_checkpoint(PASSIVE)") as cursor:
+            _, _, checkpointed = await cursor.fetchone()
+    return max(checkpointed, 0)
+
+
+async def prune_inactive_profiles(app: Application) -> int:
+    """
+    Mengeluarkan profil yang tidak aktif lebih dari INACTIVE_PRUNE_DAYS dari indeks lokasi,
+    per batch kecil agar kunci penulis tidak tertahan lama. Profilnya tetap ada dan kembali
+    ke indeks saat pengguna aktif lagi (lihat ActivityTracker.flush).
+    """
+    if INACTIVE_PRUNE_DAYS <= 0 or not app.bot_data["decks"].geo_enabled:
+        return 0
+    pool: DatabasePool = app.bot_data["pool"]
+    cutoff = inactive_cutoff()
+    # Profil tidak aktif dibaca sekali per malam, berurutan lewat idx_users_last_active (keyset).
+    last_key: Tuple[str, int] = ("", -(2**63))
+    pruned = 0
+    while True:
+        async with pool.read() as db:
+            async with db.execute(
+                """
+                SELECT last_active, user_id FROM users
+                WHERE last_active < ? AND (last_active, user_id) > (?, ?)
+                ORDER BY last_active, user_id LIMIT ?
+                """,
+                (cutoff, *last_key, PRUNE_BATCH_ROWS),
+            ) as cursor:
+                rows = await cursor.fetchall()
+        if not rows:
+            return pruned
+        async with pool.write() as db:
+            cursor = await db.executemany(
+                "DELETE FROM users_geo WHERE user_id = ?", [(user_id,) for _, user_id in rows]
+            )
+            await db.commit()
+        pruned += max(cursor.rowcount, 0)
+        last_key = rows[-1]
+        await asyncio.sleep(0)
+
+
+async def precompute_recommendations(app: Application) -> int:
+    """
+    Menghitung deck kandidat untuk setiap pengguna yang aktif dalam ACTIVE_USER_DAYS terakhir
+    dan menyimpannya di tabel 'recommendations', sehingga deck pertama mereka esok hari tidak
+    perlu query kandidat dan scoring langsung.
+
+    Pengguna diproses satu per satu dalam batch PRECOMPUTE_BATCH_USERS. Sebelum setiap
+    pengguna, pekerjaan ini menunggu selama trafik live memakai lebih dari separuh koneksi baca.
+    Dalam mode sharding, setiap shard hanya menghitung deck untuk pengguna miliknya.
+    """
+    pool: DatabasePool = app.bot_data["pool"]
+    decks: CandidateDeckManager = app.bot_data["decks"]
+    peers: Optional[ShardPeers] = app.bot_data.get("shards")
+    active_since = sql_timestamp(ACTIVE_USER_DAYS * 86400)
+    last_id = -(2**63)
+    total = 0
+    while True:
+        async with pool.read() as db:
+            async with db.execute(
+                "SELECT user_id FROM users WHERE last_active >= ? AND user_id > ? ORDER BY user_id LIMIT ?",
+                (active_since, last_id, PRECOMPUTE_BATCH_USERS),
+            ) as cursor:
+                user_ids = [user_id for (user_id,) in await cursor.fetchall()]
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+        if peers is not None:
+            user_ids = [user_id for user_id in user_ids if peers.owns(user_id)]
+
+        rows = []
+        for user_id in user_ids:
+            while pool.idle_readers() <= pool.reader_count // 2:
+                await asyncio.sleep(PRECOMPUTE_BACKOFF_SECONDS)
+            candidates = await decks.precompute(user_id)
+            rows.append((user_id, encode_id_array(candidates), sql_timestamp()))
+        async with pool.write() as db:
+            await db.executemany(
+                "INSERT OR REPLACE INTO recommendations (user_id, candidates, computed_at) VALUES (?, ?, ?)", rows
+            )
+            await db.commit()
+        total += len(rows)
+        await asyncio.sleep(PRECOMPUTE_BATCH_PAUSE_SECONDS)
+
+    # Rekomendasi milik pengguna yang sudah tidak aktif tidak akan dipakai lagi.
+    async with pool.write() as db:
+        await db.execute(
+            "DELETE FROM recommendations WHERE computed_at < ?", (sql_timestamp(RECOMMENDATION_TTL_SECONDS),)
+        )
+        await db.commit()
+    return total
+
+
+async def vacuum_database(app: Application) -> int:
+    """
+    Mengembalikan sebagian halaman kosong ke sistem file lalu memangkas file WAL.
+    Incremental vacuum hanya tersedia untuk database yang dibuat dengan auto_vacuum=INCREMENTAL;
+    database lama perlu satu kali `VACUUM` manual saat bot berhenti untuk beralih ke mode itu.
+    """
+    async with app.bot_data["pool"].write() as db:
+        async with db.execute("PRAGMA auto_vacuum") as cursor:
+            (mode,) = await cursor.fetchone()
+        async with db.execute("PRAGMA freelist_count") as cursor:
+            (free_pages,) = await cursor.fetchone()
+        reclaimed = 0
+        if mode == 2 and free_pages:
+            await db.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES_PER_RUN})")
+            reclaimed = min(free_pages, VACUUM_PAGES_PER_RUN)
+        await db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return reclaimed
+
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Pekerjaan berkala ringan."""
+    await run_job(context.application, "flush_activity", flush_activity)
+    await run_job(context.application, "optimize_database", optimize_database)
+
+
+async def nightly_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Pekerjaan berat di luar jam sibuk, dijalankan berurutan."""
+    await run_job(context.application, "flush_activity", flush_activity)
+    await run_job(context.application, "prune_inactive", prune_inactive_profiles)
+    await run_job(context.application, "precompute_recommendations", precompute_recommendations)
+    await run_job(context.application, "vacuum_database", vacuum_database)
+
+
+def schedule_jobs(app: Application) -> None:
+    """Mendaftarkan pekerjaan pemeliharaan ke JobQueue aplikasi."""
+    app.bot_data["jobs"] = JobStats()
+    if app.job_queue is None:
+        logger.warning(
+            "JobQueue unavailable (install python-telegram-bot[job-queue]); background maintenance is disabled."
+        )
+        return
+    app.job_queue.run_repeating(
+        maintenance_job, interval=MAINTENANCE_INTERVAL_SECONDS, first=MAINTENANCE_INTERVAL_SECONDS, name="maintenance"
+    )
+    app.job_queue.run_daily(
+        nightly_job, time=datetime.time(hour=NIGHTLY_JOB_HOUR, tzinfo=datetime.timezone.utc), name="nightly"
+    )
+
+
+# --- Mode Webhook dan Pemrosesan Update Paralel ---
+
+# Jika WEBHOOK_URL diatur (misal: https://bot.example.com/telegram), bot berjalan dalam mode
+# webhook dengan server HTTP bawaan python-telegram-bot; jika tidak, memakai polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Jumlah update yang diproses bersamaan, dan batas update yang boleh menunggu giliran.
+UPDATE_WORKERS = int(os.getenv("UPDATE_WORKERS", "32"))
+MAX_PENDING_UPDATES = int(os.getenv("MAX_PENDING_UPDATES", "4096"))
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Memproses update dari pengguna berbeda secara paralel, tetapi update dari pengguna
+    yang sama tetap satu per satu sesuai urutan masuk.
+
+    Ini menjaga state ConversationHandler dan `context.user_data` (misal
+    "potential_match_id") tetap konsisten. Update yang menunggu giliran pengguna yang
+    sama tidak memakai slot worker, jadi satu pengguna yang spam tombol tidak
+    menghambat pengguna lain.
+    """
+
+    def __init__(self, workers: int = UPDATE_WORKERS, max_pending: int = MAX_PENDING_UPDATES):
+        # Semaphore bawaan membatasi total update yang sedang ditangani (termasuk yang menunggu).
+        super().__init__(max_concurrent_updates=max_pending)
+        self._workers = asyncio.Semaphore(workers)
+        self._user_locks: Dict[int, asyncio.Lock] = {}
+        self._user_waiting: Dict[int, int] = {}
+
+    @staticmethod
+    def _ordering_key(update: object) -> Optional[int]:
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = self._ordering_key(update)
+        if key is None:
+            async with self._workers:
+                await coroutine
+            return
+
+        # asyncio.Lock melayani penunggu secara FIFO, sehingga urutan per pengguna terjaga.
+        lock = self._user_locks.get(key)
+        if lock is None:
+            lock = self._user_locks[key] = asyncio.Lock()
+        self._user_waiting[key] = self._user_waiting.get(key, 0) + 1
+        try:
+            async with lock:
+                async with self._workers:
+                    await coroutine
+        finally:
+            self._user_waiting[key] -= 1
+            if not self._user_waiting[key]:
+                del self._user_waiting[key]
+                del self._user_locks[key]
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+
+# --- Sharding Multi-Proses ---
+
+# Dengan SHARD_COUNT > 1, `main()` menjalankan satu router dan SHARD_COUNT proses worker.
+# Router hanya menerima update (polling/webhook) lalu meneruskannya ke worker pemilik
+# pengguna (user_id % SHARD_COUNT) lewat Unix socket. Setiap worker menjalankan
+# Application lengkap dengan file database dan event loop sendiri.
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "1"))
+SHARD_SOCKET_DIR = os.getenv("SHARD_SOCKET_DIR", "shards")
+# Batas waktu menunggu socket worker muncul, dan jeda sebelum menyambung ulang ke worker.
+SHARD_CONNECT_TIMEOUT_SECONDS = 30
+SHARD_RECONNECT_SECONDS = 0.5
+# Pesan yang boleh menunggu per koneksi keluar; jika penuh, pesan fire-and-forget dibuang dengan
+# warning dan router menunggu sampai ada ruang.
+SHARD_QUEUE_SIZE = 100_000
+# Pesan yang digabung dalam satu write ke socket.
+SHARD_WRITE_BATCH = 512
+SHARD_MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+# Pesan yang harus sampai (update dari router, like ke shard lain) dikirim ulang jika tidak
+# dibalas dalam batas waktu ini, dengan jeda yang berlipat hingga SHARD_RETRY_MAX_SECONDS.
+SHARD_ACK_TIMEOUT_SECONDS = 5
+SHARD_RETRY_MAX_SECONDS = 30
+# update_id terakhir yang diingat worker untuk mengabaikan update yang dikirim ulang router.
+SHARD_RECENT_UPDATES = 10_000
+# Anti-entropy profil saat worker start: salinan dibandingkan per ember user_id sebesar ini,
+# dan profil yang berbeda dikirim ulang per SHARD_SYNC_BATCH baris.
+SHARD_SYNC_BUCKET = 4096
+SHARD_SYNC_BATCH = 1000
+# Kolom profil yang dibandingkan; last_active disinkronkan terpisah oleh ActivityTracker.
+SHARD_SYNC_COLUMNS = ("user_id", "gender", "age", "hobby", "latitude", "longitude", "photo_id", "description", "registration_date")
+# Baris milik satu shard selain profil (yang disalin ke semua shard), untuk `shard-split`.
+# Swipe keluar ada di shard pengirim; like masuk dan match di shard kedua pengguna, sama
+# seperti yang ditulis SwipeBuffer saat berjalan. State percakapan dikunci [chat_id, user_id].
+SHARD_OWNED_ROWS: Dict[str, str] = {
+    "swipes": "swiper_id % :count = :index OR (swiped_id % :count = :index AND action = 'like')",
+    "matches": "user_id % :count = :index OR match_id % :count = :index",
+    "seen_set_chunks": "user_id % :count = :index",
+    "user_filters": "user_id % :count = :index",
+    "recommendations": "user_id % :count = :index",
+    "persisted_user_data": "user_id % :count = :index",
+    "persisted_conversations": "json_extract(conversation_key, '$[#-1]') % :count = :index",
+}
+
+
+def shard_database_file(path: str, index: int) -> str:
+    """Nama file database milik satu shard, misal 'dating_bot_2025.shard0.db'."""
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard{index}{ext}"
+
+
+def shard_socket_path(socket_dir: str, index: int) -> str:
+    return os.path.join(socket_dir, f"shard{index}.sock")
+
+
+# Protokol IPC: setiap pesan adalah objek JSON dengan field "op", diawali panjangnya
+# (4 byte big-endian). Pesan dengan field "id" dibalas dengan {"id": ..., "result": ...}.
+def encode_frame(message: Dict[str, Any]) -> bytes:
+    data = json.dumps(message, separators=(",", ":")).encode()
+    return len(data).to_bytes(4, "big") + data
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Optional[Dict[str, Any]]:
+    """Membaca satu pesan. Mengembalikan None jika koneksi ditutup."""
+    try:
+        size = int.from_bytes(await reader.readexactly(4), "big")
+        if size > SHARD_MAX_MESSAGE_BYTES:
+            raise ValueError(f"IPC message too large: {size} bytes")
+        return json.loads(await reader.readexactly(size))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+class ShardLink:
+    """
+    Koneksi keluar ke satu worker.
+
+    `send` tidak menunggu: pesan diantrekan lalu ditulis berurutan oleh task background,
+    sehingga handler tidak tertahan oleh shard lain. Jika koneksi putus, batch yang sedang
+    ditulis dibuang (dicatat di log) dan koneksi dibuka ulang; urutan pesan yang tersisa tetap.
+
+    Pesan yang harus sampai dikirim lewat `deliver` atau `deliver_wait`: pesan disimpan sampai
+    penerima membalas. Setiap kali koneksi tersambung (lagi), semua pesan yang belum dibalas
+    dikirim lebih dulu sesuai urutan aslinya, dan salinannya yang masih antre dilewati. Selama
+    koneksi tetap, pesan dikirim ulang jika balasan tidak datang dalam SHARD_ACK_TIMEOUT_SECONDS
+    (jeda berlipat hingga SHARD_RETRY_MAX_SECONDS). Penerima harus aman menerima pesan yang
+    sama dua kali.
+    """
+
+    def __init__(self, path: str, queue_size: int = SHARD_QUEUE_SIZE):
+        self.path = path
+        # (frame, id pesan `deliver` atau None)
+        self._queue: asyncio.Queue = asyncio.Queue(queue_size)
+        self._replies: Dict[int, asyncio.Future] = {}
+        self._call_ids = itertools.count(1)
+        # id -> [pesan, batas waktu balasan (None selama belum ditulis), jeda berikutnya,
+        # koneksi tempat pesan terakhir ditulis] untuk pesan `deliver` yang belum dibalas.
+        self._unacked: Dict[int, List[Any]] = {}
+        self._connection = 0
+        self._acked = asyncio.Event()
+        self._acked.set()
+        self._task: Optional[asyncio.Task] = None
+        self._resend_task: Optional[asyncio.Task] = None
+        self.stats = {"sent": 0, "dropped": 0, "reconnects": 0, "retries": 0}
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+        self._resend_task = asyncio.create_task(self._resend_unacked())
+
+    def send(self, message: Dict[str, Any]) -> None:
+        try:
+            self._queue.put_nowait((encode_frame(message), None))
+        except asyncio.QueueFull:
+            self.stats["dropped"] += 1
+            logger.warning(f"IPC queue to {self.path} is full, dropping {message.get('op')} message.")
+
+    async def call(self, message: Dict[str, Any], timeout: Optional[float] = None) -> Any:
+        """Mengirim pesan dan menunggu balasannya (asyncio.TimeoutError setelah `timeout` detik)."""
+        call_id = next(self._call_ids)
+        future = self._replies[call_id] = asyncio.get_running_loop().create_future()
+        self.send({**message, "id": call_id})
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._replies.pop(call_id, None)
+
+    def _track(self, message: Dict[str, Any]) -> Tuple[bytes, int]:
+        call_id = next(self._call_ids)
+        self._unacked[call_id] = [message, None, SHARD_ACK_TIMEOUT_SECONDS, None]
+        self._acked.clear()
+        return encode_frame({**message, "id": call_id}), call_id
+
+    def deliver(self, message: Dict[str, Any]) -> None:
+        """Seperti `send`, tetapi dikirim ulang sampai penerima membalas."""
+        item = self._track(message)
+        try:
+            self._queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Tidak dibuang: dicoba lagi oleh _resend_unacked setelah batas waktu balasan.
+            self._unacked[item[1]][1] = time.monotonic() + SHARD_ACK_TIMEOUT_SECONDS
+            logger.warning(f"IPC queue to {self.path} is full, delaying {message.get('op')} message.")
+
+    async def deliver_wait(self, message: Dict[str, Any]) -> None:
+        """Seperti `deliver`, tetapi menunggu ruang di antrean sehingga urutan pesan tetap terjaga."""
+        await self._queue.put(self._track(message))
+
+    def unacked(self) -> List[Dict[str, Any]]:
+        return [entry[0] for entry in self._unacked.values()]
+
+    async def wait_acked(self) -> None:
+        """Menunggu semua pesan `deliver` dibalas."""
+        await self._acked.wait()
+
+    async def _resend_unacked(self) -> None:
+        while True:
+            await asyncio.sleep(SHARD_RECONNECT_SECONDS)
+            now = time.monotonic()
+            expired = [(call_id, entry) for call_id, entry in self._unacked.items() if entry[1] is not None and entry[1] <= now]
+            if not expired:
+                continue
+            logger.warning(f"{len(expired)} IPC messages to {self.path} were not acknowledged, resending.")
+            for call_id, entry in expired:
+                entry[2] = min(entry[2] * 2, SHARD_RETRY_MAX_SECONDS)
+                try:
+                    self._queue.put_nowait((encode_frame({**entry[0], "id": call_id}), call_id))
+                except asyncio.QueueFull:
+                    entry[1] = now + entry[2]
+                    continue
+                entry[1] = entry[3] = None
+                self.stats["retries"] += 1
+
+    async def flush(self) -> None:
+        """Menunggu semua pesan di antrean selesai ditulis ke socket."""
+        await self._queue.join()
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        while True:
+            try:
+                return await asyncio.open_unix_connection(self.path)
+            except OSError:
+                await asyncio.sleep(SHARD_RECONNECT_SECONDS)
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while (message := await read_frame(reader)) is not None:
+                if self._unacked.pop(message.get("id"), None) is not None and not self._unacked:
+                    self._acked.set()
+                future = self._replies.get(message.get("id"))
+                if future is not None and not future.done():
+                    future.set_result(message.get("result"))
+        except (OSError, ValueError) as e:
+            logger.error(f"IPC connection to {self.path} failed while reading replies: {e}")
+
+    async def _write(self, writer: asyncio.StreamWriter, batch: List[Tuple[bytes, Optional[int]]]) -> bool:
+        now = time.monotonic()
+        for _, call_id in batch:
+            entry = self._unacked.get(call_id)
+            if entry is not None:
+                entry[1] = now + entry[2]
+                entry[3] = self._connection
+        try:
+            writer.write(b"".join(frame for frame, _ in batch))
+            await writer.drain()
+        except OSError as e:
+            dropped = sum(call_id is None for _, call_id in batch)
+            self.stats["dropped"] += dropped
+            logger.error(
+                f"IPC connection to {self.path} lost, {dropped} messages dropped, {len(batch) - dropped} will be resent: {e}"
+            )
+            return False
+        self.stats["sent"] += len(batch)
+        return True
+
+    def _already_sent(self, item: Tuple[bytes, Optional[int]]) -> bool:
+        """True untuk salinan antre pesan `deliver` yang sudah dibalas atau sudah ditulis ke koneksi ini."""
+        if item[1] is None:
+            return False
+        entry = self._unacked.get(item[1])
+        return entry is None or entry[3] == self._connection
+
+    async def _write_queue(self, writer: asyncio.StreamWriter) -> None:
+        # Semua pesan `deliver` yang belum dibalas (termasuk yang masih antre) ditulis lebih dulu
+        # sesuai urutan aslinya, agar pesan yang hilang bersama koneksi sebelumnya tidak
+        # tersusul pesan yang lebih baru.
+        pending = sorted(self._unacked)
+        written = [call_id for call_id in pending if self._unacked[call_id][3] is not None]
+        if written:
+            self.stats["retries"] += len(written)
+            logger.warning(f"Resending {len(written)} unacknowledged IPC messages to {self.path}.")
+        for start in range(0, len(pending), SHARD_WRITE_BATCH):
+            chunk = [call_id for call_id in pending[start : start + SHARD_WRITE_BATCH] if call_id in self._unacked]
+            batch = [(encode_frame({**self._unacked[call_id][0], "id": call_id}), call_id) for call_id in chunk]
+            if batch and not await self._write(writer, batch):
+                return
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < SHARD_WRITE_BATCH and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                unsent = [item for item in batch if not self._already_sent(item)]
+                if unsent and not await self._write(writer, unsent):
+                    return
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _run(self) -> None:
+        while True:
+            reader, writer = await self._connect()
+            self._connection += 1
+            replies = asyncio.create_task(self._read_replies(reader))
+            writes = asyncio.create_task(self._write_queue(writer))
+            try:
+                # Koneksi dianggap putus jika penulisan gagal atau worker menutup socket.
+                await asyncio.wait((replies, writes), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                replies.cancel()
+                writes.cancel()
+                writer.close()
+            self.stats["reconnects"] += 1
+
+    async def close(self) -> None:
+        for task in (self._task, self._resend_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+
+async def wait_for_sockets(paths: Iterable[str], timeout: float = SHARD_CONNECT_TIMEOUT_SECONDS) -> None:
+    """Menunggu sampai semua worker membuka socket-nya."""
+    deadline = time.monotonic() + timeout
+    for path in paths:
+        while not os.path.exists(path):
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Shard socket {path} did not appear within {timeout:.0f}s")
+            await asyncio.sleep(0.05)
+
+
+class ShardPeers:
+    """
+    Pembagian pengguna antar-shard dari sisi satu worker, beserta koneksi ke shard lain.
+
+    Data milik pengguna (swipe keluar, seen-set, deck, state percakapan) hanya ada di
+    shard pemiliknya. Profil direplikasi ke semua shard, sehingga pengambilan kandidat,
+    kartu profil dan skor tetap lokal; like untuk pengguna di shard lain diteruskan
+    ke shard tersebut agar mutual like dan daftar "yang menyukai saya" bisa dicek di sana.
+
+    Like dikirim lewat `deliver` (lihat ShardLink.deliver), dan yang belum dibalas saat
+    worker berhenti dikembalikan oleh `close` untuk disimpan di tabel 'shard_outbox'.
+    Balasan berarti like sudah masuk SwipeBuffer shard tujuan, seketahan swipe lokal di sana.
+    Replikasi profil dan waktu aktif tetap fire-and-forget; profil yang tertinggal diperbaiki
+    oleh `resync_profiles` saat worker start.
+    """
+
+    def __init__(self, index: int, count: int, socket_dir: str):
+        self.index = index
+        self.count = count
+        self._links = {
+            shard: ShardLink(shard_socket_path(socket_dir, shard)) for shard in range(count) if shard != index
         }
+
+    def shard_of(self, user_id: int) -> int:
+        return user_id % self.count
+
+    def owns(self, user_id: int) -> bool:
+        return self.shard_of(user_id) == self.index
+
+    @property
+    def other_shards(self) -> List[int]:
+        return list(self._links)
+
+    async def request(self, shard: int, message: Dict[str, Any]) -> Any:
+        """Mengirim pesan ke `shard` dan mengembalikan balasannya; diulang selama tidak dibalas."""
+        link = self._links[shard]
+        delay = SHARD_RECONNECT_SECONDS
+        while True:
+            try:
+                return await link.call(message, SHARD_ACK_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                link.stats["retries"] += 1
+                logger.warning(f"No reply to {message['op']} message from shard {shard}, retrying in {delay:.1f}s.")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, SHARD_RETRY_MAX_SECONDS)
+
+    def deliver(self, shard: int, message: Dict[str, Any]) -> None:
+        self._links[shard].deliver(message)
+
+    def deliver_to_owner(self, user_id: int, message: Dict[str, Any]) -> None:
+        self.deliver(self.shard_of(user_id), message)
+
+    def broadcast(self, message: Dict[str, Any]) -> None:
+        for link in self._links.values():
+            link.send(message)
+
+    def start(self) -> None:
+        for link in self._links.values():
+            link.start()
+
+    async def flush(self, timeout: Optional[float] = None) -> None:
+        """Menunggu antrean semua koneksi tertulis dan semua `deliver` dibalas (paling lama `timeout`)."""
+        waits = [
+            asyncio.create_task(wait())
+            for link in self._links.values()
+            for wait in (link.flush, link.wait_acked)
+        ]
+        if waits:
+            await asyncio.wait(waits, timeout=timeout)
+        for task in waits:
+            task.cancel()
+
+    def stats(self) -> Dict[str, int]:
+        totals = {"sent": 0, "dropped": 0, "reconnects": 0, "retries": 0}
+        for link in self._links.values():
+            for key, value in link.stats.items():
+                totals[key] += value
+        totals["unacked"] = sum(len(link.unacked()) for link in self._links.values())
+        return totals
+
+    async def close(self) -> List[Tuple[int, Dict[str, Any]]]:
+        """Menutup koneksi. Mengembalikan pesan `deliver` yang belum dibalas sebagai (shard, pesan)."""
+        undelivered = [(shard, message) for shard, link in self._links.items() for message in link.unacked()]
+        for link in self._links.values():
+            await link.close()
+        return undelivered
+
+
+async def save_undelivered(pool: DatabasePool, messages: List[Tuple[int, Dict[str, Any]]]) -> None:
+    """Menyimpan pesan ke shard lain yang belum dibalas agar dikirim ulang saat worker start lagi."""
+    if not messages:
+        return
+    async with pool.write() as db:
+        await db.executemany(
+            "INSERT INTO shard_outbox (shard, message) VALUES (?, ?)",
+            [(shard, json.dumps(message)) for shard, message in messages],
+        )
+        await db.commit()
+    logger.warning(f"Saved {len(messages)} unacknowledged inter-shard messages for the next start.")
+
+
+async def resend_undelivered(app: Application) -> None:
+    """Mengirim ulang pesan yang disimpan oleh `save_undelivered` saat worker terakhir berhenti."""
+    peers: ShardPeers = app.bot_data["shards"]
+    async with app.bot_data["pool"].write() as db:
+        async with db.execute("SELECT shard, message FROM shard_outbox ORDER BY id") as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return
+        await db.execute("DELETE FROM shard_outbox")
+        await db.commit()
+    for shard, message in rows:
+        if shard in peers.other_shards:
+            peers.deliver(shard, json.loads(message))
+        else:
+            logger.error(f"Dropping saved message for shard {shard}: SHARD_COUNT is now {peers.count}.")
+    logger.info(f"Resending {len(rows)} inter-shard messages saved at the last shutdown.")
+
+
+async def profile_digests(pool: DatabasePool, index: int, count: int) -> Dict[int, int]:
+    """
+    crc32 per ember user_id (SHARD_SYNC_BUCKET id) atas kolom SHARD_SYNC_COLUMNS profil
+    pengguna milik shard `index`. Satu scan tabel users; dipakai hanya saat worker start.
+    """
+    digests: Dict[int, int] = {}
+    async with pool.read() as db:
+        async with db.execute(
+            f"SELECT {', '.join(SHARD_SYNC_COLUMNS)} FROM users WHERE user_id % ? = ? ORDER BY user_id",
+            (count, index),
+        ) as cursor:
+            while rows := await cursor.fetchmany(BULK_CHUNK_ROWS):
+                for row in rows:
+                    bucket = row[0] // SHARD_SYNC_BUCKET
+                    digests[bucket] = zlib.crc32(json.dumps(row).encode(), digests.get(bucket, 0))
+    return digests
+
+
+async def resync_profiles(app: Application) -> None:
+    """
+    Anti-entropy saat worker start: salinan profil milik shard ini di setiap shard lain
+    dibandingkan per ember user_id, lalu hanya ember yang berbeda dikirim ulang. Memperbaiki
+    profil yang tertinggal karena replikasi fire-and-forget (koneksi putus, worker mati)
+    atau file shard yang diisi terpisah. Berjalan di background setelah worker siap.
+    """
+    peers: ShardPeers = app.bot_data["shards"]
+    pool: DatabasePool = app.bot_data["pool"]
+    digests = await profile_digests(pool, peers.index, peers.count)
+    for shard in peers.other_shards:
+        stale = await peers.request(shard, {"op": "profile_digests", "shard": peers.index, "digests": digests})
+        sent = 0
+        for bucket in stale or []:
+            async with pool.read() as db:
+                async with db.execute(
+                    f"SELECT {', '.join(SHARD_SYNC_COLUMNS)} FROM users "
+                    "WHERE user_id >= ? AND user_id < ? AND user_id % ? = ?",
+                    (bucket * SHARD_SYNC_BUCKET, (bucket + 1) * SHARD_SYNC_BUCKET, peers.count, peers.index),
+                ) as cursor:
+                    rows = await cursor.fetchall()
+            for chunk in _chunks(rows, SHARD_SYNC_BATCH):
+                await peers.request(shard, {"op": "profiles", "rows": [dict(zip(SHARD_SYNC_COLUMNS, row)) for row in chunk]})
+            sent += len(rows)
+        logger.info(
+            f"Profile resync to shard {shard}: {len(stale or [])} of {len(digests)} buckets differed, {sent} profiles sent."
+        )
+
+
+async def publish_profile(bot_data: Dict[str, Any], user_id: int) -> None:
+    """Mengirim profil terbaru pengguna ke semua shard lain (tidak melakukan apa-apa tanpa sharding)."""
+    peers: Optional[ShardPeers] = bot_data.get("shards")
+    if peers is None:
+        return
+    columns = BULK_TABLES["users"]
+    async with bot_data["pool"].read() as db:
+        async with db.execute(f"SELECT {', '.join(columns)} FROM users WHERE user_id = ?", (user_id,)) as cursor:
+            row = await cursor.fetchone()
+    if row is not None:
+        peers.broadcast({"op": "profile", "row": dict(zip(columns, row))})
+
+
+# Operasi yang diterima worker: op -> fungsi(app, pesan) yang mengembalikan balasan (boleh None).
+async def _shard_op_update(app: Application, message: Dict[str, Any]) -> None:
+    # Update yang masuk setelah Application.stop() dimulai tidak akan diproses, jadi tidak
+    # dibalas; router mengirimnya lagi ke worker ini setelah restart.
+    if not app.running:
+        raise ShardRetryLater()
+    # Router mengirim ulang update yang balasannya tidak sampai; yang sudah diterima diabaikan.
+    recent: "OrderedDict[int, None]" = app.bot_data["shard_update_ids"]
+    update_id = message["update"]["update_id"]
+    if update_id in recent:
+        app.bot_data["shard_stats"]["duplicate_updates"] += 1
+        return
+    recent[update_id] = None
+    if len(recent) > SHARD_RECENT_UPDATES:
+        recent.popitem(last=False)
+    app.bot_data["shard_stats"]["updates"] += 1
+    await app.update_queue.put(Update.de_json(message["update"], app.bot))
+
+
+async def _upsert_profiles(app: Application, rows: List[Dict[str, Any]]) -> None:
+    columns = [column for column in BULK_TABLES["users"] if column in rows[0]]
+    updates = ", ".join(f"{column} = excluded.{column}" for column in columns if column != "user_id")
+    # UPSERT (bukan REPLACE) agar trigger indeks lokasi dan teks lengkap ikut berjalan.
+    async with app.bot_data["pool"].write() as db:
+        await db.executemany(
+            f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT (user_id) DO UPDATE SET {updates}",
+            [[row[column] for column in columns] for row in rows],
+        )
+        await db.commit()
+    for row in rows:
+        app.bot_data["cards"].invalidate(row["user_id"])
+    app.bot_data["shard_stats"]["profiles"] += len(rows)
+
+
+async def _shard_op_profile(app: Application, message: Dict[str, Any]) -> None:
+    await _upsert_profiles(app, [message["row"]])
+
+
+async def _shard_op_profiles(app: Application, message: Dict[str, Any]) -> None:
+    if message["rows"]:
+        await _upsert_profiles(app, message["rows"])
+
+
+async def _shard_op_profile_digests(app: Application, message: Dict[str, Any]) -> List[int]:
+    """Ember profil milik shard pengirim yang salinannya di sini berbeda (lihat resync_profiles)."""
+    local = await profile_digests(app.bot_data["pool"], message["shard"], app.bot_data["shards"].count)
+    return [int(bucket) for bucket, digest in message["digests"].items() if local.get(int(bucket)) != digest]
+
+
+async def _shard_op_active(app: Application, message: Dict[str, Any]) -> None:
+    app.bot_data["activity"].merge(message["users"])
+
+
+async def _shard_op_like(app: Application, message: Dict[str, Any]) -> None:
+    swiper_id, swiped_id = message["swiper_id"], message["swiped_id"]
+    app.bot_data["shard_stats"]["remote_likes"] += 1
+    if app.bot_data["swipes"].add_remote_like(swiper_id, swiped_id, message["swipe_date"], message["matched"]):
+        notify_match(app.bot_data, app.bot, swiped_id, swiper_id)
+
+
+async def _shard_op_drain(app: Application, message: Dict[str, Any]) -> Dict[str, Any]:
+    """Menunggu semua update dan pesan keluar selesai, lalu mengembalikan statistik shard."""
+    peers: ShardPeers = app.bot_data["shards"]
+    await app.update_queue.join()
+    await app.bot_data["swipes"].flush()
+    await peers.flush()
+    async with app.bot_data["pool"].read() as db:
+        async with db.execute(
+            "SELECT (SELECT COUNT(*) FROM swipes WHERE swiper_id % ? = ?), "
+            "(SELECT COUNT(*) FROM matches WHERE user_id % ? = ?), (SELECT COUNT(*) FROM users)",
+            (peers.count, peers.index) * 2,
+        ) as cursor:
+            swipes, matches, users = await cursor.fetchone()
+    return {
+        **app.bot_data["shard_stats"],
+        "shard": peers.index,
+        "swipes": swipes,
+        "matches": matches,
+        "users": users,
+        "cpu_s": time.process_time(),
+        "ipc": peers.stats(),
+    }
+
+
+SHARD_OPERATIONS: Dict[str, Callable[[Application, Dict[str, Any]], Awaitable[Optional[Dict[str, Any]]]]] = {
+    "update": _shard_op_update,
+    "profile": _shard_op_profile,
+    "profiles": _shard_op_profiles,
+    "profile_digests": _shard_op_profile_digests,
+    "active": _shard_op_active,
+    "like": _shard_op_like,
+    "drain": _shard_op_drain,
+}
+
+
+class ShardRetryLater(Exception):
+    """Dilempar operasi IPC agar pesan tidak dibalas; pengirim `deliver` mengirimnya lagi nanti."""
+
+
+class ShardServer:
+    """Menerima pesan dari router dan shard lain lewat Unix socket, berurutan per koneksi."""
+
+    def __init__(self, app: Application, path: str):
+        self.app = app
+        self.path = path
+        self._server: Optional[asyncio.AbstractServer] = None
+        # Task handler per koneksi masuk -> writer-nya, agar bisa ditutup oleh `close`.
+        self._connections: Dict[asyncio.Task, asyncio.StreamWriter] = {}
+
+    async def start(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._server = await asyncio.start_unix_server(self._handle, path=self.path)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while (message := await read_frame(reader)) is not None:
+                try:
+                    result = await SHARD_OPERATIONS[message["op"]](self.app, message)
+                except ShardRetryLater:
+                    continue
+                except (KeyError, ValueError, aiosqlite.Error) as e:
+                    logger.error(f"IPC {message.get('op')} message failed: {e}")
+                    result = None
+                if "id" in message:
+                    writer.write(encode_frame({"id": message["id"], "result": result}))
+                    await writer.drain()
+        except (OSError, ValueError) as e:
+            logger.error(f"IPC connection error: {e}")
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Koneksi yang masih terbuka (misal router yang terus mengirim update selama worker
+            # berhenti) ditutup agar handler-nya selesai sebelum event loop berhenti.
+            for writer in self._connections.values():
+                writer.close()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def build_shard_application(
+    index: int, count: int, socket_dir: str, builder: Optional[ApplicationBuilder] = None
+) -> Application:
+    """
+    Membangun Application untuk worker `index`: handler sama dengan `main()`, tanpa updater
+    (update datang dari router), dengan database dan port metrics sendiri.
+    Hanya dipanggil sekali per proses, karena mengubah DATABASE_FILE dan METRICS_PORT.
+    """
+    global DATABASE_FILE, METRICS_PORT
+    DATABASE_FILE = shard_database_file(DATABASE_FILE, index)
+    if METRICS_PORT:
+        METRICS_PORT += 1 + index
+    if builder is None:
+        builder = Application.builder().token(os.getenv("TELEGRAM_TOKEN", ""))
+    application = (
+        builder.updater(None)
+        .concurrent_updates(PerUserUpdateProcessor())
+        .persistence(SQLitePersistence())
+        .build()
+    )
+    register_handlers(application)
+    # Harus ada sebelum post_init agar SwipeBuffer dan ActivityTracker ikut meneruskan data ke shard lain.
+    application.bot_data["shards"] = ShardPeers(index, count, socket_dir)
+    application.bot_data["shard_stats"] = {"updates": 0, "duplicate_updates": 0, "profiles": 0, "remote_likes": 0}
+    application.bot_data["shard_update_ids"] = OrderedDict()
+    return application
+
+
+async def run_shard_worker(
+    application: Application, socket_dir: str, ready: Optional[Callable[[Application], None]] = None
+) -> None:
+    """Menjalankan satu worker sampai menerima SIGINT/SIGTERM."""
+    peers: ShardPeers = application.bot_data["shards"]
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await application.initialize()
+    await post_init(application)
+    if ready is not None:
+        ready(application)
+    await application.start()
+    peers.start()
+    server = ShardServer(application, shard_socket_path(socket_dir, peers.index))
+    await server.start()
+    await resend_undelivered(application)
+    resync = asyncio.create_task(resync_profiles(application))
+    logger.info(f"Shard worker {peers.index}/{peers.count} is running on {DATABASE_FILE}.")
+    try:
+        await stop.wait()
+    finally:
+        resync.cancel()
+        await application.stop()
+        # Server tetap menerima pesan selama like ke shard lain menunggu balasan, karena shard
+        # lain juga sedang berhenti dan menunggu balasan dari shard ini.
+        await peers.flush(SHARD_ACK_TIMEOUT_SECONDS)
+        await server.close()
+        await save_undelivered(application.bot_data["pool"], await peers.close())
+        await post_shutdown(application)
+        await application.shutdown()
+
+
+class ShardRouter:
+    """
+    Meneruskan setiap update ke worker pemilik pengguna; update dari satu pengguna tetap berurutan.
+
+    Update dikirim lewat ShardLink.deliver_wait: disimpan sampai worker membalas (update sudah
+    masuk antreannya) dan dikirim ulang setelah koneksi ke worker tersambung lagi, misal karena
+    worker restart. Worker mengabaikan update_id yang sudah diterima. Jika antrean ke worker
+    penuh, `dispatch` menunggu alih-alih membuang update. Update yang belum dibalas saat router
+    berhenti dicatat di log dan di `lost_updates`.
+    """
+
+    def __init__(self, count: int, socket_dir: str):
+        self.count = count
+        self.socket_dir = socket_dir
+        self._links = [ShardLink(shard_socket_path(socket_dir, shard)) for shard in range(count)]
+        self.lost_updates = 0
+
+    async def start(self) -> None:
+        await wait_for_sockets(link.path for link in self._links)
+        for link in self._links:
+            link.start()
+
+    async def dispatch(self, update: Update) -> int:
+        """Mengirim update ke shard-nya. Update tanpa pengguna maupun chat dikirim ke shard 0."""
+        key = PerUserUpdateProcessor._ordering_key(update)
+        shard = key % self.count if key is not None else 0
+        await self._links[shard].deliver_wait({"op": "update", "update": update.to_dict()})
+        return shard
+
+    async def drain(self) -> List[Dict[str, Any]]:
+        """Menunggu semua worker selesai memproses update yang sudah dikirim."""
+        return await asyncio.gather(*(link.call({"op": "drain"}) for link in self._links))
+
+    def stats(self) -> Dict[str, int]:
+        stats = {f"shard{shard}_sent": link.stats["sent"] for shard, link in enumerate(self._links)}
+        stats["unacked_updates"] = sum(len(link.unacked()) for link in self._links)
+        stats["lost_updates"] = self.lost_updates
+        return stats
+
+    async def close(self, timeout: float = SHARD_ACK_TIMEOUT_SECONDS) -> None:
+        """Menunggu update yang sudah dikirim dibalas (paling lama `timeout`), lalu menutup koneksi."""
+        waits = [asyncio.create_task(wait()) for link in self._links for wait in (link.flush, link.wait_acked)]
+        await asyncio.wait(waits, timeout=timeout)
+        for task in waits:
+            task.cancel()
+        for shard, link in enumerate(self._links):
+            lost = len(link.unacked())
+            if lost:
+                self.lost_updates += lost
+                logger.error(f"{lost} updates for shard {shard} were not acknowledged before shutdown and are lost.")
+            await link.close()
+
+
+async def route_update(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    await context.bot_data["router"].dispatch(update)
+
+
+def start_shard_workers(count: int, socket_dir: str) -> List[subprocess.Popen]:
+    """Menjalankan `count` proses worker dengan environment yang sama dengan router."""
+    script = os.path.abspath(__file__)
+    return [
+        subprocess.Popen(
+            [sys.executable, script, "shard-worker", "--index", str(index), "--shards", str(count), "--socket-dir", socket_dir]
+        )
+        for index in range(count)
+    ]
+
+
+def stop_shard_workers(workers: List[subprocess.Popen], timeout: float = SHARD_CONNECT_TIMEOUT_SECONDS) -> None:
+    for worker in workers:
+        worker.terminate()
+    for worker in workers:
+        try:
+            worker.wait(timeout)
+        except subprocess.TimeoutExpired:
+            worker.kill()
+
+
+def run_sharded(token: str, count: int = SHARD_COUNT, socket_dir: str = SHARD_SOCKET_DIR) -> None:
+    """Menjalankan router di proses ini dan `count` worker sebagai proses anak."""
+    os.makedirs(socket_dir, exist_ok=True)
+    workers = start_shard_workers(count, socket_dir)
+    router = ShardRouter(count, socket_dir)
+
+    async def router_init(app: Application) -> None:
+        await router.start()
+        app.bot_data["router"] = router
+
+    async def router_shutdown(app: Application) -> None:
+        await router.close()
+        stop_shard_workers(workers)
+
+    application = Application.builder().token(token).post_init(router_init).post_shutdown(router_shutdown).build()
+    application.add_handler(TypeHandler(Update, route_update))
+    logger.info(f"Routing updates to {count} shard workers via {socket_dir}.")
+    try:
+        run_application(application)
+    finally:
+        # Jika router gagal start, post_shutdown tidak dipanggil; worker tetap harus dihentikan.
+        if any(worker.poll() is None for worker in workers):
+            stop_shard_workers(workers)
+
+
+# --- Fitur Matching ---
+
+async def find_match(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Mencari dan menampilkan calon pasangan."""
+    user_id = update.effective_user.id
+    decks: CandidateDeckManager = context.bot_data["decks"]
+    cards: ProfileCardCache = context.bot_data["cards"]
+    context.bot_data["activity"].touch(user_id)
+
+    # Mengambil kandidat berikutnya dari deck yang sudah diacak sebelumnya.
+    # Kandidat yang profilnya sudah tidak ada dibuang dan diganti dengan kandidat berikutnya.
+    card = None
+    while card is None:
+        candidate_id = await decks.next_candidate(user_id)
+        if candidate_id is None:
+            break
+        card = await cards.get(candidate_id)
+        if card is None:
+            decks.discard_candidate(candidate_id)
+
+    # Dikirim lewat antrean pesan keluar (prioritas interaktif) dengan chat_id eksplisit,
+    # karena find_match juga dipanggil dari callback query yang tidak punya update.message.
+    outbox: MessageScheduler = context.bot_data["outbox"]
+    chat_id = update.effective_chat.id
+    if card:
+        context.user_data["potential_match_id"] = card.user_id
+        # Kandidat berikutnya disiapkan selagi kartu ini dikirim dan dilihat pengguna.
+        decks.prefetch(user_id)
+        await outbox.send(
+            context.bot.send_photo,
+            chat_id=chat_id,
+            photo=card.photo_id,
+            caption=card.caption,
+            parse_mode=ParseMode.HTML,
+            reply_markup=card.keyboard,
+        )
+        return MATCHING
+
+    else:
+        await outbox.send(
+            context.bot.send_message,
+            chat_id=chat_id,
+            text="Sepertinya sudah tidak ada calon pasangan lagi untuk saat ini. Coba lagi nanti! 😊",
+            reply_markup=main_menu_keyboard(),
+        )
+        return MENU
+
+
+def notify_match(bot_data: Dict[str, Any], bot: Any, user_id: int, match_id: int) -> None:
+    """Memberi tahu kedua pengguna bahwa mereka match."""
+    # Notifikasi dikirim di background agar handler tidak tertahan oleh rate limit Telegram.
+    for chat_id in (user_id, match_id):
+        bot_data["outbox"].notify(
+            bot.send_message,
+            chat_id=chat_id,
+            text=f"Selamat! Anda dan pengguna lain saling suka! 🎉 Kalian sekarang match!",
+        )
+
+
+async def match_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Menangani pilihan Suka/Tidak Suka dari Inline Keyboard."""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    swipes: SwipeBuffer = context.bot_data["swipes"]
+
+    # Parsing callback_data: "match_like_12345" atau "match_dislike_12345"
+    action, match_id_str = query.data.split("_")[1:]
+    match_id = int(match_id_str)
+
+    # Mencatat aksi swipe ke buffer; ditulis ke database oleh SwipeBuffer secara berkala.
+    # Kandidat baru dilepas dari deck setelah swipe tercatat agar pengisian ulang deck
+    # di background tidak sempat memasukkannya lagi.
+    is_new_swipe = await swipes.add(user_id, match_id, action)
+    context.bot_data["decks"].mark_seen(user_id, match_id)
+    # Jawaban callback, edit pesan lama, dan kartu berikutnya tidak saling bergantung,
+    # jadi ketiganya dikirim bersamaan; kartu berikutnya biasanya sudah di-prefetch.
+    if not is_new_swipe:
+        # Pengguna sudah pernah swipe orang ini, abaikan.
+        logger.warning(f"User {user_id} tried to swipe {match_id} again.")
+        return await _with_swipe_replies(
+            user_id,
+            find_match(update, context),  # Langsung cari yang baru
+            answer_query(context, query),
+            edit_query_text(context, query, "Anda sudah pernah berinteraksi dengan profil ini."),
+        )
+
+    # Mengedit pesan asli untuk menghilangkan tombol
+    original_caption = query.message.caption
+    if action == "like":
+        edit = edit_query_caption(context, query, f"{original_caption}\n\n--- (Anda menyukai profil ini ❤️) ---", parse_mode=ParseMode.HTML)
+        # Cek apakah ada mutual like lewat indeks like di memori (termasuk swipe yang masih di buffer)
+        if context.bot_data["likes"].has_liked(match_id, user_id):
+            notify_match(context.bot_data, context.bot, user_id, match_id)
+    else: # dislike
+        edit = edit_query_caption(context, query, f"{original_caption}\n\n--- (Anda melewati profil ini ❌) ---", parse_mode=ParseMode.HTML)
+
+    # Otomatis mencari pasangan berikutnya
+    return await _with_swipe_replies(user_id, find_match(update, context), answer_query(context, query), edit)
+
+
+async def _with_swipe_replies(user_id: int, next_card: Awaitable[int], *replies: Awaitable[Any]) -> int:
+    """
+    Menjalankan pengiriman kartu berikutnya bersamaan dengan jawaban callback dan edit kartu lama.
+    Gagalnya jawaban atau edit (misal pesan sudah terlalu lama untuk diedit) hanya dicatat,
+    agar kartu berikutnya tetap terkirim dan state percakapannya tetap dikembalikan.
+    """
+    *results, state = await asyncio.gather(*replies, next_card, return_exceptions=True)
+    for result in results:
+        if isinstance(result, TelegramError):
+            logger.warning(f"Could not update the swiped card of user {user_id}: {result}")
+        elif isinstance(result, BaseException):
+            raise result
+    if isinstance(state, BaseException):
+        raise state
+    return state
+
+
+# --- Daftar Match dan Like Masuk ---
+
+LIST_PAGE_SIZE = 10
+# Kunci awal untuk halaman pertama: lebih besar dari semua tanggal dan user_id yang mungkin.
+LIST_FIRST_CURSOR: Tuple[str, int] = ("9999-12-31 23:59:59", 2**63 - 1)
+
+# jenis daftar -> (judul, query halaman)
+PROFILE_LISTS: Dict[str, Tuple[str, str]] = {
+    "matches": ("💞 Match Anda", MATCHES_PAGE_SQL),
+    "likes": ("😍 Yang Menyukai Anda", LIKES_PAGE_SQL),
+}
+
+
+class ListPage(NamedTuple):
+    """Satu halaman daftar; baris berisi (tanggal, user_id, usia, hobi), terbaru lebih dulu."""
+
+    rows: List[Tuple[str, int, int, str]]
+    has_newer: bool
+    has_older: bool
+
+
+async def fetch_list_page(
+    db: aiosqlite.Connection,
+    kind: str,
+    user_id: int,
+    cursor: Optional[Tuple[str, int]] = None,
+    older: bool = True,
+    limit: int = LIST_PAGE_SIZE,
+) -> ListPage:
+    """
+    Mengambil satu halaman daftar `kind` mulai dari `cursor` (tanggal, user_id).
+
+    Halaman yang lebih lama dibaca menurun dari cursor, halaman yang lebih baru dibaca
+    naik lalu dibalik. Satu baris ekstra diambil untuk mengetahui apakah masih ada halaman
+    berikutnya ke arah yang sama, tanpa COUNT(*).
+    """
+    sql = PROFILE_LISTS[kind][1].format(op="<" if older else ">", order="DESC" if older else "ASC")
+    date, last_id = cursor or LIST_FIRST_CURSOR
+    async with db.execute(sql, (user_id, date, last_id, limit + 1)) as db_cursor:
+        rows = await db_cursor.fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if older:
+        return ListPage(rows, has_newer=cursor is not None, has_older=more)
+    rows.reverse()
+    return ListPage(rows, has_newer=more, has_older=True)
+
+
+def render_list_page(
+    kind: str, page: ListPage, total: int, likes: "LikeIndex", user_id: int
+) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+    """Membuat teks HTML dan tombol navigasi untuk satu halaman daftar."""
+    title = PROFILE_LISTS[kind][0]
+    lines = [f"<b>{title}</b> ({total} orang)", ""]
+    for date, other_id, age, hobby in page.rows:
+        line = f"• {age} th, {html.escape(str(hobby))} <i>({str(date)[:10]})</i>"
+        if kind == "matches":
+            line += f' — <a href="tg://user?id={other_id}">Kirim pesan</a>'
+        elif likes.has_liked(user_id, other_id):
+            line += " 💞"
+        lines.append(line)
+    if not page.rows:
+        lines.append("Belum ada siapa-siapa di sini." if not page.has_newer else "Tidak ada lagi.")
+
+    # Cursor halaman berikutnya dibawa di callback_data (maksimal 64 byte).
+    buttons = []
+    if page.has_newer and page.rows:
+        date, other_id = page.rows[0][:2]
+        buttons.append(InlineKeyboardButton("⬅️ Lebih baru", callback_data=f"list_{kind}_n_{date}_{other_id}"))
+    if page.has_older and page.rows:
+        date, other_id = page.rows[-1][:2]
+        buttons.append(InlineKeyboardButton("Lebih lama ➡️", callback_data=f"list_{kind}_o_{date}_{other_id}"))
+    return "\n".join(lines), InlineKeyboardMarkup([buttons]) if buttons else None
+
+
+def list_total(kind: str, likes: "LikeIndex", user_id: int) -> int:
+    """Jumlah total dari agregat di LikeIndex, bukan COUNT(*) pada setiap tampilan."""
+    return likes.match_count(user_id) if kind == "matches" else likes.count(user_id)
+
+
+# --- Filter Pencarian ---
+
+# Sama dengan batas usia saat registrasi.
+FILTER_MIN_AGE = 18
+FILTER_MAX_AGE = 99
+GENDER_OPTIONS: Tuple[str, ...] = ("Pria", "Wanita")
+FILTER_KEYWORD_MAX_LENGTH = 64
+# Jumlah ember (gender, usia) yang dibaca dalam satu query saat mengisi deck dengan filter.
+FILTER_SAMPLE_BUCKETS = 16
+# Setiap titik acak pada pencarian kata kunci menjalankan MATCH FTS5 sendiri, jadi jumlahnya dibatasi.
+KEYWORD_SAMPLE_PIVOTS = 1
+# Kandidat pengguna dengan filter sudah disaring, jadi kumpulan yang diberi skor cukup DECK_SIZE
+# kali faktor ini (bukan RANK_POOL_FACTOR). Pada 100k profil, 400 kandidat dengan kata kunci +
+# usia + gender butuh ~2.6 ms; 100 kandidat ~0.5 ms untuk usia/gender, ~1.2 ms dengan kata kunci
+# + usia + gender, yang dibatasi pembacaan daftar dokumen FTS5 (lihat `loadtest.py --filter-benchmark`).
+FILTER_RANK_POOL_FACTOR = int(os.getenv("FILTER_RANK_POOL_FACTOR", "2"))
+# Batas baris kotak lokasi yang dibaca per pengisian deck dengan filter, sebagai kelipatan
+# jumlah kandidat. Di kota padat satu kotak sudah melebihinya, jadi cukup satu query.
+FILTER_NEARBY_ROWS_FACTOR = 2
+
+FILTER_USAGE = (
+    "Atur filter pencarian pasangan:\n"
+    "/filter usia 20-30 — rentang usia\n"
+    "/filter gender Pria|Wanita — gender kandidat\n"
+    "/filter hobi <kata kunci> — cari di hobi dan deskripsi\n"
+    "/filter <usia|gender|hobi> off — mematikan satu filter\n"
+    "/filter reset — mematikan semua filter"
+)
+
+
+class MatchFilters(NamedTuple):
+    """Filter kandidat milik satu pengguna; nilai bawaan berarti tidak ada filter."""
+
+    min_age: int = FILTER_MIN_AGE
+    max_age: int = FILTER_MAX_AGE
+    gender: Optional[str] = None
+    keyword: Optional[str] = None
+
+    @classmethod
+    def from_row(cls, row: Tuple[Any, ...]) -> "MatchFilters":
+        """Membuat filter dari kolom (min_age, max_age, gender, keyword) tabel 'user_filters'."""
+        min_age, max_age, gender, keyword = row
+        return cls(min_age or FILTER_MIN_AGE, max_age or FILTER_MAX_AGE, gender or None, keyword or None)
+
+    @property
+    def active(self) -> bool:
+        return self != MatchFilters()
+
+    def describe(self) -> str:
+        if not self.active:
+            return "Tidak ada filter aktif."
+        return "\n".join([
+            f"Usia: {self.min_age}-{self.max_age}",
+            f"Gender: {self.gender or 'semua'}",
+            f"Kata kunci: {self.keyword or '-'}",
+        ])
+
+
+def fts_query(keyword: str) -> Optional[str]:
+    """
+    Mengubah kata kunci bebas menjadi query FTS5 yang aman: setiap kata dikutip dan
+    semua kata harus ada. Kata dicocokkan utuh, bukan sebagai awalan, karena query awalan
+    harus menggabungkan daftar dokumen semua token yang cocok sebelum bisa melompat ke rowid.
+    Mengembalikan None jika tidak ada kata yang bisa dicari.
+    """
+    tokens = re.findall(r"\w+", keyword.lower())
+    return " ".join(f'"{token}"' for token in tokens) or None
+
+
+def fold_text(text: str) -> str:
+    """Teks dikecilkan dan tanpa diakritik, seperti tokenizer indeks FTS5 (remove_diacritics)."""
+    text = text.lower()
+    if text.isascii():
+        return text
+    return "".join(char for char in unicodedata.normalize("NFKD", text) if not unicodedata.combining(char))
+
+
+def keyword_tokens(text: str) -> List[str]:
+    return re.findall(r"\w+", fold_text(text))
+
+
+def matches_keyword(words: List[str], hobby: Optional[str], description: Optional[str]) -> bool:
+    """Sama dengan MATCH fts_query(keyword) pada hobi dan deskripsi: semua kata harus ada utuh."""
+    text = fold_text(f"{hobby or ''} {description or ''}")
+    # Cek substring yang murah lebih dulu; sebagian besar baris sudah gugur di sini.
+    if not all(word in text for word in words):
+        return False
+    found = set(re.findall(r"\w+", text))
+    return all(word in found for word in words)
+
+
+async def load_filters(db: aiosqlite.Connection, user_id: int) -> MatchFilters:
+    async with db.execute(
+        "SELECT min_age, max_age, gender, keyword FROM user_filters WHERE user_id = ?", (user_id,)
+    ) as cursor:
+        row = await cursor.fetchone()
+    return MatchFilters.from_row(row) if row is not None else MatchFilters()
+
+
+async def save_filters(db: aiosqlite.Connection, user_id: int, match_filters: MatchFilters) -> None:
+    """Menyimpan filter; rekomendasi precompute milik pengguna dibuang karena dihitung tanpa filter ini."""
+    if match_filters.active:
+        await db.execute(
+            "INSERT OR REPLACE INTO user_filters (user_id, min_age, max_age, gender, keyword) VALUES (?, ?, ?, ?, ?)",
+            (user_id, *match_filters),
+        )
+    else:
+        await db.execute("DELETE FROM user_filters WHERE user_id = ?", (user_id,))
+    await db.execute("DELETE FROM recommendations WHERE user_id = ?", (user_id,))
+    await db.commit()
+
+
+def parse_filter_args(args: List[str], current: MatchFilters, search_enabled: bool) -> Tuple[Optional[MatchFilters], str]:
+    """Menerapkan argumen /filter ke filter saat ini. Mengembalikan (filter baru atau None, pesan)."""
+    field = args[0].lower()
+    value = " ".join(args[1:]).strip()
+    if field == "reset":
+        return MatchFilters(), "Semua filter dimatikan."
+    if not value:
+        return None, FILTER_USAGE
+    off = value.lower() == "off"
+
+    if field == "usia":
+        if off:
+            return current._replace(min_age=FILTER_MIN_AGE, max_age=FILTER_MAX_AGE), "Filter usia dimatikan."
+        bounds = [int(number) for number in re.findall(r"\d+", value)]
+        if len(bounds) != 2 or not FILTER_MIN_AGE <= bounds[0] <= bounds[1] <= FILTER_MAX_AGE:
+            return None, f"Rentang usia tidak valid. Contoh: /filter usia 20-30 (antara {FILTER_MIN_AGE}-{FILTER_MAX_AGE})."
+        return current._replace(min_age=bounds[0], max_age=bounds[1]), "Filter usia disimpan."
+
+    if field == "gender":
+        if off:
+            return current._replace(gender=None), "Filter gender dimatikan."
+        gender = next((option for option in GENDER_OPTIONS if option.lower() == value.lower()), None)
+        if gender is None:
+            return None, f"Gender tidak valid. Pilih salah satu: {', '.join(GENDER_OPTIONS)}."
+        return current._replace(gender=gender), "Filter gender disimpan."
+
+    if field == "hobi":
+        if off:
+            return current._replace(keyword=None), "Filter kata kunci dimatikan."
+        if not search_enabled:
+            return None, "Maaf, pencarian kata kunci sedang tidak tersedia."
+        if len(value) > FILTER_KEYWORD_MAX_LENGTH or fts_query(value) is None:
+            return None, f"Kata kunci harus berisi huruf atau angka (maksimal {FILTER_KEYWORD_MAX_LENGTH} karakter)."
+        return current._replace(keyword=value), "Filter kata kunci disimpan."
+    return None, FILTER_USAGE
+
+
+async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Perintah /filter: menampilkan atau mengubah filter pencarian pasangan."""
+    user_id = update.effective_user.id
+    decks: CandidateDeckManager = context.bot_data["decks"]
+    async with context.bot_data["pool"].read() as db:
+        current = await load_filters(db, user_id)
+    if not context.args:
+        await reply(update, context, f"{current.describe()}\n\n{FILTER_USAGE}")
+        return
+
+    new_filters, message = parse_filter_args(context.args, current, decks.search_enabled)
+    if new_filters is None:
+        await reply(update, context, message)
+        return
+    async with context.bot_data["pool"].write() as db:
+        await save_filters(db, user_id, new_filters)
+    # Deck lama disusun dengan filter sebelumnya.
+    decks.reset(user_id)
+    await reply(update, context, f"{message}\n\n{new_filters.describe()}")
+
+
+# Handler daftar mengembalikan None agar state percakapan tidak berubah: daftar bisa
+# dibuka dari menu maupun di tengah matching tanpa membatalkan kartu yang sedang tampil.
+
+async def show_list(update: Update, context: ContextTypes.DEFAULT_TYPE, kind: str) -> None:
+    """Menampilkan halaman pertama daftar match atau like masuk."""
+    user_id = update.effective_user.id
+    likes: LikeIndex = context.bot_data["likes"]
+    # Like atau match yang masih di buffer ditulis dulu agar yang baru saja diberitahukan ikut tampil.
+    swipes: SwipeBuffer = context.bot_data["swipes"]
+    if swipes.has_pending_for(user_id):
+        await swipes.flush()
+    async with context.bot_data["pool"].read() as db:
+        page = await fetch_list_page(db, kind, user_id)
+    text, keyboard = render_list_page(kind, page, list_total(kind, likes, user_id), likes, user_id)
+    await reply(update, context, text, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+
+async def show_matches(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Menampilkan daftar match pengguna."""
+    return await show_list(update, context, "matches")
+
+
+async def show_likes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Menampilkan daftar pengguna yang menyukai pengguna ini."""
+    return await show_list(update, context, "likes")
+
+
+async def list_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Menangani tombol navigasi halaman, misal "list_likes_o_2025-01-31 10:00:00_12345"."""
+    query = update.callback_query
+    user_id = update.effective_user.id
+    likes: LikeIndex = context.bot_data["likes"]
+
+    _, kind, direction, date, last_id = query.data.split("_", 4)
+    async with context.bot_data["pool"].read() as db:
+        page = await fetch_list_page(db, kind, user_id, (date, int(last_id)), older=direction == "o")
+    text, keyboard = render_list_page(kind, page, list_total(kind, likes, user_id), likes, user_id)
+    await asyncio.gather(
+        answer_query(context, query),
+        edit_query_text(context, query, text, parse_mode=ParseMode.HTML, reply_markup=keyboard),
+    )
+
+
+# --- Fitur Edit Profil ---
+
+def edit_profile_keyboard() -> InlineKeyboardMarkup:
+    """Membuat keyboard untuk menu edit profil."""
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton("Ubah Deskripsi", callback_data="edit_description")],
+        [InlineKeyboardButton("Ubah Hobi", callback_data="edit_hobby")],
+        [InlineKeyboardButton("Kembali ke Menu", callback_data="edit_cancel")]
+    ])
+
+async def edit_profile_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Menangani pilihan dari menu edit profil."""
+    query = update.callback_query
+    await answer_query(context, query)
+
+    choice = query.data.split('_')[1] # "description", "hobby", atau "cancel"
+    
+    if choice == "description":
+        await reply(update, context, "Silakan kirim deskripsi baru Anda.")
+        return DESCRIPTION # Menggunakan kembali state dari registrasi
+    elif choice == "hobby":
+        await reply(update, context, "Silakan kirim hobi baru Anda.")
+        return HOBBY # Menggunakan kembali state dari registrasi
+    elif choice == "cancel":
+        await edit_query_text(context, query, "Edit dibatalkan.", reply_markup=None)
+        await reply(update, context, "Anda kembali di menu utama.", reply_markup=main_menu_keyboard())
+        return MENU
+    return EDIT_PROFILE
+
+async def save_new_description(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Menyimpan deskripsi profil yang baru."""
+    user_id = update.effective_user.id
+    new_description = update.message.text
+
+    async with context.bot_data["pool"].write() as db:
+        await db.execute("UPDATE users SET description = ? WHERE user_id = ?", (new_description, user_id))
+        await db.commit()
+    # Kartu profil lama harus dibuang agar tidak ada yang melihat versi sebelum diedit.
+    context.bot_data["cards"].invalidate(user_id)
+    await publish_profile(context.bot_data, user_id)
+
+    await reply(update, context, "Deskripsi profil Anda telah berhasil diperbarui!", reply_markup=main_menu_keyboard())
+    return MENU
+
+async def save_new_hobby(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Menyimpan hobi yang baru."""
+    user_id = update.effective_user.id
+    new_hobby = update.message.text
+
+    async with context.bot_data["pool"].write() as db:
+        await db.execute("UPDATE users SET hobby = ? WHERE user_id = ?", (new_hobby, user_id))
+        await db.commit()
+    # Kartu profil lama harus dibuang agar tidak ada yang melihat versi sebelum diedit.
+    context.bot_data["cards"].invalidate(user_id)
+    await publish_profile(context.bot_data, user_id)
+
+    await reply(update, context, "Hobi Anda telah berhasil diperbarui!", reply_markup=main_menu_keyboard())
+    return MENU
+
+
+# --- Fungsi Umum dan Fallback ---
+
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Membatalkan proses saat ini (misal: registrasi) dan kembali ke awal."""
+    await reply(
+        update,
+        context,
+        "Proses dibatalkan. Ketik /start untuk memulai lagi.",
+        reply_markup=ReplyKeyboardRemove(),
+    )
+    context.user_data.clear()
+    return ConversationHandler.END
+
+
+async def unknown_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Menangani perintah yang tidak dikenal."""
+    await reply(update, context, "Maaf, saya tidak mengerti perintah itu. Coba /start.")
+
+
+async def metrics_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Perintah admin /metrics: mengirim metrics terkini sebagai file teks Prometheus."""
+    if update.effective_user.id not in ADMIN_USER_IDS:
+        await unknown_command(update, context)
+        return
+    if context.bot_data.get("metrics") is None:
+        await reply(update, context, "Metrics tidak aktif. Atur METRICS_ENABLED=1 lalu jalankan ulang bot.")
+        return
+    await context.bot_data["outbox"].send(
+        context.bot.send_document,
+        chat_id=update.effective_chat.id,
+        document=render_metrics(context.application).encode(),
+        filename="metrics.txt",
+    )
+
+
+# --- Impor dan Ekspor Massal ---
+
+# Kolom yang boleh diimpor/diekspor per tabel, dan kolom yang wajib ada saat impor.
+BULK_TABLES: Dict[str, Tuple[str, ...]] = {
+    "users": (
+        "user_id", "gender", "age", "hobby", "latitude", "longitude",
+        "photo_id", "description", "registration_date", "last_active",
+    ),
+    "swipes": ("swiper_id", "swiped_id", "action", "swipe_date"),
+}
+BULK_REQUIRED_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "users": ("user_id",),
+    "swipes": ("swiper_id", "swiped_id", "action"),
+}
+# Baris per executemany/fetchmany, dan baris per transaksi saat impor.
+BULK_CHUNK_ROWS = 50_000
+BULK_COMMIT_ROWS = 1_000_000
+# Jeda minimum antar log progres (detik).
+BULK_PROGRESS_INTERVAL = 2.0
+
+
+class BulkProgress:
+    """Mencatat progres impor/ekspor (jumlah baris dan baris per detik) ke log."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self.rows = 0
+        self.started = time.perf_counter()
+        self._last_report = self.started
+
+    def update(self, rows: int) -> None:
+        self.rows += rows
+        now = time.perf_counter()
+        if now - self._last_report >= BULK_PROGRESS_INTERVAL:
+            self._last_report = now
+            logger.info(f"{self.label}: {self.rows} rows ({self.rows / (now - self.started):.0f} rows/s)")
+
+    def finish(self) -> None:
+        elapsed = time.perf_counter() - self.started
+        rate = self.rows / elapsed if elapsed else 0.0
+        logger.info(f"{self.label}: done, {self.rows} rows in {elapsed:.1f}s ({rate:.0f} rows/s)")
+
+
+def _bulk_format(path: str, fmt: Optional[str]) -> str:
+    if fmt:
+        return fmt
+    return "csv" if path.lower().endswith(".csv") else "jsonl"
+
+
+def _read_bulk_rows(file, fmt: str, table: str) -> Tuple[List[str], Iterable[Tuple[Any, ...]]]:
+    """
+    Membaca header (kolom) lalu mengembalikan generator baris sebagai tuple.
+    Untuk JSONL, kolom diambil dari record pertama; nilai kosong di CSV menjadi NULL.
+    """
+    if fmt == "csv":
+        reader = csv.reader(file)
+        columns = next(reader, [])
+        rows: Iterable[Tuple[Any, ...]] = (tuple(value if value != "" else None for value in row) for row in reader)
+    else:
+        lines = (line for line in file if line.strip())
+        first = next(lines, None)
+        columns = list(json.loads(first)) if first else []
+
+        def parse(line_no: int, line: str) -> Tuple[Any, ...]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Record {line_no}: invalid JSON ({e})") from e
+            if record.keys() - known:
+                raise ValueError(f"Record {line_no}: unexpected columns {sorted(record.keys() - known)}")
+            return tuple(record.get(column) for column in columns)
+
+        known = set(columns)
+        rows = (parse(line_no, line) for line_no, line in enumerate(itertools.chain([first] if first else [], lines), 1))
+
+    unknown = [column for column in columns if column not in BULK_TABLES[table]]
+    missing = [column for column in BULK_REQUIRED_COLUMNS[table] if column not in columns]
+    if unknown or missing:
+        raise ValueError(f"Invalid columns for {table}: unknown={unknown}, missing={missing}")
+    return columns, rows
+
+
+def _chunks(rows: Iterable[Tuple[Any, ...]], size: int) -> Iterable[List[Tuple[Any, ...]]]:
+    iterator = iter(rows)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+async def bulk_import(
+    table: str, path: str, fmt: Optional[str] = None, database: Optional[str] = None, shards: int = 1
+) -> int:
+    """
+    Mengimpor baris JSONL/CSV ke tabel 'users' atau 'swipes' secara streaming.
+
+    Indeks sekunder dan trigger tabel tujuan dihapus selama impor lalu dibuat ulang
+    sekali di akhir, sehingga setiap baris hanya menulis ke tabel dan PRIMARY KEY.
+    Baris yang sudah ada (PRIMARY KEY sama) dilewati. Bot sebaiknya tidak berjalan
+    selama impor karena cache di memori (like, seen-set) tidak ikut diperbarui.
+    Mengembalikan jumlah baris yang benar-benar ditambahkan.
+
+    Dengan `shards` > 1, file dibaca sekali per file shard (lihat shard_database_file):
+    profil masuk ke semua shard, swipe hanya ke shard yang memilikinya (SHARD_OWNED_ROWS).
+    """
+    fmt = _bulk_format(path, fmt)
+    database = database or DATABASE_FILE
+    if shards > 1:
+        inserted = 0
+        for index in range(shards):
+            inserted += await _import_file(table, path, fmt, shard_database_file(database, index), (index, shards))
+        return inserted
+    return await _import_file(table, path, fmt, database)
+
+
+def _owned_swipes(
+    columns: List[str], rows: Iterable[Tuple[Any, ...]], index: int, count: int
+) -> Iterable[Tuple[Any, ...]]:
+    """Sama dengan SHARD_OWNED_ROWS["swipes"]: swipe keluar pengguna shard ini dan like masuk untuknya."""
+    swiper, swiped, action = (columns.index(column) for column in ("swiper_id", "swiped_id", "action"))
+    for row in rows:
+        if int(row[swiper]) % count == index or (int(row[swiped]) % count == index and row[action] == "like"):
+            yield row
+
+
+async def _import_file(
+    table: str, path: str, fmt: str, database: str, shard: Optional[Tuple[int, int]] = None
+) -> int:
+    # File dibuka dan header-nya divalidasi sebelum database disentuh.
+    with open(path, newline="", encoding="utf-8") as file:
+        columns, rows = _read_bulk_rows(file, fmt, table)
+        if shard is not None and table == "swipes":
+            rows = _owned_swipes(columns, rows, *shard)
+        db = await aiosqlite.connect(database)
+        try:
+            return await _load_bulk_rows(db, table, columns, rows)
+        finally:
+            await db.close()
+
+
+async def _load_bulk_rows(
+    db: aiosqlite.Connection, table: str, columns: List[str], rows: Iterable[Tuple[Any, ...]]
+) -> int:
+    await db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    await db.execute("PRAGMA journal_mode=WAL")
+    await create_tables(db)
+    # Impor bisa diulang dari awal jika gagal, jadi fsync per commit tidak diperlukan.
+    await db.execute("PRAGMA synchronous=OFF")
+    await db.execute("PRAGMA cache_size=-262144")
+    await db.execute("PRAGMA temp_store=MEMORY")
+
+    async with db.execute(
+        "SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND type IN ('index', 'trigger') AND sql IS NOT NULL",
+        (table,),
+    ) as cursor:
+        deferred = await cursor.fetchall()
+    for kind, name, _ in deferred:
+        await db.execute(f"DROP {kind.upper()} IF EXISTS {name}")
+    await db.commit()
+
+    changes_before = db.total_changes
+    progress = BulkProgress(f"Import {table}")
+    sql = f"INSERT OR IGNORE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    pending: Optional[asyncio.Future] = None
+    try:
+        pending_rows = uncommitted = 0
+        # Chunk berikutnya di-parse selagi chunk sebelumnya ditulis oleh thread aiosqlite.
+        for chunk in _chunks(rows, BULK_CHUNK_ROWS):
+            if pending is not None:
+                await pending
+                progress.update(pending_rows)
+                uncommitted += pending_rows
+                if uncommitted >= BULK_COMMIT_ROWS:
+                    await db.commit()
+                    uncommitted = 0
+            pending = asyncio.ensure_future(db.executemany(sql, chunk))
+            pending_rows = len(chunk)
+        if pending is not None:
+            await pending
+            progress.update(pending_rows)
+        await db.commit()
+        progress.finish()
+    except BaseException:
+        # Batch yang sudah di-commit tetap ada; indeks dan trigger harus kembali seperti semula.
+        if pending is not None and not pending.done():
+            pending.cancel()
+        await db.rollback()
+        logger.error(f"Import {table} failed after {progress.rows} rows; restoring indexes and triggers.")
+        raise
+    finally:
+        inserted = db.total_changes - changes_before
+        logger.info(f"Rebuilding {len(deferred)} indexes and triggers on {table}...")
+        for _, _, create_sql in deferred:
+            await db.execute(create_sql)
+        # Data turunan yang biasanya diisi trigger atau SwipeBuffer.
+        if table == "users":
+            await setup_geo_index(db)
+            if await setup_search_index(db):
+                await db.execute("INSERT INTO users_fts (users_fts) VALUES ('rebuild')")
+        else:
+            await rebuild_seen_sets(db)
+            await db.execute(MATCHES_BACKFILL_SQL)
+        await db.commit()
+    logger.info(f"Imported {inserted} new {table} rows ({progress.rows - inserted} already existed).")
+    return inserted
+
+
+async def split_database(path: str, count: int) -> List[str]:
+    """
+    Membagi database mode satu proses menjadi `count` file shard, sekali sebelum bot pertama
+    kali dijalankan dengan SHARD_COUNT > 1 (bot harus berhenti). Setiap shard mendapat salinan
+    lengkap (VACUUM INTO), lalu baris milik shard lain dihapus (SHARD_OWNED_ROWS); profil
+    tetap ada di semua shard. File shard yang sudah ada tidak ditimpa.
+    Mengembalikan nama file shard.
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"Database {path} does not exist")
+    targets = [shard_database_file(path, index) for index in range(count)]
+    existing = [target for target in targets if os.path.exists(target)]
+    if existing:
+        raise ValueError(f"Shard files already exist: {', '.join(existing)}")
+    try:
+        db = await aiosqlite.connect(path)
+        try:
+            # Skema dinaikkan ke versi terbaru dulu agar semua shard mulai dari skema yang sama.
+            await create_tables(db)
+            await db.commit()
+            for target in targets:
+                await db.execute("VACUUM INTO ?", (target,))
+        finally:
+            await db.close()
+        for index, target in enumerate(targets):
+            db = await aiosqlite.connect(target)
+            try:
+                async with db.execute("SELECT name FROM sqlite_master WHERE type = 'table'") as cursor:
+                    tables = {row[0] for row in await cursor.fetchall()}
+                removed = 0
+                for table, owned in SHARD_OWNED_ROWS.items():
+                    if table in tables:
+                        cursor = await db.execute(
+                            f"DELETE FROM {table} WHERE NOT ({owned})", {"index": index, "count": count}
+                        )
+                        removed += cursor.rowcount
+                await db.commit()
+                await db.execute("PRAGMA incremental_vacuum")
+            finally:
+                await db.close()
+            logger.info(f"Wrote {target}: removed {removed} rows owned by other shards.")
+    except BaseException:
+        # Split yang gagal di tengah jalan tidak boleh meninggalkan file shard setengah jadi.
+        for target in targets:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(target + suffix):
+                    os.unlink(target + suffix)
+        raise
+    return targets
+
+
+async def bulk_export(table: str, path: str, fmt: Optional[str] = None, database: Optional[str] = None) -> int:
+    """Mengekspor tabel 'users' atau 'swipes' ke JSONL/CSV secara streaming (memori konstan)."""
+    fmt = _bulk_format(path, fmt)
+    columns = BULK_TABLES[table]
+    db = await aiosqlite.connect(database or DATABASE_FILE)
+    file = sys.stdout if path == "-" else open(path, "w", newline="", encoding="utf-8")
+    progress = BulkProgress(f"Export {table}")
+    try:
+        writer = csv.writer(file) if fmt == "csv" else None
+        if writer is not None:
+            writer.writerow(columns)
+        # Urutan rowid membaca tabel secara berurutan tanpa lompatan lewat indeks.
+        async with db.execute(f"SELECT {', '.join(columns)} FROM {table} ORDER BY rowid") as cursor:
+            while True:
+                rows = await cursor.fetchmany(BULK_CHUNK_ROWS)
+                if not rows:
+                    break
+                if writer is not None:
+                    writer.writerows(("" if value is None else value for value in row) for row in rows)
+                else:
+                    file.writelines(
+                        json.dumps(dict(zip(columns, row)), ensure_ascii=False) + "\n" for row in rows
+                    )
+                progress.update(len(rows))
+        progress.finish()
+        return progress.rows
+    finally:
+        if file is not sys.stdout:
+            file.close()
+        await db.close()
+
+
+def build_conversation_handler(persistence: Optional[SQLitePersistence] = None) -> ConversationHandler:
+    """Membangun ConversationHandler utama (registrasi, menu, matching, dan edit profil)."""
+    # ConversationHandler terpisah untuk proses edit, agar lebih modular
+    edit_conv_handler = ConversationHandler(
+        entry_points=[CallbackQueryHandler(edit_profile_choice, pattern="^edit_")],
+        states={
+            DESCRIPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_description)],
+            HOBBY: [MessageHandler(filters.TEXT & ~filters.COMMAND, save_new_hobby)],
+        },
+        fallbacks=[CallbackQueryHandler(lambda u,c: MENU, pattern="^edit_cancel")],
+        map_to_parent={
+            MENU: MENU,
+            ConversationHandler.END: MENU
+        },
+        name="edit_profile",
+        persistent=True,
     )
 
+    # Daftar match dan like masuk bisa dibuka dari menu maupun selama matching. Setiap state
+    # mendapat objek handler sendiri agar instrumentasi metrik tidak membungkusnya dua kali.
+    def list_handlers() -> List[BaseHandler]:
+        return [
+            MessageHandler(filters.Regex("^(Match Saya 💞)$"), show_matches),
+            MessageHandler(filters.Regex("^(Yang Menyukai Saya 😍)$"), show_likes),
+            CallbackQueryHandler(list_page, pattern="^list_"),
+        ]
+
+    def resume_state(update: Update) -> int:
+        # Tombol kartu kandidat hanya ditangani di MATCHING; update lain dimulai dari menu.
+        query = update.callback_query
+        return MATCHING if query is not None and (query.data or "").startswith("match_") else MENU
+
     # Gabungan handler utama
-    main_conv_handler = ConversationHandler(
+    return ResumingConversationHandler(
         entry_points=[CommandHandler("start", start)],
         states={
             GENDER: [MessageHandler(filters.Regex("^(Pria|Wanita)$"), gender)],
@@ -527,22 +5552,134 @@ def main() -> None:
             MENU: [
                 MessageHandler(filters.Regex("^(Cari Pasangan 💘)$"), find_match),
                 MessageHandler(filters.Regex("^(Profil Saya 👤)$"), my_profile),
+                *list_handlers(),
                 edit_conv_handler, # Nested conversation untuk edit
             ],
-            MATCHING: [CallbackQueryHandler(match_choice, pattern="^match_")],
+            MATCHING: [CallbackQueryHandler(match_choice, pattern="^match_"), *list_handlers()],
         },
         fallbacks=[CommandHandler("cancel", cancel)],
+        # State disimpan oleh SQLitePersistence agar bertahan saat bot di-restart; MENU dan
+        # MATCHING dipulihkan lewat resume_state.
+        name="main",
+        persistent=True,
+        persistence=persistence,
+        resume_state=resume_state,
+    )
+
+
+def register_handlers(application: Application) -> None:
+    """Mendaftarkan semua handler ke aplikasi. Dipakai oleh main() dan load test."""
+    handlers = [
+        build_conversation_handler(application.persistence if isinstance(application.persistence, SQLitePersistence) else None),
+        CommandHandler("metrics", metrics_command),
+        CommandHandler("filter", filter_command),
+        MessageHandler(filters.COMMAND, unknown_command),
+    ]
+    if METRICS_ENABLED:
+        metrics = application.bot_data["metrics"] = MetricsRegistry()
+        for handler in handlers:
+            instrument_handler(handler, metrics)
+    # Pembatasan per pengguna berjalan lebih dulu (grup -1) dan bisa menghentikan update.
+    application.bot_data["admission"] = AdmissionController()
+    application.add_handler(TypeHandler(Update, admission_check), group=-1)
+    for handler in handlers:
+        application.add_handler(handler)
+
+
+def main() -> None:
+    """Fungsi utama untuk menjalankan bot."""
+    # Mengambil token dari environment variable. Lebih aman daripada hardcoding.
+    token = os.getenv("TELEGRAM_TOKEN", "GANTI_DENGAN_TOKEN_BOT_ANDA")
+    if token == "GANTI_DENGAN_TOKEN_BOT_ANDA":
+        logger.error("TELEGRAM_TOKEN tidak diatur. Mohon atur environment variable atau ganti di dalam kode.")
+        return
+    if SHARD_COUNT > 1:
+        run_sharded(token)
+        return
+
+    # Menggunakan Application.builder() untuk membuat aplikasi bot.
+    application = (
+        Application.builder()
+        .token(token)
+        .concurrent_updates(PerUserUpdateProcessor()) # Paralel antar pengguna, berurutan per pengguna
+        .persistence(SQLitePersistence()) # State percakapan dan user_data bertahan saat restart
+        .post_init(post_init) # Menjalankan setup DB dan antrean pesan saat bot mulai
+        .post_shutdown(post_shutdown) # Menutup antrean pesan dan koneksi DB saat bot berhenti
+        .build()
     )
 
+    register_handlers(application)
+    run_application(application)
 
-    application.add_handler(main_conv_handler)
-    application.add_handler(MessageHandler(filters.COMMAND, unknown_command))
 
-    # Menjalankan bot
-    logger.info("Bot is running...")
-    application.run_polling()
+def run_application(application: Application) -> None:
+    """Menjalankan bot dalam mode webhook jika WEBHOOK_URL diatur, selain itu polling."""
+    if WEBHOOK_URL:
+        logger.info(f"Bot is running in webhook mode on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}...")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=urllib.parse.urlparse(WEBHOOK_URL).path.lstrip("/"),
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        logger.info("Bot is running...")
+        application.run_polling()
+
+
+def cli(argv: Optional[List[str]] = None) -> None:
+    """Titik masuk command line: menjalankan bot (default) atau impor/ekspor massal."""
+    parser = argparse.ArgumentParser(description="Bot kencan Telegram.")
+    commands = parser.add_subparsers(dest="command")
+    commands.add_parser("run", help="Menjalankan bot (default).")
+    plans = commands.add_parser(
+        "check-plans", help="Memeriksa rencana query yang sering dipakai; gagal jika ada full scan."
+    )
+    plans.add_argument("--database", default=DATABASE_FILE, help="File database SQLite.")
+    worker = commands.add_parser("shard-worker", help="Menjalankan satu worker shard (dijalankan oleh router).")
+    worker.add_argument("--index", type=int, required=True)
+    worker.add_argument("--shards", type=int, required=True)
+    worker.add_argument("--socket-dir", default=SHARD_SOCKET_DIR)
+    split = commands.add_parser("shard-split", help="Membagi database satu proses menjadi file per shard.")
+    split.add_argument("--database", default=DATABASE_FILE, help="File database SQLite yang dibagi.")
+    split.add_argument("--shards", type=int, default=SHARD_COUNT, help="Jumlah shard (default: SHARD_COUNT).")
+    for name, help_text in (("import", "Mengimpor JSONL/CSV ke database."), ("export", "Mengekspor tabel ke JSONL/CSV.")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("table", choices=sorted(BULK_TABLES))
+        command.add_argument("path", help="File JSONL/CSV ('-' untuk stdout saat ekspor).")
+        command.add_argument("--format", choices=("jsonl", "csv"), help="Default: dari ekstensi file.")
+        command.add_argument("--database", default=DATABASE_FILE, help="File database SQLite.")
+        if name == "import":
+            command.add_argument(
+                "--shards", type=int, default=SHARD_COUNT, help="Impor ke file per shard (default: SHARD_COUNT)."
+            )
+    args = parser.parse_args(argv)
+
+    if args.command == "check-plans":
+        if not asyncio.run(check_plans_command(args.database)):
+            sys.exit(1)
+    elif args.command == "shard-worker":
+        application = build_shard_application(args.index, args.shards, args.socket_dir)
+        asyncio.run(run_shard_worker(application, args.socket_dir))
+    elif args.command == "shard-split":
+        if args.shards < 2:
+            parser.error("shard-split needs --shards of at least 2")
+        try:
+            asyncio.run(split_database(args.database, args.shards))
+        except (OSError, ValueError, aiosqlite.Error) as e:
+            logger.error(f"Splitting {args.database} failed: {e}")
+            sys.exit(1)
+    elif args.command in ("import", "export"):
+        bulk = functools.partial(bulk_import, shards=args.shards) if args.command == "import" else bulk_export
+        try:
+            asyncio.run(bulk(args.table, args.path, args.format, args.database))
+        except (OSError, ValueError, aiosqlite.Error) as e:
+            logger.error(f"{args.command.capitalize()} of {args.table} failed: {e}")
+            sys.exit(1)
+    else:
+        main()
 
 
 if __name__ == "__main__":
-    main()
-�
+    cli()